@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+
+import os
+import gzip
+import json
+import time
+import shutil
+import platform
+import resource
+import argparse
+import tempfile
+import tracemalloc
+from datetime import datetime, timedelta
+import numpy as np
+import gnss_ir_util as src
+import rinex3_stream
+import rinex_header_index
+import rinex3_snr
+import sat_geometry
+import reflector_height
+import result_store
+import tidal_analysis
+
+# ---- Defaults ----
+REGISTRY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "stations.json")
+REPORT_PATH = "benchmark_report.json"
+START_DAY = datetime(2024, 5, 20)
+EARTH_ROTATION = 7.2921151467e-5        # rad/s
+SNR_NOISE = 0.2                         # dB-Hz
+TIDE = {"M2": (1.0, 40.0), "K1": (0.3, 120.0)}    # Synthetic tide: amplitude [m], phase [deg]
+# ------------------
+
+# Synthetic constellations: (number of planes, satellites per plane, inclination [deg], radius [m], period [s])
+CONSTELLATIONS = {"G": (6, 4, 55.0, 26560e3, 43082.0), "E": (3, 6, 56.0, 29600e3, 50680.0)}
+# Observation types per system and the carrier frequency of each SNR observation
+OBS_TYPES = {"G": ["C1C", "S1C", "S2L"], "E": ["C1X", "S1X", "S5Q"]}
+CARRIERS = {"S1C": 1575.42e6, "S2L": 1227.60e6, "S1X": 1575.42e6, "S5Q": 1176.45e6}
+
+
+def satellite_xyz(sat, seconds):
+    """
+    ECEF positions (len(seconds), 3) of a satellite of the synthetic constellations on a circular orbit.
+    """
+    n_planes, per_plane, inclination, radius, period = CONSTELLATIONS[sat[0]]
+    number = int(sat[1:]) - 1
+    raan = 2 * np.pi * (number % n_planes) / n_planes
+    u = 2 * np.pi * (seconds / period + (number // n_planes) / per_plane + (number % n_planes) / (n_planes * per_plane))
+    inclination = np.radians(inclination)
+    x = radius * (np.cos(u) * np.cos(raan) - np.sin(u) * np.cos(inclination) * np.sin(raan))
+    y = radius * (np.cos(u) * np.sin(raan) + np.sin(u) * np.cos(inclination) * np.cos(raan))
+    z = radius * np.sin(u) * np.sin(inclination)
+    theta = EARTH_ROTATION * seconds
+    return np.stack([x * np.cos(theta) + y * np.sin(theta), -x * np.sin(theta) + y * np.cos(theta), z], axis=-1)
+
+def satellites():
+    return [f"{system}{i + 1:02d}" for system, c in CONSTELLATIONS.items() for i in range(c[0] * c[1])]
+
+def synthetic_tide(mjd):
+    # Water level [m] of the synthetic tide at MJD times
+    names = list(TIDE)
+    A = tidal_analysis.design_matrix(names, np.atleast_1d(mjd), 0.0)
+    amplitude = np.array([TIDE[name][0] for name in names])
+    phase = np.radians([TIDE[name][1] for name in names])
+    return A @ np.concatenate([[0.0], amplitude * np.cos(phase), amplitude * np.sin(phase)])
+
+def true_reflector_height(rh0, mjd):
+    # The reflector height drops as the water rises
+    return rh0 - synthetic_tide(mjd)
+
+def write_sp3(sp3_path, day, step=900, margin=7200):
+    """
+    SP3 file of the synthetic constellations covering day with a margin on both sides.
+    """
+    t0 = day - timedelta(seconds=margin)
+    n_epochs = int((86400 + 2 * margin) // step) + 1
+    sats = satellites()
+    seconds_since_start = (t0 - START_DAY).total_seconds() + np.arange(n_epochs) * step
+    xyz = {sat: satellite_xyz(sat, seconds_since_start) / 1000 for sat in sats}
+    lines = [f"#dP{t0.year:4d} {t0.month:2d} {t0.day:2d} {t0.hour:2d} {t0.minute:2d} {0.0:11.8f} {n_epochs:7d} ORBIT SYNTH FIT  BENCH"]
+    for k in range(n_epochs):
+        t = t0 + timedelta(seconds=k * step)
+        lines.append(f"*  {t.year:4d} {t.month:2d} {t.day:2d} {t.hour:2d} {t.minute:2d} {t.second:11.8f}")
+        lines.extend(f"P{sat}{xyz[sat][k, 0]:14.6f}{xyz[sat][k, 1]:14.6f}{xyz[sat][k, 2]:14.6f}     10.000000"
+                     for sat in sats)
+    lines.append("EOF")
+    with open(sp3_path, 'w') as f:
+        f.write("\n".join(lines) + "\n")
+
+def write_rinex3(rinex_path, station, day, samplerate, rh0, rng):
+    """
+    Gzip compressed Rinex3 observation file of one day with SNR observations of a
+    horizontal reflector at reflector height rh0 - tide.
+
+    Returns:
+    - int: Number of satellite records written.
+    """
+    seconds = np.arange(0, 86400, samplerate, dtype=float)
+    geometry = sat_geometry.sat_geometry(None, station.lat, station.lon, station.height)
+    rx_xyz = geometry.rx_xyz
+    mjd = result_store.to_mjd(day) + seconds / 86400
+    rh = true_reflector_height(rh0, mjd)
+
+    records = {}            # {sat: (visible mask, {obs type: values})}
+    for sat in satellites():
+        xyz = satellite_xyz(sat, (day - START_DAY).total_seconds() + seconds)
+        elev, _, _ = geometry.look_angles(xyz)
+        visible = elev > 0
+        sin_elev = np.sin(np.radians(elev))
+        direct = 10 ** ((35 + 15 * sin_elev) / 20)
+        values = {OBS_TYPES[sat[0]][0]: np.linalg.norm(xyz - rx_xyz, axis=-1)}
+        for obs_type in OBS_TYPES[sat[0]][1:]:
+            wavelength = reflector_height.SPEED_OF_LIGHT / CARRIERS[obs_type]
+            multipath = 20 * np.cos(4 * np.pi * rh / wavelength * sin_elev + int(sat[1:]))
+            values[obs_type] = 20 * np.log10(np.abs(direct + multipath)) + rng.normal(0, SNR_NOISE, len(seconds))
+        records[sat] = (visible, values)
+
+    header = ["     3.04           OBSERVATION DATA    M".ljust(60) + "RINEX VERSION / TYPE",
+              station.station_id.ljust(60) + "MARKER NAME",
+              "".join(f"{v:14.4f}" for v in rx_xyz).ljust(60) + "APPROX POSITION XYZ",
+              f"{samplerate:10.3f}".ljust(60) + "INTERVAL"]
+    header += [f"{system}  {len(types):3d} {' '.join(types)}".ljust(60) + "SYS / # / OBS TYPES"
+               for system, types in OBS_TYPES.items()]
+    header += [f"{day.year:6d}{day.month:6d}{day.day:6d}{0:6d}{0:6d}{0:13.7f}     GPS".ljust(60) + "TIME OF FIRST OBS",
+               "".ljust(60) + "END OF HEADER"]
+
+    n_records = 0
+    with gzip.open(rinex_path, 'wt', compresslevel=1) as f:
+        f.write("\n".join(header) + "\n")
+        for k, second in enumerate(seconds):
+            visible = [sat for sat, (mask, _) in records.items() if mask[k]]
+            t = day + timedelta(seconds=float(second))
+            lines = [f"> {t.year:4d} {t.month:02d} {t.day:02d} {t.hour:02d} {t.minute:02d}{t.second:11.7f}  0{len(visible):3d}"]
+            for sat in visible:
+                values = records[sat][1]
+                lines.append(sat + "".join(f"{values[obs_type][k]:14.3f}  " for obs_type in OBS_TYPES[sat[0]]).rstrip())
+            n_records += len(visible)
+            f.write("\n".join(lines) + "\n")
+    return n_records
+
+
+def _text_difference(old, new):
+    # CRINEX text differencing: ' ' keeps the old character, '&' blanks it
+    chars = [' ' if i < len(old) and old[i] == c else ('&' if c == ' ' else c) for i, c in enumerate(new)]
+    chars += ['&' if c != ' ' else ' ' for c in old[len(new):]]
+    return ''.join(chars).rstrip()
+
+def _difference(history):
+    # Highest order difference of an arc history (oldest value first)
+    for _ in range(len(history) - 1):
+        history = [b - a for a, b in zip(history, history[1:])]
+    return history[0]
+
+def write_crinex(rinex_path, crx_path, order=3):
+    """
+    Hatanaka compressed (CRINEX 3) copy of a Rinex3 file written by write_rinex3,
+    as RNX2CRX writes it: epoch lines as text differences, observations as
+    differences of up to order on every satellite arc.
+    """
+    with gzip.open(rinex_path, 'rt') as f:
+        lines = f.read().splitlines()
+    end = next(i for i, line in enumerate(lines) if "END OF HEADER" in line) + 1
+    out = ["3.0                 COMPACT RINEX FORMAT".ljust(60) + "CRINEX VERS   / TYPE",
+           "RNX2CRX ver.4.1.0".ljust(60) + "CRINEX PROG / DATE"] + lines[:end]
+
+    previous_epoch, arcs = "", {}           # arcs: {(sat, obs index): last order + 1 values}
+    k = end
+    while k < len(lines):
+        n_sats = int(lines[k][32:35])
+        sat_lines = lines[k + 1:k + 1 + n_sats]
+        epoch_line = lines[k][:35].ljust(41) + "".join(line[:3] for line in sat_lines)
+        out.append(_text_difference(previous_epoch, epoch_line) if previous_epoch else epoch_line)
+        out.append("")                      # No receiver clock offset
+        previous_epoch, k = epoch_line, k + 1 + n_sats
+
+        new_arcs = {}
+        for line in sat_lines:
+            fields = []
+            for i in range(len(OBS_TYPES[line[0]])):
+                text = line[3 + 16 * i:17 + 16 * i].strip()
+                if not text:
+                    fields.append("")
+                    continue
+                history = (arcs.get((line[:3], i), []) + [int(text.replace(".", ""))])[-(order + 1):]
+                new_arcs[(line[:3], i)] = history
+                fields.append(f"{order}&{history[0]}" if len(history) == 1 else str(_difference(history)))
+            out.append(" ".join(fields))
+        arcs = new_arcs
+
+    with gzip.open(crx_path, 'wt', compresslevel=1) as f:
+        f.write("\n".join(out) + "\n")
+
+
+def _measure(stages, name, func, n_items, unit):
+    """
+    Run func, recording wall time, CPU time, peak traced memory and throughput under stages[name].
+    """
+    tracemalloc.start()
+    wall, cpu = time.perf_counter(), time.process_time()
+    result = func()
+    wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    items = n_items(result) if callable(n_items) else n_items
+    stages[name] = {"wall_s": round(wall, 4), "cpu_s": round(cpu, 4), "peak_mb": round(peak / 1e6, 2),
+                    "items": int(items), "unit": unit, "throughput_per_s": round(items / wall, 2) if wall else None}
+    print(f"    {name:24s} {wall:8.2f} s  {items / wall if wall else 0:12.1f} {unit}/s  peak {peak / 1e6:8.1f} MB")
+    return result
+
+def run_benchmark(station, samplerate, n_days, workdir, seed=0):
+    """
+    Generate n_days of synthetic data for a station and time every processing stage on it.
+
+    Returns:
+    - dict: Stage measurements and the accuracy of the retrieved reflector heights.
+    """
+    rng = np.random.default_rng(seed)
+    params = station.gnssir_input
+    rh0 = (float(params["h1"]) + float(params["h2"])) / 2
+    days = [START_DAY + timedelta(days=i) for i in range(n_days)]
+    rinex_paths = [os.path.join(workdir, f"{station.station_id}_{d:%Y%j}_{samplerate}s.rnx.gz") for d in days]
+    crx_paths = [p.replace(".rnx.gz", ".crx.gz") for p in rinex_paths]
+    sp3_paths = [os.path.join(workdir, f"SYN_{d:%Y%j}.sp3") for d in days]
+    snr_paths = [os.path.join(workdir, f"{station.station_id.lower()}{d:%j}0.{d:%y}.snr{station.rinex2snr_snr}")
+                 for d in days]
+
+    print(f">>  {station.station_id}: {n_days} days at {samplerate} s")
+    n_records = 0
+    for day, rinex_path, crx_path, sp3_path in zip(days, rinex_paths, crx_paths, sp3_paths):
+        n_records += write_rinex3(rinex_path, station, day, samplerate, rh0, rng)
+        write_crinex(rinex_path, crx_path)
+        write_sp3(sp3_path, day)
+
+    stages = {}
+    _measure(stages, "header_parse", lambda: [rinex_header_index.scan_header(p) for p in crx_paths],
+             len(rinex_paths), "files")
+    # The stations deliver Hatanaka compressed files; the plain Rinex3 parse is timed for comparison
+    _measure(stages, "conversion", lambda: sum(len(epoch.obs) for p in crx_paths
+                                               for _, epoch in rinex3_stream.iter_epochs(p)),
+             lambda n: n, "records")
+    _measure(stages, "conversion_rnx", lambda: sum(len(epoch.obs) for p in rinex_paths
+                                                   for _, epoch in rinex3_stream.iter_epochs(p)),
+             lambda n: n, "records")
+    _measure(stages, "snr_extraction",
+             lambda: sum(rinex3_snr.extract_snr(r, s, o, station.lat, station.lon, station.height,
+                                                samplerate=samplerate, snr_option=station.rinex2snr_snr)
+                         for r, s, o in zip(crx_paths, sp3_paths, snr_paths)),
+             lambda n: n, "rows")
+
+    estimates = {}
+    for method in reflector_height.PERIODOGRAMS:
+        estimates[method] = _measure(
+            stages, f"estimation_{method}",
+            lambda: [reflector_height.estimate_reflector_heights(reflector_height.read_snr_file(p),
+                                                                 periodogram=method, **params)
+                     for p in snr_paths],
+            lambda tables: sum(len(t) for t in tables), "arcs")
+
+    store = result_store.result_store(os.path.join(workdir, "rh_store"))
+    tables = estimates[station.periodogram]
+
+    def aggregate():
+        for day, table in zip(days, tables):
+            store.append(station.station_id, result_store.columns_from_estimates(table, day.year, day.timetuple().tm_yday))
+        return store.query(station.station_id, days[0], days[-1] + timedelta(days=1))
+    rows = _measure(stages, "aggregation", aggregate, lambda rows: len(rows["mjd"]), "retrievals")
+
+    constituents = list(TIDE) if n_days < 15 else ["M2", "S2", "N2", "K1", "O1"]
+    fit = _measure(stages, "tidal_fit",
+                   lambda: tidal_analysis.fit_tides({station.station_id: (rows["mjd"], -rows["rh"])}, constituents),
+                   len(rows["mjd"]), "retrievals")
+
+    error = rows["rh"] - true_reflector_height(rh0, rows["mjd"])
+    accuracy = {"n_retrievals": int(len(error)),
+                "rh_median_abs_error_m": float(np.median(np.abs(error))) if len(error) else None,
+                "M2_amplitude_m": float(fit.amplitude[0, 0]), "M2_amplitude_true_m": TIDE["M2"][0]}
+    return {"station": station.station_id, "samplerate": samplerate, "days": n_days, "records": n_records,
+            "periodogram": station.periodogram, "stages": stages, "accuracy": accuracy}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the processing stages on synthetic Rinex3/SNR data.")
+    parser.add_argument("--station", default="KULL", help="Station of the registry whose position and gnssir settings are used")
+    parser.add_argument("--samplerates", type=int, nargs="+", default=[15, 5], help="Sample rates in seconds")
+    parser.add_argument("--days", type=int, default=2, help="Number of synthetic days")
+    parser.add_argument("--registry", default=REGISTRY_PATH, help="Station registry file")
+    parser.add_argument("--output", default=REPORT_PATH, help="JSON report")
+    parser.add_argument("--workdir", default=None, help="Directory for the synthetic data (default: temporary)")
+    args = parser.parse_args()
+
+    station = src.load_station_registry(args.registry)[args.station.upper()]
+    workdir = args.workdir or tempfile.mkdtemp(prefix="gnss_ir_benchmark_")
+    os.makedirs(workdir, exist_ok=True)
+    try:
+        runs = []
+        for samplerate in args.samplerates:
+            run_dir = os.path.join(workdir, f"{samplerate}s")
+            os.makedirs(run_dir, exist_ok=True)
+            runs.append(run_benchmark(station, samplerate, args.days, run_dir))
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {"created": datetime.now().isoformat(timespec='seconds'),
+              "machine": {"platform": platform.platform(), "python": platform.python_version(),
+                          "numpy": np.__version__, "cores": src.count_nr_cores()},
+              "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+              "runs": runs}
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Report written to {args.output}")
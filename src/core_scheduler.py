@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+
+import os
+import multiprocessing
+from contextlib import contextmanager
+
+_scheduler = None
+
+
+def _read_first_line(file_path):
+    try:
+        with open(file_path, 'r') as f:
+            return f.readline().strip()
+    except OSError:
+        return None
+
+def available_cores():
+    """
+    Number of cores this process may use, respecting the CPU affinity mask and
+    the cgroup (v2 cpu.max or v1 cfs quota) CPU limit, not just os.cpu_count().
+    """
+    try:
+        n_cores = len(os.sched_getaffinity(0))
+    except AttributeError:
+        n_cores = os.cpu_count() or 1
+
+    quota, period = None, None
+    cpu_max = _read_first_line("/sys/fs/cgroup/cpu.max")                        # cgroup v2: "<quota> <period>"
+    if cpu_max and cpu_max.split()[0] != "max":
+        quota, period = (int(v) for v in cpu_max.split()[0:2])
+    else:
+        cfs_quota = _read_first_line("/sys/fs/cgroup/cpu/cpu.cfs_quota_us")     # cgroup v1
+        cfs_period = _read_first_line("/sys/fs/cgroup/cpu/cpu.cfs_period_us")
+        if cfs_quota and cfs_period and int(cfs_quota) > 0:
+            quota, period = int(cfs_quota), int(cfs_period)
+    if quota and period:
+        n_cores = min(n_cores, max(1, quota // period))
+    return max(1, n_cores)
+
+def available_memory():
+    """
+    Memory in bytes available to this process: the cgroup memory limit if set,
+    otherwise MemAvailable of the machine.
+    """
+    limit = _read_first_line("/sys/fs/cgroup/memory.max")                           # cgroup v2
+    if limit is None:
+        limit = _read_first_line("/sys/fs/cgroup/memory/memory.limit_in_bytes")     # cgroup v1
+    mem_available = None
+    try:
+        with open("/proc/meminfo", 'r') as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    mem_available = int(line.split()[1]) * 1024
+                    break
+    except OSError:
+        mem_available = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+
+    if limit and limit.isdigit() and mem_available:
+        return min(int(limit), mem_available)
+    return mem_available
+
+
+class core_scheduler:
+    """
+    Global core and memory budget shared by concurrent stations and stages.
+
+    Every job (e.g. a rinex2snr call) asks for cores before it starts and gets
+    a share of the free cores, sized when it starts: while many jobs wait each
+    gets few cores, and jobs started as others finish get more. The budget is
+    shared between threads and, when handed to a process pool through
+    install() as initializer, between processes.
+    """
+    def __init__(self, total_cores=None, total_memory=None):
+        self.total_cores = total_cores or available_cores()
+        self.total_memory = float(total_memory or available_memory() or 0)
+        context = multiprocessing.get_context()
+        self._condition = context.Condition()
+        self._free_cores = context.Value('i', self.total_cores, lock=False)
+        self._free_memory = context.Value('d', self.total_memory, lock=False)
+        self._n_waiting = context.Value('i', 0, lock=False)
+
+    def _grant(self, min_cores, max_cores, memory_per_core):
+        free_cores = self._free_cores.value
+        idle = free_cores == self.total_cores
+        if memory_per_core and self.total_memory:
+            free_cores = min(free_cores, int(self._free_memory.value // memory_per_core))
+            if idle:
+                # Never block a job on an idle machine because of the memory estimate
+                free_cores = max(free_cores, min_cores)
+        # Fair share between the jobs that are waiting
+        share = max(min_cores, free_cores // max(1, self._n_waiting.value))
+        cores = min(max_cores, share, free_cores)
+        return cores if cores >= min_cores else 0
+
+    def acquire(self, max_cores=None, min_cores=1, memory_per_core=0):
+        """
+        Block until at least min_cores (and their memory) are free.
+
+        Returns:
+        - int: Number of cores granted, between min_cores and max_cores.
+        """
+        max_cores = min(max_cores or self.total_cores, self.total_cores)
+        min_cores = min(min_cores, max_cores)
+        with self._condition:
+            self._n_waiting.value += 1
+            cores = self._grant(min_cores, max_cores, memory_per_core)
+            while not cores:
+                self._condition.wait()
+                cores = self._grant(min_cores, max_cores, memory_per_core)
+            self._n_waiting.value -= 1
+            self._free_cores.value -= cores
+            if self.total_memory:
+                self._free_memory.value -= cores * memory_per_core
+        return cores
+
+    def release(self, cores, memory_per_core=0):
+        with self._condition:
+            self._free_cores.value += cores
+            if self.total_memory:
+                self._free_memory.value += cores * memory_per_core
+            self._condition.notify_all()
+
+    @contextmanager
+    def allocate(self, max_cores=None, min_cores=1, memory_per_core=0):
+        """
+        with scheduler.allocate(max_cores=8) as n_cores: ... run a job with -par n_cores
+        """
+        cores = self.acquire(max_cores, min_cores, memory_per_core)
+        try:
+            yield cores
+        finally:
+            self.release(cores, memory_per_core)
+
+def install(scheduler):
+    """
+    Make scheduler the one returned by get_scheduler(), e.g. as process pool initializer.
+    """
+    global _scheduler
+    _scheduler = scheduler
+
+def get_scheduler():
+    """
+    The scheduler of this process, a default one for the whole machine if none was installed.
+    """
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = core_scheduler()
+    return _scheduler
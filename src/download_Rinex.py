@@ -2,6 +2,11 @@
 
 import paramiko
 import os
+import time
+import queue
+import threading
+import instrumentation
+import gnss_ir_util as src
 
 # SSH details
 REMOTE_HOST = "10.58.1.129"
@@ -9,51 +14,170 @@ REMOTE_USER = "csol"
 PASSWORD = "XXXX"
 REMOTE_PATH = "/data/rinex3/obs/"
 LOCAL_PATH = "/mnt/c/Users/csol/GNSS_IR/src/TEMP_RINEX_DATA/"
+CHUNK_SIZE = 1024 * 1024
 
-def generate_filenames(station_id, year, doy_range):
+def generate_filenames(station_id, year, doy_range, period="01D", sampling="15S"):
     """
     Generate RINEX file names based on the Station ID, Year, and DOY range.
+
+    With period "01H" or "15M" the names of all hourly or 15 minute files of
+    the days are generated, e.g. with sampling "01S" for high rate data.
     """
+    step = src.RINEX3_PERIODS[period] // 60       # Minutes between file starts
     filenames = []
     for doy in doy_range:
         doy_str = f"{doy:03d}"  # Zero-pad DOY to 3 digits
-        filename = f"{station_id}00GRL_R_{year}{doy_str}0000_01D_15S_MO.crx.gz"
-        filenames.append(filename)
+        for minute in range(0, 24 * 60, step):
+            start = f"{minute // 60:02d}{minute % 60:02d}"
+            filename = f"{station_id}00GRL_R_{year}{doy_str}{start}_{period}_{sampling}_MO.crx.gz"
+            filenames.append(filename)
     return filenames
 
-def download_files(station_id, year, doy_range, local_dir):
-    # Initialize SSH client
+def open_sftp(host=REMOTE_HOST, username=REMOTE_USER, password=PASSWORD, port=22):
+    """
+    Open an SSH connection and an SFTP session on it.
+    """
     ssh = paramiko.SSHClient()
     ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+    ssh.connect(host, port=port, username=username, password=password)
+    return ssh, ssh.open_sftp()
+
+def is_up_to_date(local_filepath, remote_stat):
+    """
+    True if the local file has the size and modification time of the remote file.
+    """
+    if not os.path.exists(local_filepath):
+        return False
+    local_stat = os.stat(local_filepath)
+    return local_stat.st_size == remote_stat.st_size and int(local_stat.st_mtime) == int(remote_stat.st_mtime)
+
+def _part_source(part_filepath):
+    # Remote (size, mtime) a .part file was downloaded from, None if unknown
+    try:
+        with open(part_filepath + ".src", 'r') as f:
+            size, mtime = f.read().split()
+        return int(size), int(float(mtime))
+    except (OSError, ValueError):
+        return None
+
+def fetch_file(sftp, remote_filepath, local_filepath, chunk_size=CHUNK_SIZE):
+    """
+    Download a single file, skipping it when the local copy is up to date.
+
+    The transfer is written to "<local_filepath>.part" and continues from the
+    end of an existing .part file, so an interrupted transfer is resumed
+    instead of restarted. The remote size and modification time are kept in
+    "<local_filepath>.part.src"; a .part file of a remote file that has been
+    replaced since is discarded. The finished file gets the remote
+    modification time.
+
+    Returns:
+    - str: "skipped", "downloaded" or "resumed"
+    """
+    remote_stat = sftp.stat(remote_filepath)
+    if is_up_to_date(local_filepath, remote_stat):
+        return "skipped"
 
-    # Connect to the remote server
-    ssh.connect(REMOTE_HOST, username=REMOTE_USER, password=PASSWORD)
+    part_filepath = local_filepath + ".part"
+    source = (int(remote_stat.st_size), int(remote_stat.st_mtime))
+    offset = os.path.getsize(part_filepath) if os.path.exists(part_filepath) else 0
+    if offset > remote_stat.st_size or _part_source(part_filepath) != source:
+        offset = 0
+    with open(part_filepath + ".src", 'w') as f:
+        f.write(f"{source[0]} {source[1]}\n")
 
-    # Initialize SFTP client
-    sftp = ssh.open_sftp()
+    with sftp.open(remote_filepath, 'rb') as remote_file, open(part_filepath, 'ab' if offset else 'wb') as local_file:
+        remote_file.seek(offset)
+        remote_file.prefetch(remote_stat.st_size)      # End of the prefetch, counted from the start of the file
+        while True:
+            data = remote_file.read(chunk_size)
+            if not data:
+                break
+            local_file.write(data)
 
+    # A short transfer is kept as .part and resumed by the next attempt
+    size = os.path.getsize(part_filepath)
+    if size != remote_stat.st_size:
+        raise EOFError(f"{remote_filepath}: got {size} of {remote_stat.st_size} bytes")
+    os.replace(part_filepath, local_filepath)
+    os.remove(part_filepath + ".src")
+    os.utime(local_filepath, (remote_stat.st_atime, remote_stat.st_mtime))
+    return "resumed" if offset else "downloaded"
+
+def _download_worker(jobs, results, connect, retries, backoff):
+    # Each worker keeps one SFTP session open for all the files it downloads
+    ssh, sftp = None, None
+    while True:
+        try:
+            filename, remote_filepath, local_filepath = jobs.get_nowait()
+        except queue.Empty:
+            break
+
+        labels = instrumentation.labels_from_command(f"download {filename}")
+        with instrumentation.measure("download", **labels) as outcome:
+            for attempt in range(retries + 1):
+                try:
+                    if sftp is None:
+                        ssh, sftp = connect()
+                    status = fetch_file(sftp, remote_filepath, local_filepath)
+                    break
+                except FileNotFoundError:
+                    status = "not found"
+                    break
+                except (OSError, EOFError, paramiko.SSHException) as e:
+                    # Transient failure, reconnect and retry with exponential backoff
+                    status = f"failed: {e}"
+                    if ssh is not None:
+                        ssh.close()
+                    ssh, sftp = None, None
+                    if attempt < retries:
+                        time.sleep(backoff * 2 ** attempt)
+            if status == "not found" or status.startswith("failed"):
+                outcome.update(exit_status=1, error=status)
+
+        results[filename] = status
+        print(f"{filename}: {status}")
+
+    if ssh is not None:
+        ssh.close()
+
+def download_files(station_id, year, doy_range, local_dir, n_workers=4, retries=3, backoff=2.0, connect=open_sftp,
+                   period="01D", sampling="15S"):
+    """
+    Download the Rinex3 files of a station for a DOY range over parallel SFTP sessions.
+
+    Args:
+    - station_id (str): Station ID (e.g., NORD).
+    - year (int): Year.
+    - doy_range (iterable): DOYs to download.
+    - local_dir (str): Download directory.
+    - n_workers (int): Number of parallel transfers, each with its own SFTP session.
+    - retries (int): Retries per file on transient failures.
+    - backoff (float): Initial wait in seconds between retries, doubled every retry.
+    - connect (callable): Returns (ssh, sftp), e.g. for a local SFTP server.
+    - period, sampling (str): File period ("01D", "01H", "15M") and sampling (e.g. "15S", "01S").
+
+    Returns:
+    - dict: {filename: "skipped" | "downloaded" | "resumed" | "not found" | "failed: ..."}
+    """
     # Generate file names based on the input DOY range
-    filenames = generate_filenames(station_id, year, doy_range)
+    filenames = generate_filenames(station_id, year, doy_range, period, sampling)
 
-    year_path = f"{year}/"
-    # Loop through the filenames and download each
+    jobs = queue.Queue()
     for filename in filenames:
-        remote_filepath = os.path.join(REMOTE_PATH, year_path)
-        remote_filepath = os.path.join(remote_filepath, filename)
-        # print(remote_filepath)
+        remote_filepath = os.path.join(REMOTE_PATH, f"{year}/", filename)
         local_filepath = os.path.join(local_dir, filename)
+        jobs.put((filename, remote_filepath, local_filepath))
 
-        # sftp.get(remote_filepath, local_filepath)
-        try:
-            print(f"Downloading: {remote_filepath} -> {local_filepath}")
-            sftp.get(remote_filepath, local_filepath)
-            print(f"Successfully downloaded {filename}")
-        except FileNotFoundError:
-            print(f"File not found: {filename}")
-    
-    # Close connections
-    sftp.close()
-    ssh.close()
+    results = {}
+    n_workers = max(1, min(n_workers, len(filenames)))
+    workers = [threading.Thread(target=_download_worker, args=(jobs, results, connect, retries, backoff))
+               for _ in range(n_workers)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return results
 
 if __name__ == "__main__":
     # Example inputs (you can modify this to accept user input)
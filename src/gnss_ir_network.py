@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+
+import os
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import gnss_ir_util as src
+import gnssrefl_backend
+import download_Rinex
+import processing_manifest
+import core_scheduler
+import instrumentation
+import result_store
+import job_workspace
+import orbit_cache
+
+# ------------------------------ Defaults ----------------------------------
+REGISTRY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "stations.json")
+RINEX3_PATH = "/mnt/c/Users/csol/GNSS_IR/src/TEMP_RINEX_DATA/"  # One sub directory per station
+# Rough memory use of the stages per core (bytes), used by the core scheduler
+STAGE_MEMORY_PER_CORE = {"rinex3_rinex2": 0.5e9, "rinex2snr": 1.0e9, "gnssir": 0.5e9}
+# --------------------------------------------------------------------------
+
+
+def select_rinex3_files(station_dir, station_id, days):
+    """
+    Daily Rinex3 files of a station in its directory for a set of days.
+
+    Args:
+    - days (iterable): (year, doy) to look for, e.g. from src.day_range.
+
+    Returns:
+    - dict: {(year, doy): rinex3_file} of the days with a file.
+    """
+    days = set(days)
+    rinex3_by_day = {}
+    for rinex3_file in src.load_Rinex_files(station_dir, station_id):
+        parsed = src.parse_rinex3_name(rinex3_file)
+        if parsed is None or parsed[2] != 86400:
+            continue        # Sub-daily files go to the rolling window (rolling_window.py)
+        _, file_year, file_doy = src.get_info(rinex3_file)
+        if (int(file_year), int(file_doy)) in days:
+            rinex3_by_day[(int(file_year), int(file_doy))] = rinex3_file
+    return rinex3_by_day
+
+def _process_station_year(station, year, rinex3_by_doy, station_dir, workspace, manifest):
+    """
+    Rinex3 -> Rinex2 -> SNR -> GNSS-IR for the days of one year of a station.
+
+    rinex2snr and gnssir are called once per batch of consecutive days with
+    data, so gaps are never attempted.
+
+    Returns:
+    - tuple: (new SNR days, GNSS-IR days, Rinex3 files that failed to convert)
+    """
+    station_id = station.station_id.lower()
+    snr_params = {"samplerate": station.samplerate, "snr": station.rinex2snr_snr, "orb": "gbm"}
+    gnssir_params = dict(station.gnssir_input, lat=station.lat, lon=station.lon, height=station.height,
+                         snr=station.gnssir_snr)
+    scheduler = core_scheduler.get_scheduler()
+
+    # Days whose SNR file is missing or was made from another input file or parameters
+    if manifest:
+        rinex3_hashes = {doy: processing_manifest.file_hash(os.path.join(station_dir, rinex3_file))
+                         for doy, rinex3_file in rinex3_by_doy.items()}
+        snr_doys = manifest.pending(station_id, year, "rinex2snr", rinex3_hashes, snr_params)
+    else:
+        snr_doys = sorted(rinex3_by_doy)
+
+    # Unpack Rinex3 files and convert to rinex2, from links to the archived files
+    convert_files = [workspace.add_input(os.path.join(station_dir, rinex3_by_doy[doy])) for doy in snr_doys]
+    with scheduler.allocate(max_cores=max(1, len(convert_files)),
+                            memory_per_core=STAGE_MEMORY_PER_CORE["rinex3_rinex2"]) as n_cores:
+        conversions = src.convert_rinex3_files(convert_files, max_workers=n_cores, cwd=workspace.path)
+    n_failed = sum(not c.success for c in conversions)
+    rinex2_names = {doy: src.rinex2_file_name(station_id, year, doy) for doy in snr_doys}
+
+    # Convert Rinex2 -> SNR, one call per batch of consecutive days
+    snr_doys = [doy for doy in snr_doys if os.path.exists(workspace.file(rinex2_names[doy]))]
+    for _, _, first_doy, last_doy in src.plan_batches([(station_id, year, doy) for doy in snr_doys]):
+        with scheduler.allocate(max_cores=last_doy - first_doy + 1,
+                                memory_per_core=STAGE_MEMORY_PER_CORE["rinex2snr"]) as n_cores:
+            src.run_convert_rinex2_snr_range(station_id, year, first_doy, last_doy, n_cores,
+                                             station.samplerate, station.rinex2snr_snr, cwd=workspace.path)
+        # The Rinex2 files of the batch are no longer needed
+        workspace.remove(*(rinex2_names[doy] for doy in range(first_doy, last_doy + 1)))
+    snr_paths = {doy: src.snr_file_path(station_id, year, doy, station.rinex2snr_snr) for doy in rinex3_by_doy}
+    if manifest:
+        for doy in snr_doys:
+            if os.path.exists(snr_paths[doy]):
+                manifest.record(station_id, year, doy, "rinex2snr", rinex3_hashes[doy], snr_params, snr_paths[doy])
+
+    # Running GNSS-IR calculations on SNR files
+    snr_hashes = {doy: processing_manifest.file_hash(path) if manifest else None
+                  for doy, path in snr_paths.items() if os.path.exists(path)}
+    if manifest:
+        gnssir_doys = manifest.pending(station_id, year, "gnssir", snr_hashes, gnssir_params)
+    else:
+        gnssir_doys = sorted(snr_hashes)
+    for _, _, first_doy, last_doy in src.plan_batches([(station_id, year, doy) for doy in gnssir_doys]):
+        with scheduler.allocate(max_cores=last_doy - first_doy + 1,
+                                memory_per_core=STAGE_MEMORY_PER_CORE["gnssir"]) as n_cores:
+            src.run_gnssIR_range(station_id, year, first_doy, last_doy, n_cores, station.gnssir_snr)
+    if manifest:
+        for doy in gnssir_doys:
+            result_path = src.gnssir_result_path(station_id, year, doy)
+            if os.path.exists(result_path):
+                manifest.record(station_id, year, doy, "gnssir", snr_hashes[doy], gnssir_params, result_path)
+
+    # Add the new reflector heights to the station's result store
+    result_store.result_store().ingest_results(station_id, year, gnssir_doys)
+    return len(snr_doys), len(gnssir_doys), n_failed
+
+def process_station(station, year, doy_start, doy_end, rinex3_path, download=False, manifest_path=None,
+                    scratch_root=None, tmpfs=False, year_end=None):
+    """
+    Run the full GNSS-IR chain (Rinex3 -> Rinex2 -> SNR -> GNSS-IR) for one station.
+
+    Each station reads its Rinex3 files from its own sub directory of
+    rinex3_path and converts them in a private scratch directory (on tmpfs
+    with tmpfs=True), so several stations can be processed at the same time
+    and no intermediates are left behind. The cores of every stage are
+    taken from the core scheduler shared by all stations, so the parallelism of
+    a stage depends on what the other stations are running when it starts.
+    With a processing manifest only the days whose input or parameters changed
+    since the last run are processed. The range runs from doy_start of year to
+    doy_end of year_end (default: the same year) and is processed year by year.
+
+    Returns:
+    - tuple: (station_id, status message)
+    """
+    station_dir = os.path.join(rinex3_path, station.station_id)
+    os.makedirs(station_dir, exist_ok=True)
+    days = src.day_range(year, doy_start, doy_end, year_end)
+    years = sorted({y for y, _ in days})
+
+    if download:
+        for y in years:
+            download_Rinex.download_files(station.station_id, y, [doy for yy, doy in days if yy == y], station_dir)
+
+    rinex3_by_day = select_rinex3_files(station_dir, station.station_id, days)
+    if not rinex3_by_day:
+        return station.station_id, "no Rinex3 files found"
+
+    manifest = processing_manifest.processing_manifest(manifest_path) if manifest_path else None
+    n_snr = n_gnssir = n_failed = 0
+    try:
+        # The Rinex2 intermediates live in a private scratch directory, removed when the station is done
+        with job_workspace.job_workspace(f"{station.station_id}_{year}{doy_start:03d}", root=scratch_root,
+                                         tmpfs=tmpfs) as workspace:
+            # Create JSON for GNSS-IR
+            input_orig = src.create_gnssir_input_class(lat=station.lat, lon=station.lon, height=station.height,
+                                                       **station.gnssir_input)
+            src.create_json(station.station_id.lower(), station.lat, station.lon, station.height, input_orig)
+
+            for y in years:
+                rinex3_by_doy = {doy: rinex3_file for (yy, doy), rinex3_file in rinex3_by_day.items() if yy == y}
+                if rinex3_by_doy:
+                    new_snr, new_gnssir, failed = _process_station_year(station, y, rinex3_by_doy, station_dir,
+                                                                        workspace, manifest)
+                    n_snr, n_gnssir, n_failed = n_snr + new_snr, n_gnssir + new_gnssir, n_failed + failed
+    finally:
+        if manifest:
+            manifest.close()
+
+    status = f"done, {n_snr} new SNR days, {n_gnssir} GNSS-IR days"
+    if n_failed:
+        status += f" ({n_failed} Rinex3 files failed to convert)"
+    return station.station_id, status
+
+def process_network(stations, year, doy_start, doy_end, rinex3_path=RINEX3_PATH, max_workers=None, download=False,
+                    manifest_path=processing_manifest.MANIFEST_PATH, total_cores=None, total_memory=None,
+                    scratch_root=None, tmpfs=False, year_end=None, prefetch_orbits=True):
+    """
+    Process a set of stations for a DOY range concurrently with a process pool.
+
+    Args:
+    - stations (list): station_config objects to process.
+    - year (int): Year to process.
+    - doy_start, doy_end (int): DOY range (inclusive), doy_end in year_end.
+    - rinex3_path (str): Root data directory, one sub directory per station.
+    - max_workers (int): Number of stations processed at once (default: all).
+    - download (bool): Download the Rinex3 files before processing.
+    - manifest_path (str): Processing manifest, None reprocesses every day.
+    - total_cores, total_memory (int): Budget shared by all stations (default: what this process may use).
+    - scratch_root (str): Directory for the per station scratch directories (default: job_workspace.SCRATCH_ROOT).
+    - tmpfs (bool): Put the scratch directories on tmpfs (/dev/shm).
+    - year_end (int): Last year of the range, for runs across New Year (default: year).
+    - prefetch_orbits (bool): Fetch the orbits of the range into the shared orbit cache first.
+
+    Returns:
+    - dict: {station_id: status message}
+    """
+    if max_workers is None:
+        max_workers = len(stations)
+    max_workers = max(1, min(max_workers, len(stations)))
+
+    # One core and memory budget for all concurrent stations and their stages
+    scheduler = core_scheduler.core_scheduler(total_cores, total_memory)
+
+    # The orbit of every day is fetched and parsed once for all stations, not by every rinex2snr call
+    if prefetch_orbits:
+        orbit_cache.get_cache().prefetch(src.day_range(year, doy_start, doy_end, year_end))
+
+    results = {}
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=core_scheduler.install,
+                             initargs=(scheduler,)) as pool:
+        futures = {pool.submit(process_station, station, year, doy_start, doy_end,
+                               rinex3_path, download, manifest_path, scratch_root, tmpfs, year_end): station.station_id
+                   for station in stations}
+        for future in as_completed(futures):
+            station_id = futures[future]
+            try:
+                _, status = future.result()
+            except Exception as e:
+                status = f"failed: {e}"
+            results[station_id] = status
+            print(f">>  {station_id}: {status}")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run GNSS-IR for all stations in the station registry.")
+    parser.add_argument("year", type=int, help="Year (e.g., 2024)")
+    parser.add_argument("doy_start", type=int, help="Start DOY (e.g., 140)")
+    parser.add_argument("doy_end", type=int, help="End DOY (e.g., 145)")
+    parser.add_argument("--year_end", type=int, default=None, help="Year of doy_end, for runs across New Year")
+    parser.add_argument("--stations", nargs="+", default=None, help="Station IDs (default: all in registry)")
+    parser.add_argument("--registry", default=REGISTRY_PATH, help="Station registry file")
+    parser.add_argument("--rinex3_path", default=RINEX3_PATH, help="Root data directory")
+    parser.add_argument("--workers", type=int, default=None, help="Number of stations processed at once")
+    parser.add_argument("--cores", type=int, default=None, help="Cores shared by all stations (default: all available)")
+    parser.add_argument("--download", action="store_true", help="Download Rinex3 files first")
+    parser.add_argument("--manifest", default=processing_manifest.MANIFEST_PATH, help="Processing manifest")
+    parser.add_argument("--reprocess", action="store_true", help="Ignore the manifest and process every day")
+    parser.add_argument("--scratch", default=None, help="Directory for the scratch directories of the stations")
+    parser.add_argument("--tmpfs", action="store_true", help="Put the scratch directories on tmpfs (/dev/shm)")
+    parser.add_argument("--no_prefetch", action="store_true", help="Leave fetching the orbits to rinex2snr")
+    parser.add_argument("--prometheus", default=None, help="Write the stage measurements as a Prometheus text file")
+    parser.add_argument("--backend", default=gnssrefl_backend.BACKEND, choices=["shell", "inprocess"],
+                        help="Run gnssrefl commands as shell subprocesses or in-process in worker processes")
+    args = parser.parse_args()
+    gnssrefl_backend.set_backend(args.backend)
+
+    registry = src.load_station_registry(args.registry)
+    station_ids = [s.upper() for s in args.stations] if args.stations else list(registry)
+    missing = [s for s in station_ids if s not in registry]
+    if missing:
+        parser.error(f"Stations not in registry: {' '.join(missing)}")
+
+    process_network([registry[s] for s in station_ids], args.year, args.doy_start, args.doy_end,
+                    rinex3_path=args.rinex3_path, max_workers=args.workers, download=args.download,
+                    manifest_path=None if args.reprocess else args.manifest, total_cores=args.cores,
+                    scratch_root=args.scratch, tmpfs=args.tmpfs, year_end=args.year_end,
+                    prefetch_orbits=not args.no_prefetch)
+    if args.prometheus:
+        instrumentation.write_prometheus(args.prometheus)
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+
+import os
+import queue
+import argparse
+import threading
+from dataclasses import dataclass
+import gnss_ir_util as src
+import gnssrefl_backend
+import download_Rinex
+import core_scheduler
+import instrumentation
+import result_store
+import job_workspace
+import orbit_cache
+
+# ------------------------------ Defaults ----------------------------------
+REGISTRY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "stations.json")
+RINEX3_PATH = "/mnt/c/Users/csol/GNSS_IR/src/TEMP_RINEX_DATA/"  # One sub directory per station
+# --------------------------------------------------------------------------
+
+_DONE = None    # End of work marker passed down the queues
+
+
+@dataclass
+class day_item:
+    """
+    One station-day flowing through the pipeline
+    """
+    station: src.station_config
+    year: int
+    doy: int
+    station_dir: str
+    rinex3_file: str = None
+    workspace: job_workspace.job_workspace = None    # Scratch directory of the Rinex2 file
+    status: str = "pending"
+
+
+class _stage:
+    """
+    A pipeline stage: n worker threads taking items from in_queue, applying
+    func and passing them on to out_queue. Failed items skip the remaining
+    stages but are still passed on, so they reach the results.
+    """
+    def __init__(self, name, func, n_workers, in_queue, out_queue, setup=None):
+        self.name = name
+        self.func = func
+        self.setup = setup
+        self.in_queue = in_queue
+        self.out_queue = out_queue
+        self.n_running = n_workers
+        self.lock = threading.Lock()
+        self.threads = [threading.Thread(target=self._work, daemon=True) for _ in range(n_workers)]
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+
+    def _work(self):
+        context, setup_error = None, None
+        if self.setup:
+            try:
+                context = self.setup()
+            except Exception as e:
+                setup_error = e
+
+        while True:
+            item = self.in_queue.get()
+            if item is _DONE:
+                # Let the other workers of this stage see the marker as well
+                self.in_queue.put(_DONE)
+                break
+            if item.status == "pending":
+                try:
+                    if setup_error is not None:
+                        raise setup_error
+                    self.func(item, context)
+                except Exception as e:
+                    item.status = f"failed in {self.name}: {e}"
+            self.out_queue.put(item)
+
+        with self.lock:
+            self.n_running -= 1
+            last = self.n_running == 0
+        if context is not None:
+            context.close()
+        if last:
+            self.out_queue.put(_DONE)
+
+
+class _sftp_session:
+    # SFTP session kept by a download worker for all the days it fetches
+    def __init__(self):
+        self.ssh, self.sftp = download_Rinex.open_sftp()
+
+    def close(self):
+        self.ssh.close()
+
+def _download(item, session):
+    filename = download_Rinex.generate_filenames(item.station.station_id, item.year, [item.doy])[0]
+    remote_filepath = os.path.join(download_Rinex.REMOTE_PATH, f"{item.year}/", filename)
+    with instrumentation.measure("download", item.station.station_id, item.year, item.doy):
+        download_Rinex.fetch_file(session.sftp, remote_filepath, os.path.join(item.station_dir, filename))
+    item.rinex3_file = filename
+
+def _find_local(item, context):
+    filename = download_Rinex.generate_filenames(item.station.station_id, item.year, [item.doy])[0]
+    if not os.path.exists(os.path.join(item.station_dir, filename)):
+        raise FileNotFoundError(filename)
+    item.rinex3_file = filename
+
+def _convert(item, context):
+    item.workspace = job_workspace.job_workspace(f"{item.station.station_id}_{item.year}{item.doy:03d}").open()
+    rinex3_file = item.workspace.add_input(os.path.join(item.station_dir, item.rinex3_file))
+    with core_scheduler.get_scheduler().allocate(max_cores=1):
+        src.run_convert_rinex3_2(rinex3_file, cwd=item.workspace.path)
+
+def _snr(item, context):
+    station = item.station
+    with core_scheduler.get_scheduler().allocate(max_cores=1):
+        src.run_convert_rinex2_snr_range(station.station_id.lower(), item.year, item.doy, item.doy, 1,
+                                         station.samplerate, station.rinex2snr_snr, cwd=item.workspace.path)
+    item.workspace.close()
+
+def _gnssir(item, context):
+    with core_scheduler.get_scheduler().allocate(max_cores=1):
+        src.run_gnssIR_range(item.station.station_id.lower(), item.year, item.doy, item.doy, 1,
+                             item.station.gnssir_snr)
+    result_store.result_store().ingest_results(item.station.station_id, item.year, [item.doy])
+    item.status = "done"
+
+def run_pipeline(stations, year, doy_start, doy_end, rinex3_path=RINEX3_PATH, download=True,
+                 n_download=4, n_convert=2, n_snr=2, n_gnssir=2, queue_size=4, year_end=None,
+                 prefetch_orbits=True):
+    """
+    Process station-days through download -> convert -> SNR -> GNSS-IR as a streaming pipeline.
+
+    Every day moves on to the next stage as soon as it is done with the
+    previous one, with bounded queues in between, so network transfers,
+    decompression and the estimation of different days overlap. The wall time
+    of a batch approaches that of the slowest stage instead of the sum.
+
+    Args:
+    - stations (list): station_config objects.
+    - year (int): Year to process.
+    - doy_start, doy_end (int): DOY range (inclusive), doy_end in year_end.
+    - rinex3_path (str): Root data directory, one sub directory per station.
+    - download (bool): Download the files, otherwise only the days with a file in the station directories.
+    - n_download, n_convert, n_snr, n_gnssir (int): Worker threads per stage.
+    - queue_size (int): Maximum number of days waiting in front of each stage.
+    - year_end (int): Last year of the range, for runs across New Year (default: year).
+    - prefetch_orbits (bool): Fetch the orbits of the range into the shared orbit cache first.
+
+    Returns:
+    - list: day_item per station-day, with its final status.
+    """
+    for station in stations:
+        os.makedirs(os.path.join(rinex3_path, station.station_id), exist_ok=True)
+        input_orig = src.create_gnssir_input_class(lat=station.lat, lon=station.lon, height=station.height,
+                                                   **station.gnssir_input)
+        src.create_json(station.station_id.lower(), station.lat, station.lon, station.height, input_orig)
+
+    days = src.day_range(year, doy_start, doy_end, year_end)
+    if prefetch_orbits:
+        orbit_cache.get_cache().prefetch(days)
+
+    queues = [queue.Queue(maxsize=queue_size) for _ in range(4)] + [queue.Queue()]
+    if download:
+        fetch = _stage("download", _download, n_download, queues[0], queues[1], setup=_sftp_session)
+    else:
+        fetch = _stage("find", _find_local, 1, queues[0], queues[1])
+    stages = [fetch,
+              _stage("rinex3_rinex2", _convert, n_convert, queues[1], queues[2]),
+              _stage("rinex2snr", _snr, n_snr, queues[2], queues[3]),
+              _stage("gnssir", _gnssir, n_gnssir, queues[3], queues[4])]
+    for stage in stages:
+        stage.start()
+
+    # Feed the days, blocking while the first stage is busy. Without download
+    # only the days with a Rinex3 file are fed, so gaps are not attempted.
+    present = set()
+    for station in stations if not download else []:
+        station_dir = os.path.join(rinex3_path, station.station_id)
+        present.update((station.station_id, y, doy) for _, y, doy in
+                       src.scan_work_items(station_dir, station.station_id, days, file_types=("rinex3",)))
+    for day_year, doy in days:
+        for station in stations:
+            if download or (station.station_id, day_year, doy) in present:
+                queues[0].put(day_item(station=station, year=day_year, doy=doy,
+                                       station_dir=os.path.join(rinex3_path, station.station_id)))
+    queues[0].put(_DONE)
+
+    results = []
+    while True:
+        item = queues[4].get()
+        if item is _DONE:
+            break
+        if item.workspace is not None:
+            item.workspace.close()      # Days that failed before the SNR file was made
+        print(f">>  {item.station.station_id} {item.year} {item.doy:03d}: {item.status}")
+        results.append(item)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Streaming download -> convert -> SNR -> GNSS-IR pipeline.")
+    parser.add_argument("year", type=int, help="Year (e.g., 2024)")
+    parser.add_argument("doy_start", type=int, help="Start DOY (e.g., 140)")
+    parser.add_argument("doy_end", type=int, help="End DOY (e.g., 145)")
+    parser.add_argument("--year_end", type=int, default=None, help="Year of doy_end, for runs across New Year")
+    parser.add_argument("--stations", nargs="+", default=None, help="Station IDs (default: all in registry)")
+    parser.add_argument("--registry", default=REGISTRY_PATH, help="Station registry file")
+    parser.add_argument("--rinex3_path", default=RINEX3_PATH, help="Root data directory")
+    parser.add_argument("--no_download", action="store_true", help="Use files already in the data directory")
+    parser.add_argument("--queue_size", type=int, default=4, help="Days waiting in front of each stage")
+    parser.add_argument("--no_prefetch", action="store_true", help="Leave fetching the orbits to rinex2snr")
+    parser.add_argument("--prometheus", default=None, help="Write the stage measurements as a Prometheus text file")
+    parser.add_argument("--backend", default=gnssrefl_backend.BACKEND, choices=["shell", "inprocess"],
+                        help="Run gnssrefl commands as shell subprocesses or in-process in worker processes")
+    args = parser.parse_args()
+    gnssrefl_backend.set_backend(args.backend)
+
+    registry = src.load_station_registry(args.registry)
+    station_ids = [s.upper() for s in args.stations] if args.stations else list(registry)
+    run_pipeline([registry[s] for s in station_ids], args.year, args.doy_start, args.doy_end,
+                 rinex3_path=args.rinex3_path, download=not args.no_download, queue_size=args.queue_size,
+                 year_end=args.year_end, prefetch_orbits=not args.no_prefetch)
+    if args.prometheus:
+        instrumentation.write_prometheus(args.prometheus)
@@ -1,16 +1,32 @@
 #!/usr/bin/env python3
 
 import os 
+import calendar
 import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from tqdm import tqdm
 import numpy as np
 import re
-from dataclasses import dataclass, asdict
+from gnssrefl_backend import run_command
+from core_scheduler import available_cores
+import rinex_header_index
+import json
+from datetime import datetime, timedelta
+from dataclasses import dataclass, asdict, field
 from pprint import pprint
 
 
-def load_Rinex_files(rinex3_path): 
+# Rinex3 long file name: {station}00GRL_R_{yyyy}{doy}{hh}{mm}_{period}_{sampling}_MO.crx.gz
+RINEX3_LONG_NAME = re.compile(r"^([A-Za-z0-9]{4})\w{5}_\w_(\d{4})(\d{3})(\d{2})(\d{2})_(01D|01H|15M)_\w{3}_\w{2}\.")
+# Rinex3 file periods: daily, hourly and 15 minute files
+RINEX3_PERIODS = {"01D": 86400, "01H": 3600, "15M": 900}
+
+
+def load_Rinex_files(rinex3_path, station_id=None): 
     rinex3_files = [f for f in os.listdir(rinex3_path) if f.endswith('.gz')]
+    if station_id is not None:
+        # Only the files of one station, the directory may be shared
+        rinex3_files = [f for f in rinex3_files if f[0:4].upper() == station_id.upper()]
     return rinex3_files
 
 def get_info(rinex3_file): 
@@ -20,10 +36,76 @@ def get_info(rinex3_file):
     doy = info[2][4:7]
     return station_id, year, doy
 
-def run_convert_rinex3_2(rinex3_file):
+def parse_rinex3_name(rinex3_file):
+    """
+    Station, start time and period of a Rinex3 long file name, daily or sub-daily.
+
+    E.g. NUK200GRL_R_20241401300_01H_01S_MO.crx.gz -> ("nuk2", datetime(2024, 5, 19, 13, 0), 3600)
+
+    Returns:
+    - tuple: (station_id, start datetime, period in seconds), None if not a Rinex3 file name.
+    """
+    match = RINEX3_LONG_NAME.match(os.path.basename(rinex3_file))
+    if not match:
+        return None
+    station_id, year, doy, hour, minute, period = match.groups()
+    start = datetime(int(year), 1, 1) + timedelta(days=int(doy) - 1, hours=int(hour), minutes=int(minute))
+    return station_id.lower(), start, RINEX3_PERIODS[period]
+
+def run_convert_rinex3_2(rinex3_file, cwd=None):
     # Convert Rinex3 -> Rinex2 using rinex3_rinex2
     rinex3_command = f"rinex3_rinex2 {rinex3_file}"
-    subprocess.run(rinex3_command, check=True, shell=True)
+    run_command(rinex3_command, cwd=cwd)
+
+@dataclass
+class conversion_result:
+    rinex3_file: str
+    success: bool
+    error: str = ""
+
+def convert_rinex3_files(rinex3_files, max_workers=None, cwd=None):
+    """
+    Convert Rinex3 -> Rinex2 for many files at once with a bounded worker pool.
+
+    Each conversion runs outside this interpreter (a rinex3_rinex2 subprocess or
+    a gnssrefl worker process), so threads are enough to keep the workers busy. A failing file (e.g. a corrupt day) is
+    reported but does not stop the remaining conversions.
+
+    Args:
+    - rinex3_files (list): Rinex3 file names (relative to cwd) or paths.
+    - max_workers (int): Number of simultaneous conversions (default: count_nr_cores()).
+    - cwd (str): Directory the conversions are run in.
+
+    Returns:
+    - list: conversion_result per file, in the order of rinex3_files.
+    """
+    if max_workers is None:
+        max_workers = count_nr_cores()
+    max_workers = max(1, min(max_workers, len(rinex3_files) or 1))
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as pool, tqdm(total=len(rinex3_files)) as pbar:
+        futures = {pool.submit(run_convert_rinex3_2, rinex3_file, cwd): rinex3_file for rinex3_file in rinex3_files}
+        for future in as_completed(futures):
+            rinex3_file = futures[future]
+            try:
+                future.result()
+                results[rinex3_file] = conversion_result(rinex3_file, True)
+            except (subprocess.CalledProcessError, OSError) as e:
+                results[rinex3_file] = conversion_result(rinex3_file, False, str(e))
+            pbar.update(1)
+
+    failed = [r for r in results.values() if not r.success]
+    if failed:
+        print(f"Conversion failed for {len(failed)} of {len(rinex3_files)} Rinex3 files:")
+        for r in failed:
+            print(f"    {r.rinex3_file}: {r.error}")
+    return [results[rinex3_file] for rinex3_file in rinex3_files]
+
+def run_convert_rinex2_snr_range(station_id, year, doy, doy_end, n_cores, samplerate, snr, cwd=None):
+    # Convert Rinex2 -> SNR for a DOY range using the station specific sample rate and SNR choice
+    rinex2_command = f"rinex2snr {station_id} {year} {doy} -doy_end {doy_end} -orb gbm -nolook True -samplerate {samplerate} -snr {snr} -overwrite OVERWRITE -par {n_cores}"
+    run_command(rinex2_command, cwd=cwd)
 
 def determine_new_path(rinex3_file): 
     new_path = rinex3_file.split(".")
@@ -82,9 +164,86 @@ def xyz2llhd(xyz):
         i+=1
     return lat*180/np.pi, lon*180/np.pi, h
 
+def llh2xyz(lat, lon, height):
+    """
+    Converts latitude,longitude,height to cartesian coordinates,
+    for a single position or for arrays of N positions
+
+    Parameters
+    ----------
+    lat : float or (N,) array
+        latitude in degrees
+
+    lon : float or (N,) array
+        longitude in degrees
+
+    height : float or (N,) array
+        ellipsoidal height in WGS84 in meters
+
+    Returns
+    -------
+    xyz : (3,) or (N,3) numpy array of floats
+        Cartesian position in meters
+
+    """
+    lat = np.asarray(lat, dtype=float)*np.pi/180
+    lon = np.asarray(lon, dtype=float)*np.pi/180
+    height = np.asarray(height, dtype=float)
+    n = wgs84.a/np.sqrt(1-wgs84.e**2*np.sin(lat)**2)
+    x = (n+height)*np.cos(lat)*np.cos(lon)
+    y = (n+height)*np.cos(lat)*np.sin(lon)
+    z = (n*(1-wgs84.e**2)+height)*np.sin(lat)
+    return np.stack([x, y, z], axis=-1)
+
+def xyz2llhd_batch(xyz, n_iter=2):
+    """
+    Converts an array of cartesian coordinates to latitude,longitude,height
+
+    Vectorized version of xyz2llhd using Bowring's closed form solution,
+    refined a fixed number of times so that all positions are converted
+    by the same whole-array operations (no per position loop).
+
+    Parameters
+    ----------
+    xyz : (N,3) or (3,) array of floats
+        Cartesian positions in meters
+
+    n_iter : int
+        number of Bowring iterations, one is already sub millimeter
+        for positions near the Earth surface
+
+    Returns
+    -------
+    lat : (N,) array
+        latitude in degrees
+
+    lon : (N,) array
+        longitude in degrees
+
+    h : (N,) array
+        ellipsoidal height in WGS84 in meters
+
+    """
+    xyz = np.asarray(xyz, dtype=float)
+    x = xyz[...,0]
+    y = xyz[...,1]
+    z = xyz[...,2]
+    a = wgs84.a
+    b = wgs84.a*(1-wgs84.f)
+    e2 = wgs84.e**2
+    ep2 = (a**2-b**2)/b**2
+
+    lon = np.arctan2(y, x)
+    p = np.hypot(x, y)
+    beta = np.arctan2(z*a, p*b)     # reduced latitude, first guess
+    for i in range(max(1, n_iter)):
+        lat = np.arctan2(z+ep2*b*np.sin(beta)**3, p-e2*a*np.cos(beta)**3)
+        beta = np.arctan2((1-wgs84.f)*np.sin(lat), np.cos(lat))
+    h = p*np.cos(lat) + z*np.sin(lat) - a*np.sqrt(1-e2*np.sin(lat)**2)
+    return lat*180/np.pi, lon*180/np.pi, h
+
 def extract_approx_xyz_from_rinex_file(file_path):
     with open(file_path, 'r') as rinex_file:
-        header_lines = []
         for line in rinex_file:
             if "APPROX POSITION XYZ" in line:
                 # Extract the XYZ values using a regular expression
@@ -92,12 +251,16 @@ def extract_approx_xyz_from_rinex_file(file_path):
                 if match:
                     x, y, z = map(float, match.groups())
                     return x, y, z
-            header_lines.append(line)  # Store header lines in case you need them
+            if "END OF HEADER" in line:
+                # The position is only given in the header, do not scan the observations
+                break
 
     return None
 
 def get_xyz(rinex_file_path): 
-    xyz = extract_approx_xyz_from_rinex_file(rinex_file_path)
+    # Header position through the header index, so an unchanged file is not opened again
+    with rinex_header_index.header_index() as index:
+        xyz = index.lookup(rinex_file_path)
     if xyz is not None:
         x, y, z = xyz
         print(f"Approximate Position XYZ: x={x}, y={y}, z={z}")
@@ -106,6 +269,7 @@ def get_xyz(rinex_file_path):
         lat = input("Input the Latitude for the reciever: ")
         lon = input("Input the Longitude for the reciever: ")
         height = input("Input the reciever height (Ellipsoidal, H): ")
+        return float(lat), float(lon), float(height)
 
     lat, lon, height = xyz2llhd(xyz)
     return lat, lon, height
@@ -140,18 +304,61 @@ def create_json(station_id, lat, lon, height, input_orig):
 
     # refl_zones dmht -lat 76.76853 -lon -18.670557 -height 43.222 -el_list 2 7 15 -azlist 110 190
     gnssir_input_command = f"gnssir_input {station_id} -lat {lat} -lon {lon} -height {height} -e1 {input_orig.e1} -e2 {input_orig.e2} -h1 {input_orig.h1} -h2 {input_orig.h2} -nr1 {input_orig.nr1} -nr2 {input_orig.nr2} -peak2noise {input_orig.peak2noise} -ampl {input_orig.ampl} -frlist {input_orig.frlist} -azlist2 {input_orig.azlist2}"
-    subprocess.run(gnssir_input_command, check=True, shell=True)
+    run_command(gnssir_input_command)
     return
 
 def run_gnssIR(station_id, year, doy):
     gnssir_command = f"gnssir {station_id} {year} {doy} -snr 66"
-    subprocess.run(gnssir_command, check=True, shell=True)
+    run_command(gnssir_command)
+    return
+
+def run_gnssIR_range(station_id, year, doy, doy_end, n_cores, snr):
+    gnssir_command = f"gnssir {station_id} {year} {doy} -doy_end {doy_end} -snr {snr} -par {n_cores}"
+    run_command(gnssir_command)
     return
 
+@dataclass
+class station_config:
+    """
+    Processing parameters of a single station, as stored in the station registry
+    """
+    station_id: str
+    lat: float
+    lon: float
+    height: float               # Ellipsoidal height WGS84
+    samplerate: int             # rinex2snr -samplerate
+    rinex2snr_snr: int          # rinex2snr -snr
+    gnssir_snr: int             # gnssir -snr
+    gnssir_input: dict = field(default_factory=dict)
+    # Periodogram of the native estimator (reflector_height.py): "direct" or "fast". Used by the rolling
+    # window, param_sweep and benchmark; the daily processing runs gnssir and is not affected
+    periodogram: str = "direct"
+
+def load_station_registry(registry_path):
+    """
+    Load all stations from the station registry (JSON) file.
+
+    Args:
+    - registry_path (str): Path to the registry file, keyed by upper case station ID.
+
+    Returns:
+    - dict: {station_id: station_config}
+    """
+    with open(registry_path, 'r') as f:
+        registry = json.load(f)
+
+    stations = {}
+    for station_id, params in registry.items():
+        stations[station_id.upper()] = station_config(station_id=station_id.upper(), **params)
+    return stations
+
 
 def get_doy_range(directory):
     """
     Get the range of DOY (Day of Year) for RINEX2 files in the specified directory.
+
+    Only the first and last DOY are returned, for files of a single year.
+    Use scan_work_items and plan_batches for gaps and runs across New Year.
     
     Args:
     - directory (str): Path to the directory containing RINEX2 files.
@@ -188,12 +395,114 @@ def get_doy_range(directory):
     end_doy = max(doy_list)
     return station_id, year, (start_doy, end_doy)
 
-def count_nr_cores(): 
-    n_cores = os.cpu_count()
-    if n_cores > 10: 
-        n_cores = 10
-        return n_cores
-    else: 
-        return n_cores
+def rinex2_file_name(station_id, year, doy):
+    # Rinex2 file name as written by rinex3_rinex2: {station_id}{doy}0.{yy}o
+    return f"{station_id.lower()}{int(doy):03d}0.{str(year)[2:4]}o"
+
+def snr_file_path(station_id, year, doy, snr_option):
+    """
+    Path of the SNR file as expected by gnssir: $REFL_CODE/{year}/snr/{station}/{station}{doy}0.{yy}.snr{option}
+    """
+    station_id = station_id.lower()
+    yy = str(year)[2:4]
+    return os.path.join(os.environ.get('REFL_CODE', '.'), str(year), 'snr', station_id,
+                        f"{station_id}{int(doy):03d}0.{yy}.snr{snr_option}")
+
+def gnssir_result_path(station_id, year, doy):
+    # Reflector heights written by gnssir: $REFL_CODE/{year}/results/{station}/{doy}.txt
+    return os.path.join(os.environ.get('REFL_CODE', '.'), str(year), 'results', station_id.lower(),
+                        f"{int(doy):03d}.txt")
+
+def contiguous_runs(doy_list):
+    """
+    Group DOYs into runs of consecutive days, e.g. [1, 2, 3, 7, 8] -> [(1, 3), (7, 8)]
+    """
+    runs = []
+    for doy in sorted(set(doy_list)):
+        if runs and doy == runs[-1][1] + 1:
+            runs[-1] = (runs[-1][0], doy)
+        else:
+            runs.append((doy, doy))
+    return runs
+
+def day_range(year, doy_start, doy_end, year_end=None):
+    """
+    Every (year, doy) from doy_start of year to doy_end of year_end (default: the same year), across New Year.
+    """
+    year_end = year if year_end is None else year_end
+    days = []
+    for y in range(year, year_end + 1):
+        first = doy_start if y == year else 1
+        last = doy_end if y == year_end else 365 + calendar.isleap(y)
+        days += [(y, doy) for doy in range(first, last + 1)]
+    return days
+
+def scan_work_items(directory, station_id=None, days=None, file_types=("rinex3", "rinex2")):
+    """
+    Station-days with data in a directory, from the Rinex3 and Rinex2 file names found there.
+
+    Args:
+    - directory (str): Directory with daily Rinex3 (KULL00GRL_R_20241400000_01D_...) and/or Rinex2 (kull1400.24o)
+      files. Sub-daily Rinex3 files are left to the rolling window (see rolling_window.py).
+    - station_id (str): Only this station.
+    - days (iterable): Only these (year, doy), e.g. from day_range.
+    - file_types (tuple): File types that count as data, "rinex3" and/or "rinex2".
+
+    Returns:
+    - list: Sorted (station_id, year, doy) work items, station in lower case.
+    """
+    rinex3_pattern = re.compile(r"^([A-Za-z0-9]{4})\w{5}_\w_(\d{4})(\d{3})0000_01D_.*\.gz$")
+    rinex2_pattern = re.compile(r"^([a-zA-Z0-9]{4})(\d{3})0\.(\d{2})o$")
+    days = None if days is None else set(days)
+
+    items = set()
+    for filename in os.listdir(directory):
+        rinex3_match, rinex2_match = rinex3_pattern.match(filename), rinex2_pattern.match(filename)
+        if rinex3_match and "rinex3" in file_types:
+            station, year, doy = rinex3_match.group(1), int(rinex3_match.group(2)), int(rinex3_match.group(3))
+        elif rinex2_match and "rinex2" in file_types:
+            station, year, doy = rinex2_match.group(1), int(rinex2_match.group(3)) + 2000, int(rinex2_match.group(2))
+        else:
+            continue
+        if station_id is not None and station.lower() != station_id.lower():
+            continue
+        if days is None or (year, doy) in days:
+            items.add((station.lower(), year, doy))
+    return sorted(items)
+
+def plan_batches(work_items, max_days=None):
+    """
+    Group work items into batches of consecutive days, one rinex2snr/gnssir -doy_end call each.
+
+    A batch never spans a gap (days without data are not attempted) or a
+    year boundary (gnssrefl takes a single year per call), e.g.
+    [(kull, 2023, 364), (kull, 2023, 365), (kull, 2024, 1), (kull, 2024, 3)]
+    -> [(kull, 2023, 364, 365), (kull, 2024, 1, 1), (kull, 2024, 3, 3)]
+
+    Args:
+    - work_items (list): (station_id, year, doy) work items, e.g. from scan_work_items.
+    - max_days (int): Split longer runs into batches of at most this many days.
+
+    Returns:
+    - list: (station_id, year, doy_start, doy_end) batches, sorted by station and time.
+    """
+    doys = {}
+    for station_id, year, doy in work_items:
+        doys.setdefault((station_id, int(year)), []).append(int(doy))
+
+    batches = []
+    for (station_id, year), doy_list in sorted(doys.items()):
+        for first_doy, last_doy in contiguous_runs(doy_list):
+            step = max_days or last_doy - first_doy + 1
+            for doy in range(first_doy, last_doy + 1, step):
+                batches.append((station_id, year, doy, min(doy + step - 1, last_doy)))
+    return batches
+
+def count_nr_cores(max_cores=None): 
+    # Logical processors this process may use (CPU affinity and cgroup limits respected)
+    n_cores = available_cores()
+    if max_cores is not None: 
+        n_cores = min(n_cores, max_cores)
+    return n_cores
 
 
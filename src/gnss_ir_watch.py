@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+
+import os
+import time
+import ctypes
+import ctypes.util
+import select
+import struct
+import argparse
+from concurrent.futures import ProcessPoolExecutor, wait
+import gnss_ir_util as src
+import gnssrefl_backend
+import processing_manifest
+import core_scheduler
+import instrumentation
+import gnss_ir_network
+import orbit_cache
+import rolling_window
+
+# ------------------------------ Defaults ----------------------------------
+REGISTRY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "stations.json")
+RINEX3_PATH = gnss_ir_network.RINEX3_PATH       # Incoming files, one sub directory per station
+POLL_INTERVAL = 10.0        # Seconds between directory scans without inotify
+SETTLE_TIME = 30.0          # Without inotify a file unchanged for this long is taken as complete
+BATCH_WAIT = 5.0            # Seconds to wait for more files of a station before processing
+ORBIT_RETRY = 600.0         # Seconds before an orbit that could not be fetched is tried again, doubled per failure
+ORBIT_RETRY_MAX = 6 * 3600.0
+# --------------------------------------------------------------------------
+
+SUBDAILY = "sub-daily"      # Job key of the rolling window updates of a station
+# inotify(7)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+EVENT_HEADER = struct.Struct("iIII")        # wd, mask, cookie, len
+
+
+class _inotify_watcher:
+    """
+    Completed files from inotify: a file is complete when the writer closes it
+    (IN_CLOSE_WRITE) or when it is renamed into place (IN_MOVED_TO, e.g. a
+    finished .part download). Only for local file systems.
+    """
+    def __init__(self, directories):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.directories = {}
+        for directory in directories:
+            wd = libc.inotify_add_watch(self.fd, os.fsencode(directory), IN_CLOSE_WRITE | IN_MOVED_TO)
+            if wd < 0:
+                os.close(self.fd)
+                raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {directory}")
+            self.directories[wd] = directory
+
+    def completed(self, timeout):
+        """
+        Paths of the files completed within timeout seconds, None when events were lost.
+        """
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+        paths, overflow = [], False
+        while True:
+            try:
+                buffer = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(buffer):
+                wd, mask, _, length = EVENT_HEADER.unpack_from(buffer, offset)
+                name = buffer[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b"\0")
+                offset += EVENT_HEADER.size + length
+                if mask & IN_Q_OVERFLOW:
+                    overflow = True
+                elif wd in self.directories:
+                    paths.append(os.path.join(self.directories[wd], os.fsdecode(name)))
+        return None if overflow else paths
+
+    def close(self):
+        os.close(self.fd)
+
+
+class _polling_watcher:
+    """
+    Completed files from directory scans: a file is complete when its size and
+    modification time have not changed for settle_time seconds. Works on any
+    file system, e.g. network mounts where inotify sees no remote writes.
+    """
+    def __init__(self, directories, poll_interval=POLL_INTERVAL, settle_time=SETTLE_TIME):
+        self.directories = list(directories)
+        self.poll_interval = poll_interval
+        self.settle_time = settle_time
+        self.seen = {}          # path -> (size, mtime, time first seen with that size and mtime)
+        self.reported = {}      # path -> (size, mtime) when reported; a replaced file is reported again
+
+    def completed(self, timeout):
+        time.sleep(min(timeout, self.poll_interval))
+        now, paths, present = time.time(), [], set()
+        for directory in self.directories:
+            for entry in os.scandir(directory):
+                if not entry.is_file():
+                    continue
+                present.add(entry.path)
+                stat = entry.stat()
+                if self.reported.get(entry.path) == (stat.st_size, stat.st_mtime):
+                    continue
+                size, mtime, since = self.seen.get(entry.path, (None, None, now))
+                if (size, mtime) != (stat.st_size, stat.st_mtime):
+                    self.seen[entry.path] = (stat.st_size, stat.st_mtime, now)
+                elif now - since >= self.settle_time:
+                    self.reported[entry.path] = (size, mtime)
+                    del self.seen[entry.path]
+                    paths.append(entry.path)
+        # Forget removed files (e.g. moved into their station directory)
+        for path in set(self.reported) - present:
+            del self.reported[path]
+        for path in set(self.seen) - present:
+            del self.seen[path]
+        return paths
+
+    def close(self):
+        pass
+
+
+def _existing_files(directories):
+    # Files already in place when the watch starts, or when inotify events were lost
+    return [entry.path for directory in directories for entry in os.scandir(directory) if entry.is_file()]
+
+def _station_file(path, registry, rinex3_path, queued):
+    """
+    (station_id, start datetime, period in seconds, path in the station directory)
+    of a completed Rinex3 file of a registry station, daily or sub-daily. None
+    for other files (partial downloads end in .part) and for files queued
+    before with the same modification time.
+
+    Files dropped in the root of rinex3_path are moved into their station directory.
+    """
+    parsed = src.parse_rinex3_name(path)
+    if (parsed is None or not path.endswith(".gz") or parsed[0].upper() not in registry
+            or not os.path.exists(path)):
+        return None
+    station_id, start, period = parsed[0].upper(), parsed[1], parsed[2]
+    station_path = os.path.join(rinex3_path, station_id, os.path.basename(path))
+    if os.path.abspath(path) != os.path.abspath(station_path):
+        os.replace(path, station_path)
+    mtime = os.path.getmtime(station_path)
+    if queued.get(station_path) == mtime:
+        return None         # Seen again after the move, or by the scanner
+    queued[station_path] = mtime
+    return station_id, start, period, station_path
+
+def _prefetch_orbits(days, failed, now=None):
+    """
+    Prefetch the orbits of the days about to be processed, except days whose
+    orbit could not be fetched before and that are not due for a retry yet
+    (rinex2snr then looks for the orbit itself).
+
+    Args:
+    - days (iterable): (year, doy) of the jobs being submitted.
+    - failed (dict): {(year, doy): (failures, time of the next attempt)}, updated in place.
+
+    Returns:
+    - dict: {(year, doy): SP3 path or None} of the days attempted.
+    """
+    now = time.time() if now is None else now
+    due = sorted(day for day in set(days) if failed.get(day, (0, 0.0))[1] <= now)
+    if not due:
+        return {}
+    paths = orbit_cache.get_cache().prefetch(due)
+    for day, path in paths.items():
+        if path is None:
+            failures = failed.get(day, (0, 0.0))[0] + 1
+            failed[day] = (failures, now + min(ORBIT_RETRY * 2 ** (failures - 1), ORBIT_RETRY_MAX))
+        else:
+            failed.pop(day, None)
+    return paths
+
+def watch(stations, rinex3_path=RINEX3_PATH, manifest_path=processing_manifest.MANIFEST_PATH, max_workers=None,
+          total_cores=None, use_inotify=True, poll_interval=POLL_INTERVAL, settle_time=SETTLE_TIME,
+          batch_wait=BATCH_WAIT, scratch_root=None, tmpfs=False, prometheus_path=None, stop=None):
+    """
+    Process Rinex3 files as they land in the data directory, until interrupted.
+
+    Every completed file goes through conversion, SNR extraction and GNSS-IR
+    right away and its reflector heights are appended to the station's result
+    store, so the latency is minutes after arrival. Files arriving close
+    together (within batch_wait seconds) are processed as one batch per
+    station and year. Hourly and 15 minute files go to the station's rolling
+    SNR window instead (see rolling_window.update). The processing manifest makes sure a day is only
+    processed again when its file changed, also across restarts: the files
+    already in place when the watch starts are processed first.
+
+    Args:
+    - stations (list): station_config objects to watch.
+    - rinex3_path (str): Data directory, one sub directory per station; files in the root are moved there.
+    - manifest_path (str): Processing manifest.
+    - max_workers (int): Number of stations processed at once (default: all).
+    - total_cores (int): Cores shared by all stations (default: what this process may use).
+    - use_inotify (bool): Use inotify, otherwise (or when unavailable) scan the directories.
+    - poll_interval, settle_time (float): Scan interval and time a file must be unchanged, when scanning.
+    - batch_wait (float): Seconds to wait for more files before processing.
+    - scratch_root, tmpfs: Scratch directories of the jobs, see gnss_ir_network.process_station.
+    - prometheus_path (str): Rewrite this Prometheus text file after every batch.
+    - stop (callable): Return True to end the watch (default: run until interrupted).
+    """
+    registry = {station.station_id: station for station in stations}
+    directories = [rinex3_path] + [os.path.join(rinex3_path, station_id) for station_id in registry]
+    for directory in directories:
+        os.makedirs(directory, exist_ok=True)
+
+    watcher = None
+    if use_inotify:
+        try:
+            watcher = _inotify_watcher(directories)
+        except (OSError, AttributeError) as e:
+            print(f">>  inotify not available ({e}), scanning every {poll_interval:.0f} s")
+    if watcher is None:
+        watcher = _polling_watcher(directories, poll_interval, settle_time)
+
+    scheduler = core_scheduler.core_scheduler(total_cores)
+    max_workers = max(1, min(max_workers or len(registry), len(registry)))
+    pending = {}            # (station_id, year) -> DOYs waiting to be processed
+                            # (station_id, SUBDAILY) -> sub-daily files waiting for the rolling window
+    running = {}            # future -> (station_id, year, DOYs)
+    queued = {}             # Rinex3 file -> modification time when it was queued
+    orbit_failures = {}     # (year, doy) -> (failed fetches, time of the next attempt)
+    last_arrival = 0.0
+    # The files already in place are processed first (the scanner finds them itself once settled)
+    arrived = _existing_files(directories) if isinstance(watcher, _inotify_watcher) else []
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=core_scheduler.install,
+                             initargs=(scheduler,)) as pool:
+        try:
+            while not (stop and stop()):
+                for path in arrived:
+                    station_file = _station_file(path, registry, rinex3_path, queued)
+                    if station_file:
+                        station_id, start, period, station_path = station_file
+                        if period < 86400:
+                            pending.setdefault((station_id, SUBDAILY), set()).add(station_path)
+                        else:
+                            pending.setdefault((station_id, start.year), set()).add(start.timetuple().tm_yday)
+                        last_arrival = time.time()
+
+                # Process once no more files came in for batch_wait seconds, one job per station and year
+                busy = {key[:2] for key in running.values()}
+                if pending and time.time() - last_arrival >= batch_wait:
+                    submit = [key for key in pending if key not in busy]
+                    # Stations receiving the same days share one orbit fetch
+                    _prefetch_orbits([(key[1], doy) for key in submit if key[1] != SUBDAILY for doy in pending[key]],
+                                     orbit_failures)
+                    for key in submit:
+                        station_id, year = key
+                        if year == SUBDAILY:
+                            paths = sorted(pending.pop(key))
+                            print(f">>  {station_id}: adding {len(paths)} sub-daily files to the rolling window")
+                            future = pool.submit(rolling_window.update, registry[station_id], paths)
+                            running[future] = (station_id, year, paths)
+                            continue
+                        doys = sorted(pending.pop(key))
+                        print(f">>  {station_id} {year}: processing DOY {', '.join(str(d) for d in doys)}")
+                        future = pool.submit(gnss_ir_network.process_station, registry[station_id], year,
+                                             doys[0], doys[-1], rinex3_path, False, manifest_path,
+                                             scratch_root, tmpfs)
+                        running[future] = (station_id, year, doys)
+
+                if running:
+                    done, _ = wait(list(running), timeout=0)
+                    for future in done:
+                        station_id, year, _ = running.pop(future)
+                        try:
+                            if year == SUBDAILY:
+                                status = f"{future.result()} new reflector heights"
+                            else:
+                                _, status = future.result()
+                        except Exception as e:
+                            status = f"failed: {e}"
+                        print(f">>  {station_id} {year}: {status}")
+                        if prometheus_path:
+                            instrumentation.write_prometheus(prometheus_path)
+
+                timeout = batch_wait if pending or running else poll_interval
+                arrived = watcher.completed(timeout)
+                if arrived is None:
+                    arrived = _existing_files(directories)      # inotify queue overflow, rescan
+        except KeyboardInterrupt:
+            print(">>  Stopping, waiting for the running jobs")
+        finally:
+            watcher.close()
+            wait(list(running))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Process Rinex3 files of the registry stations as they arrive.")
+    parser.add_argument("--stations", nargs="+", default=None, help="Station IDs (default: all in registry)")
+    parser.add_argument("--registry", default=REGISTRY_PATH, help="Station registry file")
+    parser.add_argument("--rinex3_path", default=RINEX3_PATH, help="Data directory to watch")
+    parser.add_argument("--workers", type=int, default=None, help="Number of stations processed at once")
+    parser.add_argument("--cores", type=int, default=None, help="Cores shared by all stations (default: all available)")
+    parser.add_argument("--manifest", default=processing_manifest.MANIFEST_PATH, help="Processing manifest")
+    parser.add_argument("--poll", action="store_true", help="Scan the directories instead of using inotify")
+    parser.add_argument("--poll_interval", type=float, default=POLL_INTERVAL, help="Seconds between scans")
+    parser.add_argument("--settle_time", type=float, default=SETTLE_TIME,
+                        help="Seconds a file must be unchanged to count as complete when scanning")
+    parser.add_argument("--batch_wait", type=float, default=BATCH_WAIT,
+                        help="Seconds to wait for more files before processing")
+    parser.add_argument("--scratch", default=None, help="Directory for the scratch directories of the jobs")
+    parser.add_argument("--tmpfs", action="store_true", help="Put the scratch directories on tmpfs (/dev/shm)")
+    parser.add_argument("--prometheus", default=None, help="Keep a Prometheus text file of the stage measurements")
+    parser.add_argument("--backend", default=gnssrefl_backend.BACKEND, choices=["shell", "inprocess"],
+                        help="Run gnssrefl commands as shell subprocesses or in-process in worker processes")
+    args = parser.parse_args()
+    gnssrefl_backend.set_backend(args.backend)
+
+    registry = src.load_station_registry(args.registry)
+    station_ids = [s.upper() for s in args.stations] if args.stations else list(registry)
+    missing = [s for s in station_ids if s not in registry]
+    if missing:
+        parser.error(f"Stations not in registry: {' '.join(missing)}")
+
+    watch([registry[s] for s in station_ids], rinex3_path=args.rinex3_path, manifest_path=args.manifest,
+          max_workers=args.workers, total_cores=args.cores, use_inotify=not args.poll,
+          poll_interval=args.poll_interval, settle_time=args.settle_time, batch_wait=args.batch_wait,
+          scratch_root=args.scratch, tmpfs=args.tmpfs, prometheus_path=args.prometheus)
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import shlex
+import importlib
+import multiprocessing
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+import instrumentation
+import core_scheduler
+
+# gnssrefl commands and the module holding their entry point (main)
+ENTRY_POINTS = {
+    "rinex3_rinex2": "gnssrefl.rinex3_rinex2",
+    "rinex2snr": "gnssrefl.rinex2snr_cl",
+    "gnssir_input": "gnssrefl.gnssir_input",
+    "gnssir": "gnssrefl.gnssir_cl",
+}
+
+# "shell": one subprocess per command, "inprocess": call gnssrefl in long-lived worker processes
+BACKEND = os.environ.get("GNSS_IR_BACKEND", "shell")
+# Worker processes of the inprocess backend, default: the cores of the process's core scheduler
+MAX_WORKERS = int(os.environ["GNSS_IR_BACKEND_WORKERS"]) if os.environ.get("GNSS_IR_BACKEND_WORKERS") else None
+
+_pool = None
+
+
+def set_backend(backend, max_workers=None):
+    """
+    Select how gnssrefl commands are run: "shell" or "inprocess".
+    """
+    global BACKEND, MAX_WORKERS
+    if backend not in ("shell", "inprocess"):
+        raise ValueError(f"Unknown backend '{backend}', use 'shell' or 'inprocess'")
+    BACKEND = backend
+    os.environ["GNSS_IR_BACKEND"] = backend     # Also for worker processes that are spawned
+    if max_workers is not None:
+        MAX_WORKERS = max_workers
+        os.environ["GNSS_IR_BACKEND_WORKERS"] = str(max_workers)
+    shutdown()
+
+def shutdown():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown()
+        _pool = None
+
+def _import_entry_points():
+    # Worker initializer: pay the gnssrefl import cost once per worker process
+    for module in ENTRY_POINTS.values():
+        importlib.import_module(module)
+
+def _call_entry_point(command, cwd):
+    """
+    Run a gnssrefl command line inside this (worker) process.
+    """
+    argv = shlex.split(command)
+    main = importlib.import_module(ENTRY_POINTS[argv[0]]).main
+    old_argv, old_cwd = sys.argv, os.getcwd()
+    sys.argv = argv
+    try:
+        if cwd:
+            os.chdir(cwd)
+        with instrumentation.measure(argv[0], exclusive=True, **instrumentation.labels_from_command(command)):
+            try:
+                main()
+            except SystemExit as e:
+                if e.code not in (None, 0):
+                    raise subprocess.CalledProcessError(e.code if isinstance(e.code, int) else 1, command)
+    finally:
+        sys.argv = old_argv
+        os.chdir(old_cwd)
+
+def _inprocess_available():
+    try:
+        importlib.import_module("gnssrefl")
+        return True
+    except ImportError:
+        return False
+
+def _get_pool():
+    global _pool, BACKEND
+    if _pool is None:
+        if not _inprocess_available():
+            print("gnssrefl can not be imported, falling back to the shell backend")
+            BACKEND = "shell"
+            return None
+        # At most the core budget (cgroup and affinity aware, shared by the stations when installed). Every
+        # command runs under a core grant, and with a non-fork context a worker is only started when none is
+        # idle, so a station process holds as many workers as commands it runs at the same time
+        max_workers = MAX_WORKERS or core_scheduler.get_scheduler().total_cores
+        _pool = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("forkserver"),
+                                    initializer=_import_entry_points)
+    return _pool
+
+def run_command(command, cwd=None):
+    """
+    Run a gnssrefl command line, e.g. "gnssir kull 2024 140 -snr 66".
+
+    With the "inprocess" backend the entry point of the command is called as a
+    Python function in a pool of long-lived worker processes that imported
+    gnssrefl once, instead of starting a new interpreter for every command.
+    Other commands, and every command with the "shell" backend, are run in a
+    shell. Failures raise subprocess.CalledProcessError for both backends and
+    the resources of every command are recorded (see instrumentation.py).
+    """
+    name = shlex.split(command)[0]
+    pool = _get_pool() if BACKEND == "inprocess" and name in ENTRY_POINTS else None
+    if pool is None:
+        instrumentation.run_subprocess(command, cwd=cwd)
+        return
+
+    try:
+        pool.submit(_call_entry_point, command, cwd).result()
+    except subprocess.CalledProcessError:
+        raise
+    except Exception as e:
+        raise subprocess.CalledProcessError(1, command) from e
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import json
+import time
+import fcntl
+import shlex
+import socket
+import resource
+import argparse
+import subprocess
+from contextlib import contextmanager
+from datetime import datetime
+
+# ---- Defaults ----
+# Every measured stage is appended as one JSON line, "" disables the instrumentation
+METRICS_PATH = os.environ.get("GNSS_IR_METRICS",
+                              os.path.join(os.environ.get('REFL_CODE', '.'), "gnss_ir_metrics.jsonl"))
+PROMETHEUS_PREFIX = "gnss_ir_stage"
+# ------------------
+
+# Rinex3 long file name: KULL00GRL_R_20241400000_01D_15S_MO.crx.gz
+RINEX3_NAME = re.compile(r"^([A-Za-z0-9]{4})\w{5}_\w_(\d{4})(\d{3})")
+
+
+def _read_proc_io():
+    # Bytes this process caused to be read from / written to storage
+    counters = {}
+    try:
+        with open("/proc/self/io", 'r') as f:
+            for line in f:
+                key, value = line.split(":")
+                counters[key] = int(value)
+    except OSError:
+        pass
+    return counters.get("read_bytes", 0), counters.get("write_bytes", 0)
+
+def _peak_rss(reset=False):
+    """
+    Peak resident set size of this process in bytes (VmHWM), optionally resetting it first.
+    """
+    if reset:
+        try:
+            with open("/proc/self/clear_refs", 'w') as f:
+                f.write("5")
+        except OSError:
+            pass
+        return None
+    try:
+        with open("/proc/self/status", 'r') as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def labels_from_command(command):
+    """
+    Station, year and DOY (range) of a gnssrefl command line, e.g. "rinex2snr kull 2024 140 -doy_end 145 ...".
+    """
+    argv = shlex.split(command)
+    labels = {"station": None, "year": None, "doy": None, "doy_end": None}
+    if len(argv) > 1 and RINEX3_NAME.match(os.path.basename(argv[1])):
+        station, year, doy = RINEX3_NAME.match(os.path.basename(argv[1])).groups()
+        labels.update(station=station.upper(), year=int(year), doy=int(doy))
+    elif len(argv) > 1 and re.fullmatch(r"[A-Za-z0-9]{4}", argv[1]):
+        labels["station"] = argv[1].upper()
+        if len(argv) > 3 and argv[2].isdigit() and argv[3].isdigit():
+            labels.update(year=int(argv[2]), doy=int(argv[3]))
+    if "-doy_end" in argv[:-1]:
+        labels["doy_end"] = int(argv[argv.index("-doy_end") + 1])
+    return labels
+
+def record(entry, metrics_path=None):
+    """
+    Append one stage measurement as a JSON line. Several processes may append at the same time.
+    """
+    metrics_path = METRICS_PATH if metrics_path is None else metrics_path
+    if not metrics_path:
+        return
+    if os.path.dirname(metrics_path):
+        os.makedirs(os.path.dirname(metrics_path), exist_ok=True)
+    with open(metrics_path, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        f.write(json.dumps(entry) + "\n")
+        fcntl.flock(f, fcntl.LOCK_UN)
+
+def _entry(stage, labels, start, wall, cpu, peak_rss, read_bytes, write_bytes, exit_status, error=None):
+    entry = {"stage": stage, **labels, "start": datetime.fromtimestamp(start).isoformat(timespec='seconds'),
+             "wall_s": round(wall, 3), "cpu_s": round(cpu, 3), "peak_rss_bytes": peak_rss,
+             "read_bytes": read_bytes, "write_bytes": write_bytes, "exit_status": exit_status,
+             "host": socket.gethostname(), "pid": os.getpid()}
+    if error:
+        entry["error"] = error
+    return entry
+
+def run_subprocess(command, cwd=None):
+    """
+    subprocess.run(command, shell=True, check=True) that records the resources of the command.
+
+    The child is reaped with os.wait4, which returns the CPU time, peak RSS and
+    block I/O of that child (and its reaped descendants) alone, so concurrent
+    commands are measured independently.
+    """
+    stage = shlex.split(command)[0]
+    start, wall = time.time(), time.perf_counter()
+    process = subprocess.Popen(command, shell=True, cwd=cwd)
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    record(_entry(stage, labels_from_command(command), start, time.perf_counter() - wall,
+                  usage.ru_utime + usage.ru_stime, usage.ru_maxrss * 1024,
+                  usage.ru_inblock * 512, usage.ru_oublock * 512, process.returncode))
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, command)
+
+@contextmanager
+def measure(stage, station=None, year=None, doy=None, doy_end=None, exclusive=False):
+    """
+    Record the resources of a block of Python code as a stage, e.g.
+
+        with instrumentation.measure("download", "KULL", 2024, 140): ...
+
+    The CPU time is that of the calling thread, plus that of the whole process
+    and its children with exclusive=True (a worker process running one job at
+    a time, whose peak RSS is then also reset at the start). I/O bytes and the
+    peak RSS are otherwise those of the whole process. The block may set the
+    exit status in the yielded dict; an exception is recorded with exit status
+    1 and raised again.
+    """
+    labels = {"station": station.upper() if station else None, "year": year, "doy": doy, "doy_end": doy_end}
+    start, wall = time.time(), time.perf_counter()
+    if exclusive:
+        _peak_rss(reset=True)
+        usage = [resource.getrusage(who) for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN)]
+        cpu = sum(u.ru_utime + u.ru_stime for u in usage)
+    else:
+        cpu = time.thread_time()
+    read_bytes, write_bytes = _read_proc_io()
+
+    outcome = {"exit_status": 0, "error": None}
+    try:
+        yield outcome
+    except BaseException as e:
+        outcome["exit_status"] = e.returncode if isinstance(e, subprocess.CalledProcessError) else 1
+        outcome["error"] = str(e) or type(e).__name__
+        raise
+    finally:
+        if exclusive:
+            usage = [resource.getrusage(who) for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN)]
+            cpu = sum(u.ru_utime + u.ru_stime for u in usage) - cpu
+        else:
+            cpu = time.thread_time() - cpu
+        end_read, end_write = _read_proc_io()
+        record(_entry(stage, labels, start, time.perf_counter() - wall, cpu, _peak_rss(),
+                      end_read - read_bytes, end_write - write_bytes, outcome["exit_status"], outcome["error"]))
+
+def write_prometheus(prometheus_path, metrics_path=None):
+    """
+    Write the last measurement of every station and stage, and run counts, as a
+    Prometheus text file (e.g. for the node_exporter textfile collector).
+    """
+    metrics_path = METRICS_PATH if metrics_path is None else metrics_path
+    latest, runs = {}, {}
+    if metrics_path and os.path.exists(metrics_path):
+        with open(metrics_path, 'r') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue        # A line cut short by a crash
+                key = (entry.get("station") or "", entry["stage"])
+                latest[key] = entry
+                status = "ok" if entry["exit_status"] == 0 else "failed"
+                runs[key + (status,)] = runs.get(key + (status,), 0) + 1
+
+    gauges = [("wall_seconds", "wall_s", "Wall time of the last run"),
+              ("cpu_seconds", "cpu_s", "CPU time of the last run"),
+              ("peak_rss_bytes", "peak_rss_bytes", "Peak resident memory of the last run"),
+              ("read_bytes", "read_bytes", "Bytes read from storage by the last run"),
+              ("write_bytes", "write_bytes", "Bytes written to storage by the last run"),
+              ("exit_status", "exit_status", "Exit status of the last run"),
+              ("last_run_timestamp_seconds", "start", "Start time of the last run")]
+    lines = []
+    for name, field, description in gauges:
+        lines += [f"# HELP {PROMETHEUS_PREFIX}_{name} {description} of a stage",
+                  f"# TYPE {PROMETHEUS_PREFIX}_{name} gauge"]
+        for (station, stage), entry in sorted(latest.items()):
+            value = entry.get(field)
+            if field == "start":
+                value = datetime.fromisoformat(value).timestamp()
+            if value is not None:
+                lines.append(f'{PROMETHEUS_PREFIX}_{name}{{station="{station}",stage="{stage}"}} {value}')
+    lines += [f"# HELP {PROMETHEUS_PREFIX}_runs_total Number of runs of a stage",
+              f"# TYPE {PROMETHEUS_PREFIX}_runs_total counter"]
+    for (station, stage, status), count in sorted(runs.items()):
+        lines.append(f'{PROMETHEUS_PREFIX}_runs_total{{station="{station}",stage="{stage}",status="{status}"}} {count}')
+
+    tmp_path = prometheus_path + ".part"
+    with open(tmp_path, 'w') as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(tmp_path, prometheus_path)       # The collector never reads a half written file
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarise the stage measurements of the processing runs.")
+    parser.add_argument("--metrics", default=METRICS_PATH, help="JSON lines file with the stage measurements")
+    parser.add_argument("--prometheus", default=None, help="Also write a Prometheus text file")
+    parser.add_argument("--slowest", type=int, default=10, help="Number of slowest station-days to list")
+    args = parser.parse_args()
+
+    with open(args.metrics, 'r') as f:
+        entries = [json.loads(line) for line in f if line.strip()]
+    totals = {}
+    for entry in entries:
+        total = totals.setdefault(entry["stage"], {"runs": 0, "failed": 0, "wall_s": 0.0, "cpu_s": 0.0})
+        total["runs"] += 1
+        total["failed"] += entry["exit_status"] != 0
+        total["wall_s"] += entry["wall_s"]
+        total["cpu_s"] += entry["cpu_s"]
+    for stage, total in totals.items():
+        print(f"{stage:16s} {total['runs']:6d} runs  {total['failed']:4d} failed  "
+              f"{total['wall_s']:10.1f} s wall  {total['cpu_s']:10.1f} s CPU")
+    print("Slowest:")
+    for entry in sorted(entries, key=lambda e: e["wall_s"], reverse=True)[:args.slowest]:
+        print(f"    {entry['stage']:16s} {entry.get('station')} {entry.get('year')} {entry.get('doy')}: "
+              f"{entry['wall_s']:.1f} s, peak {(entry['peak_rss_bytes'] or 0) / 1e6:.0f} MB, exit {entry['exit_status']}")
+    if args.prometheus:
+        write_prometheus(args.prometheus, args.metrics)
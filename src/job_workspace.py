@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+
+import os
+import shutil
+import tempfile
+
+# ---- Defaults ----
+SCRATCH_ROOT = os.environ.get("GNSS_IR_SCRATCH", tempfile.gettempdir())
+TMPFS_ROOT = "/dev/shm"             # RAM backed, for the short lived Rinex2 intermediates
+# ------------------
+
+
+class job_workspace:
+    """
+    Private scratch directory of one job (e.g. a station and DOY range).
+
+    The gnssrefl commands of the job run with the workspace as their working
+    directory (cwd=workspace.path), so concurrent jobs never share Rinex2 or
+    other intermediate files and no process-global os.chdir is needed. The
+    directory and everything left in it are removed when the job ends.
+
+        with job_workspace("KULL_2024140") as workspace:
+            name = workspace.add_input(rinex3_file)
+            src.run_convert_rinex3_2(name, cwd=workspace.path)
+    """
+    def __init__(self, name, root=None, tmpfs=False, keep=False):
+        self.name = name
+        if root is None:
+            root = TMPFS_ROOT if tmpfs and os.path.isdir(TMPFS_ROOT) else SCRATCH_ROOT
+        self.root = root
+        self.keep = keep
+        self.path = None
+
+    def open(self):
+        os.makedirs(self.root, exist_ok=True)
+        self.path = tempfile.mkdtemp(prefix=f"{self.name}_", dir=self.root)
+        return self
+
+    def close(self):
+        if self.path is not None and not self.keep:
+            shutil.rmtree(self.path, ignore_errors=True)
+        self.path = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def file(self, name):
+        return os.path.join(self.path, name)
+
+    def add_input(self, file_path, move=False):
+        """
+        Make an input file available in the workspace.
+
+        rinex3_rinex2 unpacks and deletes its input, so archived files are
+        hard linked (copied across file systems) and the archive stays intact.
+        With move=True the file is moved in instead, for inputs that are meant
+        to be consumed.
+
+        Returns:
+        - str: File name in the workspace.
+        """
+        name = os.path.basename(file_path)
+        target = self.file(name)
+        if move:
+            shutil.move(file_path, target)
+        else:
+            try:
+                os.link(file_path, target)
+            except OSError:
+                shutil.copy2(file_path, target)
+        return name
+
+    def remove(self, *names):
+        """
+        Remove intermediate files of a stage that succeeded, e.g. the Rinex2 files after rinex2snr.
+        """
+        for name in names:
+            try:
+                os.remove(self.file(name))
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import gzip
+import fcntl
+import hashlib
+import shutil
+import tempfile
+import subprocess
+import argparse
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import gnss_ir_util as src
+import snr_cache
+import sp3
+
+# ---- Defaults ----
+# Orbits are kept where gnssrefl looks for them ($ORBITS/{yyyy}/sp3), so rinex2snr -orb gbm finds them locally
+ORBITS_PATH = os.environ.get('ORBITS', os.path.join(os.environ.get('REFL_CODE', '.'), "orbits"))
+# Directory with the orbit products to copy from instead of downloading them (e.g. a mirror)
+ORBIT_SOURCE = os.environ.get("GNSS_IR_ORBIT_SOURCE", "")
+MAX_CACHE_BYTES = float(os.environ.get("GNSS_IR_ORBIT_CACHE_BYTES", 20e9))
+PARSED_SUFFIX = ".npc"
+# ------------------
+
+GPS_EPOCH = datetime(1980, 1, 6)
+# gnssrefl downloads into the working directory and stores the orbit under $ORBITS
+GFZ_FETCH = "import sys; from gnssrefl import gps; gps.gbm_orbits_direct(int(sys.argv[1]), int(sys.argv[2]), 0)"
+
+
+def gbm_names(year, doy):
+    """
+    File names of the GFZ multi-GNSS rapid orbit (-orb gbm) of a day, short name first as gnssrefl looks for it.
+    """
+    days = (datetime(int(year), 1, 1) + timedelta(days=int(doy) - 1) - GPS_EPOCH).days
+    long_name = f"{int(year)}{int(doy):03d}0000_01D_05M_ORB.SP3"
+    return [f"gbm{days // 7}{days % 7}.sp3", "GFZ0MGXRAP_" + long_name, "GBM0MGXRAP_" + long_name]
+
+
+class orbit_cache:
+    """
+    Local orbit products shared by all stations and days.
+
+    The SP3 file of a day is fetched once (from ORBIT_SOURCE or GFZ) into
+    $ORBITS/{yyyy}/sp3, where gnssrefl finds it, instead of being resolved by
+    every rinex2snr call. Parsed positions are kept next to it as a columnar
+    file (see snr_cache.write_columns) that all processes memory-map, so an
+    SP3 file is parsed once; SP3 files elsewhere are read directly, the cache
+    writes nothing outside its own files. The least recently used files are
+    removed when the cache grows beyond max_bytes.
+    """
+    def __init__(self, orbits_path=ORBITS_PATH, source=ORBIT_SOURCE, max_bytes=MAX_CACHE_BYTES):
+        # Absolute, so $ORBITS means the same for the gnssrefl fetch and rinex2snr in other working directories
+        self.orbits_path = os.path.abspath(orbits_path)
+        self.source = source
+        self.max_bytes = max_bytes
+        self.parsed_path = os.path.join(self.orbits_path, "parsed")
+
+    def sp3_dir(self, year):
+        return os.path.join(self.orbits_path, str(int(year)), "sp3")
+
+    @contextmanager
+    def _locked(self, name):
+        # Concurrent stations fetching or parsing the same file wait for the first one
+        os.makedirs(self.parsed_path, exist_ok=True)
+        with open(os.path.join(self.parsed_path, name + ".lock"), 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _touch(self, path):
+        # The access time marks the last use, for the LRU eviction (set explicitly, mounts often skip
+        # atime updates); the modification time is left alone, it validates the parsed positions
+        try:
+            os.utime(path, (datetime.now().timestamp(), os.stat(path).st_mtime))
+        except FileNotFoundError:
+            pass
+
+    def _parsed_file(self, sp3_path):
+        # Parsed positions of an SP3 file, named after the file and its location
+        key = hashlib.sha1(os.path.abspath(sp3_path).encode()).hexdigest()[:8]
+        return os.path.join(self.parsed_path, f"{os.path.basename(sp3_path)}.{key}{PARSED_SUFFIX}")
+
+    def _find(self, year, doy):
+        for name in gbm_names(year, doy):
+            path = os.path.join(self.sp3_dir(year), name)
+            if os.path.exists(path):
+                return path
+        return None
+
+    def _fetch_from_source(self, year, doy, target):
+        for name in gbm_names(year, doy):
+            for candidate in (os.path.join(self.source, str(int(year)), "sp3", name), os.path.join(self.source, name)):
+                for path in (candidate, candidate + ".gz"):
+                    if os.path.exists(path):
+                        opener = gzip.open if path.endswith(".gz") else open
+                        with opener(path, 'rb') as f_in, open(target + ".part", 'wb') as f_out:
+                            shutil.copyfileobj(f_in, f_out)
+                        os.replace(target + ".part", target)
+                        return True
+        return False
+
+    def _fetch_from_gfz(self, year, doy):
+        # In a child process with its own working directory and $ORBITS, the stations and prefetch threads
+        # of this process keep theirs; the file ends up in $ORBITS/{yyyy}/sp3
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            subprocess.run([sys.executable, "-c", GFZ_FETCH, str(int(year)), str(int(doy))], cwd=tmp_dir,
+                           env=dict(os.environ, ORBITS=self.orbits_path), stdout=subprocess.DEVNULL, check=True)
+
+    def fetch(self, year, doy):
+        """
+        Path of the SP3 file of a day, fetched into the cache if needed.
+
+        Returns:
+        - str: SP3 path, None if the product is not available.
+        """
+        path = self._find(year, doy)
+        if path is None:
+            with self._locked(gbm_names(year, doy)[0]):
+                path = self._find(year, doy)
+                if path is None:
+                    os.makedirs(self.sp3_dir(year), exist_ok=True)
+                    target = os.path.join(self.sp3_dir(year), gbm_names(year, doy)[0])
+                    if self.source:
+                        self._fetch_from_source(year, doy, target)
+                    else:
+                        self._fetch_from_gfz(year, doy)
+                    path = self._find(year, doy)
+        if path is not None:
+            self._touch(path)
+        return path
+
+    def owns(self, sp3_path):
+        """
+        True for SP3 files in the cache directory, e.g. those returned by fetch.
+        """
+        return os.path.abspath(sp3_path).startswith(self.orbits_path + os.sep)
+
+    def load(self, sp3_path):
+        """
+        Satellite positions of an SP3 file, parsed once and then memory-mapped.
+        SP3 files outside the cache (see owns) are parsed every time.
+
+        Returns:
+        - sp3.sp3_orbit, with xyz a read-only memory map for files of the cache.
+        """
+        if not self.owns(sp3_path):
+            return sp3.read_sp3(sp3_path)
+        parsed = self._parsed_file(sp3_path)
+        stat = os.stat(sp3_path)
+        source = {"path": os.path.abspath(sp3_path), "size": stat.st_size, "mtime": stat.st_mtime}
+        def stale():
+            return (not os.path.exists(parsed) or not snr_cache.is_columnar(parsed)
+                    or snr_cache.read_columns(parsed)[1].get("source") != source)
+
+        if stale():
+            with self._locked(os.path.basename(parsed)):
+                if stale():
+                    orbit = sp3.read_sp3(sp3_path)
+                    metadata = {"source": source, "t0": orbit.t0.isoformat(), "seconds": orbit.seconds.tolist(),
+                                "sats": orbit.sats}
+                    snr_cache.write_columns({"xyz": orbit.xyz.ravel()}, parsed, metadata)
+        self._touch(parsed)
+
+        columns, metadata = snr_cache.read_columns(parsed)
+        sats, seconds = metadata["sats"], np.array(metadata["seconds"])
+        return sp3.sp3_orbit(t0=datetime.fromisoformat(metadata["t0"]), seconds=seconds, sats=sats,
+                             xyz=columns["xyz"].reshape(len(sats), len(seconds), 3))
+
+    def prefetch(self, days, n_workers=4):
+        """
+        Fetch and parse the orbits of a set of days once, before the stations need them.
+
+        Args:
+        - days (iterable): (year, doy), e.g. from src.day_range.
+
+        Returns:
+        - dict: {(year, doy): SP3 path or None}
+        """
+        days = sorted(set(days))
+        errors = {}
+
+        def _fetch_and_parse(day):
+            try:
+                path = self.fetch(*day)
+                if path is not None:
+                    self.load(path)
+                return day, path
+            except Exception as e:
+                errors[day] = e
+                return day, None
+
+        with ThreadPoolExecutor(max_workers=max(1, min(n_workers, len(days)))) as pool:
+            paths = dict(pool.map(_fetch_and_parse, days))
+        if errors:
+            # rinex2snr then fetches these orbits itself
+            day, error = min(errors.items())
+            print(f">>  {len(errors)} of {len(days)} orbits not prefetched, e.g. {day[0]} {day[1]:03d}: {error}")
+        self.evict(keep=[path for path in paths.values() if path])
+        return paths
+
+    def _files(self):
+        # Cached files: (last use, size, path)
+        files = []
+        if not os.path.isdir(self.orbits_path):
+            return files
+        for root in [self.parsed_path] + [os.path.join(self.orbits_path, d, "sp3") for d in os.listdir(self.orbits_path)
+                                          if d.isdigit()]:
+            if not os.path.isdir(root):
+                continue
+            for entry in os.scandir(root):
+                if entry.is_file() and not entry.name.endswith((".lock", ".part")):
+                    stat = entry.stat()
+                    files.append((stat.st_atime, stat.st_size, entry.path))
+        return sorted(files)
+
+    def evict(self, keep=()):
+        """
+        Remove the least recently used files until the cache is within max_bytes.
+
+        Args:
+        - keep (list): SP3 files (and their parsed positions) not to remove, e.g. those just prefetched.
+
+        Returns:
+        - int: Bytes removed.
+        """
+        keep = {os.path.abspath(p) for p in keep} | {os.path.abspath(self._parsed_file(p)) for p in keep}
+        files = self._files()
+        sizes = {path: size for _, size, path in files}
+        total, removed = sum(sizes.values()), 0
+        for _, _, path in files:
+            if total - removed <= self.max_bytes:
+                break
+            if os.path.abspath(path) in keep or path not in sizes:
+                continue
+            # An SP3 file goes together with its parsed positions
+            for remove_path in [path] + ([self._parsed_file(path)] if not path.endswith(PARSED_SUFFIX) else []):
+                try:
+                    os.remove(remove_path)         # Processes that memory-mapped it keep their mapping
+                    removed += sizes.pop(remove_path, 0)
+                except FileNotFoundError:
+                    pass
+        return removed
+
+
+_cache = None
+
+def get_cache():
+    """
+    The orbit cache of this process, with the default settings.
+    """
+    global _cache
+    if _cache is None:
+        _cache = orbit_cache()
+    return _cache
+
+def read_sp3(sp3_path):
+    """
+    sp3.read_sp3, through the cache of parsed positions for the SP3 files of the cache.
+    """
+    return get_cache().load(sp3_path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prefetch the GBM orbits of a DOY range into the shared orbit cache.")
+    parser.add_argument("year", type=int, help="Year (e.g., 2024)")
+    parser.add_argument("doy_start", type=int, help="Start DOY (e.g., 140)")
+    parser.add_argument("doy_end", type=int, help="End DOY (e.g., 145)")
+    parser.add_argument("--year_end", type=int, default=None, help="Year of doy_end, for ranges across New Year")
+    parser.add_argument("--orbits", default=ORBITS_PATH, help="Orbit cache directory ($ORBITS)")
+    parser.add_argument("--source", default=ORBIT_SOURCE, help="Local directory to copy the orbits from")
+    parser.add_argument("--max_bytes", type=float, default=MAX_CACHE_BYTES, help="Size limit of the cache")
+    args = parser.parse_args()
+
+    cache = orbit_cache(args.orbits, args.source, args.max_bytes)
+    paths = cache.prefetch(src.day_range(args.year, args.doy_start, args.doy_end, args.year_end))
+    for (year, doy), path in sorted(paths.items()):
+        print(f"{year} {doy:03d}: {path or 'not available'}")
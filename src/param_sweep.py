@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import argparse
+import itertools
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import gnss_ir_util as src
+import reflector_height
+import result_store
+import tidal_analysis
+
+# ---- Defaults ----
+REPORT_PATH = "sweep_report.json"
+NUMERIC_PARAMETERS = ("e1", "e2", "h1", "h2", "nr1", "nr2", "peak2noise", "ampl", "ediff", "delTmax")
+# Tidal fit used as reference when none is given: short series only resolve the main constituents
+SHORT_CONSTITUENTS = ["M2", "K1"]
+CONSTITUENTS = ["M2", "S2", "N2", "K1", "O1"]
+# ------------------
+
+
+def parse_grid_option(text):
+    """
+    "h1=60,67" -> ("h1", [60.0, 67.0]); azlist2 and frlist values are separated by ';', e.g. "azlist2=0 20 285 360;0 360".
+    """
+    name, _, values = text.partition("=")
+    name = name.strip()
+    if name in NUMERIC_PARAMETERS:
+        return name, [float(v) for v in values.split(",")]
+    return name, [v.strip() for v in values.split(";")]
+
+def parameter_grid(base, grid):
+    """
+    All combinations of the grid values on top of a station's gnssir_input.
+
+    Args:
+    - base (dict): gnssir_input of the station (see src.station_config).
+    - grid (dict): {parameter name: list of values}.
+
+    Returns:
+    - list: gnssir_input dicts, one per combination.
+    """
+    names = list(grid)
+    return [dict(base, **dict(zip(names, values))) for values in itertools.product(*(grid[n] for n in names))]
+
+
+# SNR arrays already loaded by this (worker) process, {path: np.ndarray}
+_snr_days = {}
+
+def _load_snr(snr_path):
+    if snr_path not in _snr_days:
+        _snr_days[snr_path] = reflector_height.read_snr_file(snr_path)
+    return _snr_days[snr_path]
+
+def _group_key(params):
+    # Parameters that change the arcs themselves; all others only change the peak picking and QC
+    return (float(params["e1"]), float(params["e2"]), float(params.get("ediff", 2.0)), float(params.get("delTmax", 75.0)))
+
+def evaluate_day(snr_path, day_mjd, combinations, h_step=0.005, periodogram="direct"):
+    """
+    Reflector heights of one day for combinations that share the elevation window.
+
+    The arcs of every frequency are extracted and their periodograms
+    computed once, over all azimuths and over the union of the reflector
+    zones of the combinations; every combination then only selects its
+    azimuth sectors and picks its peaks.
+
+    Args:
+    - snr_path (str): SNR file of the day.
+    - day_mjd (float): MJD of the start of the day.
+    - combinations (list): gnssir_input dicts with the same e1, e2, ediff and delTmax.
+
+    Returns:
+    - list: (MJD, reflector height) arrays of the accepted arcs, one tuple per combination.
+    """
+    snr = _load_snr(snr_path)
+    e1, e2, ediff, delTmax = _group_key(combinations[0])
+    low = min(min(float(p["h1"]), float(p["nr1"])) for p in combinations)
+    high = max(max(float(p["h2"]), float(p["nr2"])) for p in combinations)
+    heights = np.arange(low, high + h_step / 2, h_step)
+    frlists = [reflector_height.parse_frlist(p["frlist"]) for p in combinations]
+
+    tables = [[] for _ in combinations]
+    for freq in sorted(set(itertools.chain(*frlists))):
+        if freq not in reflector_height.FREQUENCIES:
+            continue
+        arcs, amplitude = reflector_height.arc_periodograms(snr, freq, e1, e2, [(0.0, 360.0)], heights,
+                                                            ediff, delTmax, periodogram)
+        if amplitude is None:
+            continue
+        for i, params in enumerate(combinations):
+            if freq not in frlists[i]:
+                continue
+            in_sector = np.zeros(len(arcs['sat']), bool)
+            for az1, az2 in reflector_height.parse_azlist(params["azlist2"]):
+                in_sector |= (arcs['azim'] >= az1) & (arcs['azim'] <= az2)
+            if not np.any(in_sector):
+                continue
+            table = reflector_height.pick_peaks({name: values[in_sector] for name, values in arcs.items()},
+                                                amplitude[in_sector], heights, freq,
+                                                *(float(params[n]) for n in ("h1", "h2", "nr1", "nr2", "peak2noise", "ampl")))
+            tables[i].append(table[table['ok']])
+
+    results = []
+    for parts in tables:
+        table = np.concatenate(parts) if parts else np.zeros(0, dtype=reflector_height.RESULT_DTYPE)
+        results.append((day_mjd + table['seconds'] / 86400, table['rh']))
+    return results
+
+def read_reference(reference_path, water_level=False):
+    """
+    Reference series: text file with MJD and reflector height [m] per line.
+
+    Args:
+    - water_level (bool): The file has water levels (positive up, e.g. a tide gauge);
+      their sign is flipped, the datum offset ends up in the bias.
+
+    Returns:
+    - tuple: (MJD, reference reflector height), sorted by time.
+    """
+    data = np.loadtxt(reference_path, comments=('%', '#'), ndmin=2)
+    order = np.argsort(data[:, 0])
+    return data[order, 0], -data[order, 1] if water_level else data[order, 1]
+
+def scatter_statistics(series, reference=None, n_days=1):
+    """
+    Retrieval count and scatter of every combination.
+
+    Against a reference the residuals are retrieval minus interpolated
+    reference, their median is the bias; without one, the scatter is the
+    residual standard deviation of a tidal fit to each combination's own
+    retrievals (all combinations are fitted together, see
+    tidal_analysis.fit_tides) and there is no bias.
+
+    Returns:
+    - list: dicts with n_retrievals, per_day, bias_m, scatter_m and robust_scatter_m.
+    """
+    stats = [{"n_retrievals": len(mjd), "per_day": round(len(mjd) / max(n_days, 1), 2),
+              "bias_m": None, "scatter_m": None, "robust_scatter_m": None} for mjd, _ in series]
+    if reference is not None:
+        ref_mjd, ref_rh = reference
+        for stat, (mjd, rh) in zip(stats, series):
+            covered = (mjd >= ref_mjd[0]) & (mjd <= ref_mjd[-1])
+            if np.count_nonzero(covered) < 2:
+                continue
+            residual = rh[covered] - np.interp(mjd[covered], ref_mjd, ref_rh)
+            bias = float(np.median(residual))
+            stat.update(bias_m=round(bias, 4), scatter_m=round(float(np.std(residual)), 4),
+                        robust_scatter_m=round(1.4826 * float(np.median(np.abs(residual - bias))), 4))
+        return stats
+
+    constituents = SHORT_CONSTITUENTS if n_days < 15 else CONSTITUENTS
+    n_params = 1 + 2 * len(constituents)
+    fitted = {i: (mjd, rh) for i, (mjd, rh) in enumerate(series) if len(mjd) > 2 * n_params}
+    if fitted:
+        fit = tidal_analysis.fit_tides(fitted, constituents)
+        for row, i in enumerate(fit.station_ids):
+            mjd, rh = series[i]
+            residual = rh - tidal_analysis.predict_tides(fit, mjd)[row]
+            stats[i].update(scatter_m=round(float(fit.residual_std[row]), 4),
+                            robust_scatter_m=round(1.4826 * float(np.median(np.abs(residual - np.median(residual)))), 4))
+    return stats
+
+def sweep(station, days, grid, reference=None, max_workers=None, h_step=0.005, periodogram=None):
+    """
+    Evaluate a grid of gnssir parameters for a station on its SNR files.
+
+    The SNR files are read once per worker process and the work is split
+    into (day, elevation window) tasks run in parallel; the arcs and
+    periodograms of a task are shared by all the combinations in it (see
+    evaluate_day). No gnssir run or JSON file is involved.
+
+    Args:
+    - station (src.station_config): Station of the registry.
+    - days (list): (year, doy), e.g. from src.day_range.
+    - grid (dict): {parameter name: list of values}, see parameter_grid.
+    - reference (tuple): (MJD, reflector height) as from read_reference, None for a tidal fit.
+    - max_workers (int): Number of processes (default: all cores).
+    - periodogram (str): "direct" or "fast" (default: as set for the station).
+
+    Returns:
+    - list: One dict per combination with the parameters and the statistics, best (lowest scatter) first.
+    """
+    periodogram = periodogram or station.periodogram
+    combinations = parameter_grid(station.gnssir_input, grid)
+    groups = {}
+    for i, params in enumerate(combinations):
+        groups.setdefault(_group_key(params), []).append(i)
+
+    snr_days = []
+    for year, doy in days:
+        snr_path = src.snr_file_path(station.station_id, year, doy, station.gnssir_snr)
+        if os.path.exists(snr_path) or os.path.exists(snr_path + ".npc"):
+            snr_days.append((snr_path, result_store.to_mjd(datetime(int(year), 1, 1)) + int(doy) - 1))
+    if not snr_days:
+        raise FileNotFoundError(f"No SNR files of {station.station_id} for the {len(days)} days")
+    print(f">>  {station.station_id}: {len(combinations)} combinations in {len(groups)} elevation windows, "
+          f"{len(snr_days)} days")
+
+    parts = [[] for _ in combinations]
+    max_workers = max(1, min(max_workers or src.count_nr_cores(), len(snr_days) * len(groups)))
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        futures = {pool.submit(evaluate_day, snr_path, day_mjd, [combinations[i] for i in members], h_step,
+                               periodogram): members
+                   for snr_path, day_mjd in snr_days for members in groups.values()}
+        for future in as_completed(futures):
+            for i, result in zip(futures[future], future.result()):
+                parts[i].append(result)
+
+    series = []
+    for day_parts in parts:
+        mjd = np.concatenate([p[0] for p in day_parts])
+        rh = np.concatenate([p[1] for p in day_parts])
+        order = np.argsort(mjd)
+        series.append((mjd[order], rh[order]))
+
+    stats = scatter_statistics(series, reference, n_days=len(snr_days))
+    report = [dict(stat, params={name: params[name] for name in grid}, gnssir_input=params)
+              for params, stat in zip(combinations, stats)]
+    return sorted(report, key=lambda r: (r["scatter_m"] is None, r["scatter_m"] or 0.0, -r["n_retrievals"]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Evaluate a grid of gnssir parameters (reflector zone, QC) on the "
+                                                 "SNR files of a station, without running gnssir.")
+    parser.add_argument("station_id", help="Station ID in the station registry (e.g., KULL)")
+    parser.add_argument("year", type=int, help="Year (e.g., 2024)")
+    parser.add_argument("doy_start", type=int, help="Start DOY (e.g., 140)")
+    parser.add_argument("doy_end", type=int, help="End DOY (e.g., 145)")
+    parser.add_argument("--year_end", type=int, default=None, help="Year of doy_end, for ranges across New Year")
+    parser.add_argument("--grid", action="append", default=[], metavar="NAME=VALUES",
+                        help="Values of a parameter, e.g. h1=60,65,67 or 'azlist2=0 20 285 360;0 360' (repeatable)")
+    parser.add_argument("--reference", default=None, help="Reference file: MJD and reflector height per line "
+                                                          "(default: scatter about a tidal fit)")
+    parser.add_argument("--water_level", action="store_true", help="The reference has water levels, not reflector heights")
+    parser.add_argument("--registry", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "stations.json"))
+    parser.add_argument("--workers", type=int, default=None, help="Number of processes (default: all cores)")
+    parser.add_argument("--periodogram", default=None, choices=["direct", "fast"],
+                        help="Periodogram algorithm (default: as set for the station in the registry)")
+    parser.add_argument("--top", type=int, default=10, help="Number of combinations printed")
+    parser.add_argument("--output", default=REPORT_PATH, help="JSON report with all combinations")
+    args = parser.parse_args()
+
+    station = src.load_station_registry(args.registry)[args.station_id.upper()]
+    grid = dict(parse_grid_option(option) for option in args.grid)
+    reference = read_reference(args.reference, args.water_level) if args.reference else None
+    report = sweep(station, src.day_range(args.year, args.doy_start, args.doy_end, args.year_end), grid, reference,
+                   args.workers, periodogram=args.periodogram)
+
+    for rank, row in enumerate(report[:args.top], 1):
+        scatter = "-" if row["scatter_m"] is None else f"{row['scatter_m']:.3f} m"
+        print(f"{rank:3d}  {row['n_retrievals']:6d} retrievals ({row['per_day']:6.1f}/day)  scatter {scatter:>9s}  "
+              f"{' '.join(f'{k}={v}' for k, v in row['params'].items())}")
+    with open(args.output, 'w') as f:
+        json.dump({"station": station.station_id, "created": datetime.now().isoformat(timespec='seconds'),
+                   "grid": grid, "reference": args.reference, "combinations": report}, f, indent=2)
+    print(f"Report written to {args.output}")
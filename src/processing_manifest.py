@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import hashlib
+import sqlite3
+from datetime import datetime
+
+# Default location, next to the gnssrefl output so it survives removal of the temporary data
+MANIFEST_PATH = os.path.join(os.environ.get('REFL_CODE', '.'), "gnss_ir_manifest.sqlite")
+
+
+def file_hash(file_path, chunk_size=1024 * 1024):
+    """
+    SHA-256 of a file, read in chunks.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def params_key(params):
+    """
+    Canonical text of the processing parameters of a stage.
+    """
+    return json.dumps(params, sort_keys=True, default=str)
+
+
+class processing_manifest:
+    """
+    Record of the processed work per station/year/DOY and stage.
+
+    For every stage (e.g. "rinex3_rinex2", "rinex2snr", "gnssir") the hash of
+    the input file, the parameters used and the output path are stored. A day
+    only needs to be (re)processed when one of these has changed or the output
+    no longer exists.
+    """
+    def __init__(self, manifest_path=MANIFEST_PATH):
+        if os.path.dirname(manifest_path):
+            os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+        # Several stations may update the manifest at the same time
+        self.db = sqlite3.connect(manifest_path, timeout=60)
+        self.db.execute("""CREATE TABLE IF NOT EXISTS stages (
+                               station TEXT, year INTEGER, doy INTEGER, stage TEXT,
+                               input_hash TEXT, params TEXT, output_path TEXT, updated TEXT,
+                               PRIMARY KEY (station, year, doy, stage))""")
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def is_done(self, station, year, doy, stage, input_hash, params):
+        """
+        True if the stage was run on the same input with the same parameters and its output still exists.
+        """
+        row = self.db.execute("SELECT input_hash, params, output_path FROM stages "
+                              "WHERE station = ? AND year = ? AND doy = ? AND stage = ?",
+                              (station.upper(), int(year), int(doy), stage)).fetchone()
+        if row is None:
+            return False
+        stored_hash, stored_params, output_path = row
+        return (stored_hash == input_hash and stored_params == params_key(params)
+                and (not output_path or os.path.exists(output_path)))
+
+    def record(self, station, year, doy, stage, input_hash, params, output_path=None):
+        self.db.execute("INSERT OR REPLACE INTO stages VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        (station.upper(), int(year), int(doy), stage, input_hash, params_key(params),
+                         output_path, datetime.now().isoformat(timespec='seconds')))
+        self.db.commit()
+
+    def pending(self, station, year, stage, input_hashes, params):
+        """
+        DOYs of a stage that still have to be processed.
+
+        Args:
+        - input_hashes (dict): {doy: input hash} of the candidate days.
+
+        Returns:
+        - list: Sorted DOYs that are missing or invalidated.
+        """
+        return sorted(doy for doy, input_hash in input_hashes.items()
+                      if not self.is_done(station, year, doy, stage, input_hash, params))
+
+    def invalidate(self, station, year=None, stage=None):
+        """
+        Forget recorded work so it is redone, e.g. for a station, a year or a stage.
+        """
+        query = "DELETE FROM stages WHERE station = ?"
+        params = [station.upper()]
+        if year is not None:
+            query += " AND year = ?"
+            params.append(int(year))
+        if stage is not None:
+            query += " AND stage = ?"
+            params.append(stage)
+        self.db.execute(query, params)
+        self.db.commit()
@@ -0,0 +1,362 @@
+#!/usr/bin/env python3
+
+import os
+import argparse
+import numpy as np
+import gnss_ir_util as src
+import snr_cache
+
+SPEED_OF_LIGHT = 299792458.0
+
+# gnssir frequency codes: (satellite number range, SNR column in the SNR file, carrier frequency [Hz])
+# SNR file columns: sat elev azim seconds edot S6 S1 S2 S5 S7 S8
+FREQUENCIES = {
+    1:   ((1, 99),    6, 1575.42e6),     # GPS L1
+    2:   ((1, 99),    7, 1227.60e6),     # GPS L2
+    20:  ((1, 99),    7, 1227.60e6),     # GPS L2C
+    5:   ((1, 99),    8, 1176.45e6),     # GPS L5
+    101: ((101, 199), 6, 1602.00e6),     # GLONASS L1 (nominal)
+    102: ((101, 199), 7, 1246.00e6),     # GLONASS L2 (nominal)
+    201: ((201, 299), 6, 1575.42e6),     # Galileo E1
+    205: ((201, 299), 8, 1176.45e6),     # Galileo E5a
+    206: ((201, 299), 5, 1278.75e6),     # Galileo E6
+    207: ((201, 299), 9, 1207.14e6),     # Galileo E5b
+    208: ((201, 299), 10, 1191.795e6),   # Galileo E5
+    302: ((301, 399), 7, 1561.098e6),    # BeiDou B1I
+    306: ((301, 399), 5, 1268.52e6),     # BeiDou B3I
+    307: ((301, 399), 9, 1207.14e6),     # BeiDou B2b
+}
+
+# Result table of the retrievals, one row per arc
+RESULT_DTYPE = np.dtype([('sat', 'i4'), ('freq', 'i4'), ('rh', 'f8'), ('amp', 'f8'), ('peak2noise', 'f8'),
+                         ('azim', 'f8'), ('seconds', 'f8'), ('emin', 'f8'), ('emax', 'f8'),
+                         ('n_points', 'i4'), ('rising', '?'), ('ok', '?')])
+
+
+def read_snr_file(snr_path):
+    """
+    Read an SNR file into an (N, 11) array, through the binary SNR cache (see snr_cache.py).
+    """
+    return snr_cache.load_snr(snr_path)
+
+def parse_azlist(azlist2):
+    # "0 20 285 360" -> [(0, 20), (285, 360)]
+    values = [float(v) for v in str(azlist2).split()]
+    return list(zip(values[0::2], values[1::2]))
+
+def parse_frlist(frlist):
+    # "1 20 5" or [1, 20, 5] -> [1, 20, 5]
+    return [int(f) for f in str(frlist).split()] if isinstance(frlist, str) else [int(f) for f in frlist]
+
+def extract_arcs(snr, freq, e1, e2, azlist, ediff=2.0, delTmax=75.0, min_points=20):
+    """
+    Split the SNR observations of one frequency into rising and setting arcs.
+
+    Arcs break at a change of satellite, a time gap or a change of the sign of
+    the elevation rate. An arc is kept when it reaches to within ediff of both
+    e1 and e2, lasts at most delTmax minutes and its circular mean azimuth is in one of
+    the azimuth sectors.
+
+    Returns:
+    - dict of arrays, one entry per arc (sat, rising, azim, seconds, emin, emax)
+      plus 'elev', 'snr', 'mask' padded to (n_arcs, max_points).
+    """
+    (sat_min, sat_max), column, _ = FREQUENCIES[freq]
+    rows = ((snr[:, 0] >= sat_min) & (snr[:, 0] <= sat_max) & (snr[:, column] > 0)
+            & (snr[:, 1] >= e1) & (snr[:, 1] <= e2))
+    data = snr[rows]
+    data = data[np.lexsort((data[:, 3], data[:, 0]))]
+    empty = {'sat': np.zeros(0, int), 'elev': np.zeros((0, 0)), 'snr': np.zeros((0, 0)), 'mask': np.zeros((0, 0), bool)}
+    if len(data) < min_points:
+        return empty
+
+    sat, elev, azim, seconds, edot = data[:, 0], data[:, 1], data[:, 2], data[:, 3], data[:, 4]
+    dt = np.diff(seconds)
+    sampling = np.median(dt[dt > 0]) if np.any(dt > 0) else 1.0
+    new_arc = np.ones(len(data), bool)
+    new_arc[1:] = (np.diff(sat) != 0) | (dt > 3 * sampling) | (np.sign(edot[1:]) != np.sign(edot[:-1]))
+    arc_id = np.cumsum(new_arc) - 1
+    starts = np.flatnonzero(new_arc)
+    n_points = np.diff(np.append(starts, len(data)))
+
+    emin = np.minimum.reduceat(elev, starts)
+    emax = np.maximum.reduceat(elev, starts)
+    duration = seconds[np.append(starts[1:], len(data)) - 1] - seconds[starts]
+    # Circular mean, so arcs crossing north (350 -> 10 degrees) are not put at 180 degrees
+    azim_rad = np.radians(azim)
+    arc_azim = np.degrees(np.arctan2(np.add.reduceat(np.sin(azim_rad), starts),
+                                     np.add.reduceat(np.cos(azim_rad), starts))) % 360
+    in_sector = np.zeros(len(starts), bool)
+    for az1, az2 in azlist:
+        in_sector |= (arc_azim >= az1) & (arc_azim <= az2)
+    keep = ((emin - e1 <= ediff) & (e2 - emax <= ediff) & (duration <= delTmax * 60)
+            & (n_points >= min_points) & in_sector)
+    if not np.any(keep):
+        return empty
+
+    # Pack the kept arcs into padded 2-D arrays
+    kept = np.flatnonzero(keep)
+    new_index = np.full(len(starts), -1)
+    new_index[kept] = np.arange(len(kept))
+    row_arc = new_index[arc_id]
+    in_kept = row_arc >= 0
+    position = np.arange(len(data)) - starts[arc_id]
+    shape = (len(kept), n_points[kept].max())
+    packed_elev = np.zeros(shape)
+    packed_snr = np.zeros(shape)
+    mask = np.zeros(shape, bool)
+    packed_elev[row_arc[in_kept], position[in_kept]] = elev[in_kept]
+    packed_snr[row_arc[in_kept], position[in_kept]] = data[in_kept, column]
+    mask[row_arc[in_kept], position[in_kept]] = True
+
+    return {'sat': sat[starts][kept].astype(int), 'rising': edot[starts][kept] > 0, 'azim': arc_azim[kept],
+            'seconds': (np.add.reduceat(seconds, starts) / n_points)[kept],
+            'emin': emin[kept], 'emax': emax[kept], 'n_points': n_points[kept],
+            'elev': packed_elev, 'snr': packed_snr, 'mask': mask}
+
+def detrend_arcs(elev, snr_db, mask, order=2):
+    """
+    Convert SNR (dB-Hz) to linear units and remove a polynomial in elevation, for all arcs at once.
+
+    Returns:
+    - tuple: (sin(elevation), detrended SNR), both (n_arcs, max_points), zero outside mask
+    """
+    linear = np.where(mask, 10 ** (snr_db / 20), 0.0)
+    vander = np.stack([elev ** k for k in range(order + 1)], axis=-1) * mask[..., None]   # (A, L, order+1)
+    normal = np.einsum('alk,alm->akm', vander, vander)
+    rhs = np.einsum('alk,al->ak', vander, linear)
+    coef = np.linalg.solve(normal + 1e-12 * np.eye(order + 1), rhs[..., None])[..., 0]
+    residual = (linear - np.einsum('alk,ak->al', vander, coef)) * mask
+    return np.sin(np.radians(elev)) * mask, residual
+
+def lomb_scargle_batch(x, y, mask, heights, wavelength, max_elements=2e7):
+    """
+    Lomb-Scargle amplitude periodograms of many arcs at once.
+
+    Args:
+    - x (np.ndarray): (n_arcs, max_points) sin(elevation), zero padded.
+    - y (np.ndarray): (n_arcs, max_points) detrended SNR, zero padded.
+    - mask (np.ndarray): (n_arcs, max_points) True for real samples.
+    - heights (np.ndarray): (n_heights,) reflector heights to evaluate [m].
+    - wavelength (float): Carrier wavelength [m].
+
+    Returns:
+    - np.ndarray: (n_arcs, n_heights) amplitude of the fitted sinusoid.
+    """
+    omega = 4 * np.pi * heights / wavelength                    # angular frequency in sin(elevation)
+    n_arcs, n_points = x.shape
+    amplitude = np.zeros((n_arcs, len(heights)))
+    chunk = max(1, int(max_elements // max(1, len(heights) * n_points)))
+    for a in range(0, n_arcs, chunk):
+        xs, ys, ms = x[a:a + chunk, None, :], y[a:a + chunk, :, None], mask[a:a + chunk, None, :]
+        wx = omega[None, :, None] * xs
+        c, s = np.cos(wx) * ms, np.sin(wx) * ms                # (arcs, heights, points)
+        # Least squares fit of a cos + b sin per arc and height (equivalent to the tau form of Lomb-Scargle)
+        yc, ys_ = np.matmul(c, ys)[..., 0], np.matmul(s, ys)[..., 0]
+        cc, ss, cs = np.einsum('afl,afl->af', c, c), np.einsum('afl,afl->af', s, s), np.einsum('afl,afl->af', c, s)
+        amplitude[a:a + chunk] = _fit_amplitude(yc, ys_, cc, ss, cs)
+    return amplitude
+
+def _fit_amplitude(yc, ys, cc, ss, cs):
+    # Amplitude of the least squares a cos + b sin fit from its normal equations
+    det = np.maximum(cc * ss - cs * cs, 1e-12)
+    return np.hypot(yc * ss - ys * cs, ys * cc - yc * cs) / det
+
+def _amplitude_at(x, y, mask, omega, max_elements=2e7):
+    # lomb_scargle_batch for single (arc, angular frequency) pairs, x, y and mask with one row per pair
+    amplitude = np.zeros(len(omega))
+    chunk = max(1, int(max_elements // max(1, x.shape[1])))
+    for p in range(0, len(omega), chunk):
+        wx = omega[p:p + chunk, None] * x[p:p + chunk]
+        c, s, yp = np.cos(wx) * mask[p:p + chunk], np.sin(wx) * mask[p:p + chunk], y[p:p + chunk]
+        amplitude[p:p + chunk] = _fit_amplitude(np.sum(c * yp, axis=1), np.sum(s * yp, axis=1), np.sum(c * c, axis=1),
+                                                np.sum(s * s, axis=1), np.sum(c * s, axis=1))
+    return amplitude
+
+def _lagrange_weights(t, macc):
+    # Weights of the macc grid nodes 0..macc-1 that reproduce a smooth function at offset t
+    weights = np.ones(t.shape + (macc,))
+    for k in range(macc):
+        for m in range(macc):
+            if m != k:
+                weights[..., k] *= (t - m) / (k - m)
+    return weights
+
+def _extirpolate(values, nodes, weights, n_arcs, n_grid):
+    # Spread complex values (n_arcs, n_points) over the grid nodes (n_arcs, n_points, macc)
+    index = (np.arange(n_arcs)[:, None, None] * n_grid + nodes).ravel()
+    spread = (values[..., None] * weights).ravel()
+    grid = np.bincount(index, weights=spread.real, minlength=n_arcs * n_grid) \
+        + 1j * np.bincount(index, weights=spread.imag, minlength=n_arcs * n_grid)
+    return grid.reshape(n_arcs, n_grid)
+
+def lomb_scargle_fast(x, y, mask, heights, wavelength, oversample=8, macc=6, min_conditioning=0.7,
+                      max_elements=2e7):
+    """
+    Fast Lomb-Scargle amplitude periodograms of many arcs (Press & Rybicki extirpolation).
+
+    Same arguments and result as lomb_scargle_batch, but the heights must be
+    evenly spaced. The data are shifted down to the first frequency, spread
+    ("extirpolated") onto a regular grid with Lagrange weights and the sums of
+    all frequencies are taken from FFTs of the grid. The cost is
+    O(points * macc + grid log grid) per arc instead of O(points * heights),
+    which pays off for high rate data and wide reflector height windows.
+
+    At heights where cos and sin are nearly collinear over the samples of
+    an arc (aliased by the sampling, mostly short or sparse arcs) the least
+    squares fit amplifies the extirpolation error; these (arc, height) pairs
+    are computed directly instead. The relative error against
+    lomb_scargle_batch is then below 1e-4 of the peak amplitude of every arc
+    for the defaults (oversample=8, macc=6, well below 1e-6 for 2 s KULL
+    data) and a few 1e-2 for oversample=4, macc=4; see
+    tests/test_reflector_height.py.
+
+    Args:
+    - oversample (int): Grid nodes per period of the highest (shifted) frequency.
+    - macc (int): Number of grid nodes every sample is spread over.
+    - min_conditioning (float): (arc, height) pairs whose normalized determinant of the
+      cos/sin normal equations, 1 - |mean exp(2i omega x)|^2, is below this are computed directly.
+    """
+    steps = np.diff(heights)
+    if len(heights) < 2 or not np.allclose(steps, steps[0]):
+        raise ValueError("lomb_scargle_fast needs evenly spaced heights")
+    f0 = 2 * heights[0] / wavelength                            # cycles per unit of sin(elevation)
+    df = 2 * steps[0] / wavelength
+    n_freq = len(heights)
+    n_grid = int(2 ** np.ceil(np.log2(2 * n_freq * oversample)))
+    dx = 1 / (n_grid * df)                                      # grid period 1/df: the FFT bins are f0 + k df
+
+    n_arcs, n_points = x.shape
+    amplitude = np.zeros((n_arcs, n_freq))
+    chunk = max(1, int(max_elements // max(1, n_grid + n_points * macc)))
+    for a in range(0, n_arcs, chunk):
+        xs, ys, ms = x[a:a + chunk], y[a:a + chunk], mask[a:a + chunk]
+        n = len(xs)
+        x_min = np.min(np.where(ms, xs, np.inf), axis=1, keepdims=True)
+        xr = np.where(ms, xs - x_min, 0.0)
+        u = xr / dx
+        first = np.floor(u).astype(int) - (macc - 1) // 2
+        weights = _lagrange_weights(u - first, macc)
+        nodes = (first[..., None] + np.arange(macc)) % n_grid    # the grid is periodic in 1/df
+
+        # Sums of y exp(-2 pi i f x) at f0 + k df and of exp(-2 pi i 2f x) at 2 f0 + 2k df
+        zy = np.fft.fft(_extirpolate(ys * np.exp(-2j * np.pi * f0 * xr), nodes, weights, n, n_grid))
+        zm = np.fft.fft(_extirpolate(ms * np.exp(-4j * np.pi * f0 * xr), nodes, weights, n, n_grid))
+        zy, zm = zy[:, :n_freq], zm[:, 0:2 * n_freq:2]
+        yc, ys_ = zy.real, -zy.imag
+        c2, s2 = zm.real, -zm.imag
+        count = ms.sum(axis=1, keepdims=True)
+        amplitude[a:a + chunk] = _fit_amplitude(yc, ys_, (count + c2) / 2, (count - c2) / 2, s2 / 2)
+
+        # Where cos and sin are nearly collinear over the samples (heights aliased by the sampling of
+        # short or sparse arcs) the fit amplifies the extirpolation error, compute those exactly
+        conditioning = (count ** 2 - c2 ** 2 - s2 ** 2) / np.maximum(count, 1) ** 2
+        arcs, columns = np.nonzero(conditioning < min_conditioning)
+        if len(arcs):
+            omega = 4 * np.pi * heights[columns] / wavelength
+            amplitude[a + arcs, columns] = _amplitude_at(xs[arcs], ys[arcs], ms[arcs], omega, max_elements)
+    return amplitude
+
+# Periodogram algorithms, selected per station with "periodogram" in the station registry
+PERIODOGRAMS = {"direct": lomb_scargle_batch, "fast": lomb_scargle_fast}
+
+def arc_periodograms(snr, freq, e1, e2, azlist, heights, ediff=2.0, delTmax=75.0, periodogram="direct"):
+    """
+    Arcs of one frequency and their periodograms.
+
+    Returns:
+    - tuple: (arcs as from extract_arcs, (n_arcs, n_heights) amplitude), amplitude None without arcs
+    """
+    arcs = extract_arcs(snr, freq, e1, e2, azlist, ediff=ediff, delTmax=delTmax)
+    if len(arcs['sat']) == 0:
+        return arcs, None
+    wavelength = SPEED_OF_LIGHT / FREQUENCIES[freq][2]
+    x, y = detrend_arcs(arcs['elev'], arcs['snr'], arcs['mask'])
+    return arcs, PERIODOGRAMS[periodogram](x, y, arcs['mask'], heights, wavelength)
+
+def pick_peaks(arcs, amplitude, heights, freq, h1, h2, nr1, nr2, peak2noise, ampl):
+    """
+    Reflector height of every arc from its periodogram, with the gnssir style QC in 'ok'.
+
+    The periodograms may cover more heights than h1..h2 and nr1..nr2, so one
+    set of periodograms serves several reflector zones (see param_sweep.py).
+
+    Returns:
+    - np.ndarray: RESULT_DTYPE structured array, one row per arc.
+    """
+    in_rh = (heights >= h1) & (heights <= h2)
+    in_noise = (heights >= nr1) & (heights <= nr2)
+    rh_amplitude = np.where(in_rh[None, :], amplitude, -np.inf)
+    peak = np.argmax(rh_amplitude, axis=1)
+    peak_amp = amplitude[np.arange(len(peak)), peak]
+    noise = amplitude[:, in_noise].mean(axis=1)
+
+    table = np.zeros(len(peak), dtype=RESULT_DTYPE)
+    table['sat'] = arcs['sat']
+    table['freq'] = freq
+    table['rh'] = heights[peak]
+    table['amp'] = peak_amp
+    table['peak2noise'] = peak_amp / np.maximum(noise, 1e-12)
+    for name in ('azim', 'seconds', 'emin', 'emax', 'n_points', 'rising'):
+        table[name] = arcs[name]
+    # QC: peak not at the edge of the search window, amplitude and peak to noise thresholds
+    table['ok'] = ((peak_amp > float(ampl)) & (table['peak2noise'] > float(peak2noise))
+                   & (heights[peak] > h1) & (heights[peak] < h2))
+    return table
+
+def estimate_reflector_heights(snr, e1, e2, h1, h2, nr1, nr2, peak2noise, ampl, frlist, azlist2,
+                               h_step=0.005, ediff=2.0, delTmax=75.0, periodogram="direct",
+                               keep_rejected=False, **kwargs):
+    """
+    Reflector heights of all arcs of an SNR array, with the gnssir style QC.
+
+    The arcs of every frequency are detrended and their periodograms computed
+    as 2-D batched array operations instead of one arc at a time.
+
+    Args:
+    - snr (np.ndarray): (N, 11) SNR observations (see read_snr_file).
+    - e1, e2, h1, h2, nr1, nr2, peak2noise, ampl, frlist, azlist2: as for gnssir_input.
+    - h_step (float): Reflector height resolution of the periodograms [m].
+    - periodogram (str): "direct" (lomb_scargle_batch) or "fast" (lomb_scargle_fast).
+    - keep_rejected (bool): Also return arcs that failed the QC (ok=False).
+
+    Returns:
+    - np.ndarray: RESULT_DTYPE structured array, one row per arc.
+    """
+    if periodogram not in PERIODOGRAMS:
+        raise ValueError(f"Unknown periodogram '{periodogram}', use one of {list(PERIODOGRAMS)}")
+    e1, e2, h1, h2, nr1, nr2 = (float(v) for v in (e1, e2, h1, h2, nr1, nr2))
+    heights = np.arange(min(h1, nr1), max(h2, nr2) + h_step / 2, h_step)
+    azlist = parse_azlist(azlist2)
+
+    tables = []
+    for freq in parse_frlist(frlist):
+        if freq not in FREQUENCIES:
+            continue
+        arcs, amplitude = arc_periodograms(snr, freq, e1, e2, azlist, heights, ediff, delTmax, periodogram)
+        if amplitude is None:
+            continue
+        tables.append(pick_peaks(arcs, amplitude, heights, freq, h1, h2, nr1, nr2, peak2noise, ampl))
+
+    if not tables:
+        return np.zeros(0, dtype=RESULT_DTYPE)
+    result = np.concatenate(tables)
+    result = result[np.argsort(result['seconds'], kind='stable')]
+    return result if keep_rejected else result[result['ok']]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reflector heights from an SNR file with the native estimator.")
+    parser.add_argument("station_id", help="Station ID in the station registry (e.g., KULL)")
+    parser.add_argument("snr_file", help="SNR file")
+    parser.add_argument("--registry", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "stations.json"))
+    parser.add_argument("--periodogram", default=None, choices=["direct", "fast"],
+                        help="Periodogram algorithm (default: as set for the station in the registry)")
+    args = parser.parse_args()
+
+    station = src.load_station_registry(args.registry)[args.station_id.upper()]
+    result = estimate_reflector_heights(read_snr_file(args.snr_file), periodogram=args.periodogram or station.periodogram,
+                                        **station.gnssir_input)
+    print(f"{len(result)} retrievals")
+    for row in result:
+        print(f"{row['seconds'] / 3600:8.3f} h  sat {row['sat']:3d}  freq {row['freq']:3d}  RH {row['rh']:7.3f} m  "
+              f"amp {row['amp']:6.2f}  pk2n {row['peak2noise']:5.2f}  azim {row['azim']:6.1f}")
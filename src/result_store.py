@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+
+import os
+import fcntl
+import warnings
+import argparse
+from contextlib import contextmanager
+from datetime import datetime
+import numpy as np
+import gnss_ir_util as src
+import snr_cache
+
+# ---- Defaults ----
+# One columnar file per station and year ({STATION}/{year}.rhc), next to the gnssrefl output
+STORE_PATH = os.path.join(os.environ.get('REFL_CODE', '.'), "rh_store")
+STORE_SUFFIX = ".rhc"
+# ------------------
+
+# Columns of the gnssir result files and their stored dtype, in file order
+# (year doy RH sat UTCtime Azim Amp eminO emaxO NumbOf freq rise EdotF PkNoise DelT MJD refr)
+FILE_COLUMNS = [("year", "<i2"), ("doy", "<i2"), ("rh", "<f8"), ("sat", "<i2"), ("utc_hours", "<f8"),
+                ("azim", "<f4"), ("amp", "<f4"), ("emin", "<f4"), ("emax", "<f4"), ("n_points", "<i4"),
+                ("freq", "<i2"), ("rise", "<i1"), ("edot_factor", "<f4"), ("peak2noise", "<f4"),
+                ("delT", "<f4"), ("mjd", "<f8"), ("refr", "<i1")]
+# Stored columns: the file columns, and 1 for the provisional near-real-time rows of the rolling window
+RESULT_COLUMNS = FILE_COLUMNS + [("provisional", "<i1")]
+
+MJD_EPOCH = datetime(1858, 11, 17)
+
+
+def to_mjd(time):
+    # datetime or MJD -> MJD
+    if isinstance(time, datetime):
+        return (time - MJD_EPOCH).total_seconds() / 86400
+    return float(time)
+
+def read_result_file(result_path):
+    """
+    Read a gnssir result file ($REFL_CODE/{year}/results/{station}/{doy}.txt) into columns.
+    """
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", UserWarning)     # Days without retrievals have no rows
+        data = np.loadtxt(result_path, comments='%', ndmin=2)
+    if data.size == 0:
+        data = np.zeros((0, len(FILE_COLUMNS)))
+    if data.shape[1] < len(FILE_COLUMNS):       # Older gnssrefl versions write fewer columns
+        data = np.hstack([data, np.zeros((len(data), len(FILE_COLUMNS) - data.shape[1]))])
+    columns = {name: data[:, i].astype(dtype) for i, (name, dtype) in enumerate(FILE_COLUMNS)}
+    columns["provisional"] = np.zeros(len(data), dtype="<i1")
+    return columns
+
+def columns_from_estimates(table, year, doy, provisional=False):
+    """
+    Store columns of the result table of reflector_height.estimate_reflector_heights for one day.
+
+    The native estimator applies no refraction correction (refr 0), unlike
+    gnssir with its default refraction model; provisional marks rows that the
+    gnssir results of the day replace later.
+    """
+    day_mjd = to_mjd(datetime(int(year), 1, 1)) + int(doy) - 1
+    values = {"year": year, "doy": doy, "rh": table['rh'], "sat": table['sat'], "utc_hours": table['seconds'] / 3600,
+              "azim": table['azim'], "amp": table['amp'], "emin": table['emin'], "emax": table['emax'],
+              "n_points": table['n_points'], "freq": table['freq'], "rise": np.where(table['rising'], 1, -1),
+              "edot_factor": 0, "peak2noise": table['peak2noise'], "delT": 0,
+              "mjd": day_mjd + table['seconds'] / 86400, "refr": 0, "provisional": int(provisional)}
+    return {name: np.broadcast_to(values[name], len(table)).astype(dtype) for name, dtype in RESULT_COLUMNS}
+
+
+class result_store:
+    """
+    Reflector heights of every station in one columnar file per station and year.
+
+    The rows of a year are sorted by time (MJD), so a time window is found by
+    binary search and returned as zero-copy slices of the memory-mapped
+    columns (copied when the window spans several years). Days are appended
+    incrementally: the result files of new or changed days replace the rows
+    of those days. An append rewrites only the years it touches, so its cost
+    is bounded by the size of a year, not of the whole archive.
+    """
+    def __init__(self, store_path=STORE_PATH):
+        self.store_path = store_path
+        os.makedirs(store_path, exist_ok=True)
+
+    def path(self, station, year):
+        return os.path.join(self.store_path, station.upper(), f"{int(year)}{STORE_SUFFIX}")
+
+    def years(self, station):
+        """
+        Years with stored rows, sorted.
+        """
+        self._migrate(station)
+        station_dir = os.path.join(self.store_path, station.upper())
+        if not os.path.isdir(station_dir):
+            return []
+        return sorted(int(name[:-len(STORE_SUFFIX)]) for name in os.listdir(station_dir)
+                      if name.endswith(STORE_SUFFIX) and name[:-len(STORE_SUFFIX)].isdigit())
+
+    @contextmanager
+    def _locked(self, station):
+        # Stations and pipeline threads may append to the same store at the same time
+        with open(os.path.join(self.store_path, station.upper() + ".lock"), 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _migrate(self, station):
+        # Stores written before the partitioning kept all years in one file, split it once
+        legacy_path = os.path.join(self.store_path, station.upper() + STORE_SUFFIX)
+        if not os.path.exists(legacy_path):
+            return
+        with self._locked(station):
+            if not os.path.exists(legacy_path):
+                return
+            columns, metadata = self._read(legacy_path)
+            years = columns["year"].astype(int)
+            sources = metadata.get("sources", {})
+            for year in np.union1d(years, [int(key.split("/")[0]) for key in sources]):
+                os.makedirs(os.path.dirname(self.path(station, year)), exist_ok=True)
+                year_sources = {key: mtime for key, mtime in sources.items() if int(key.split("/")[0]) == year}
+                snr_cache.write_columns({name: np.asarray(values)[years == year] for name, values in columns.items()},
+                                        self.path(station, year), {"sources": year_sources})
+            os.remove(legacy_path)
+
+    @staticmethod
+    def _read(path):
+        if not os.path.exists(path):
+            return {name: np.zeros(0, dtype=dtype) for name, dtype in RESULT_COLUMNS}, {"sources": {}}
+        columns, metadata = snr_cache.read_columns(path)
+        n_rows = len(columns["mjd"])
+        # Stores written before a column was added have zeros there
+        return {name: columns[name] if name in columns else np.zeros(n_rows, dtype=dtype)
+                for name, dtype in RESULT_COLUMNS}, metadata
+
+    def load(self, station, year=None):
+        """
+        All rows of a station, or of one year.
+
+        Returns:
+        - tuple: ({column name: np.memmap, or array for several years}, metadata with the ingested result files)
+        """
+        self._migrate(station)
+        if year is not None:
+            return self._read(self.path(station, year))
+        parts = [self._read(self.path(station, y)) for y in self.years(station)]
+        if len(parts) == 1:
+            return parts[0]
+        columns = {name: np.concatenate([np.zeros(0, dtype=dtype)] + [part[0][name] for part in parts])
+                   for name, dtype in RESULT_COLUMNS}
+        sources = {key: mtime for part in parts for key, mtime in part[1].get("sources", {}).items()}
+        return columns, {"sources": sources}
+
+    def _append(self, station, columns, sources, replace_days):
+        # append() with the lock of the station held
+        row_years = np.asarray(columns["year"]).astype(int)
+        source_years = [int(key.split("/")[0]) for key in sources or {}]
+        for year in np.union1d(row_years, source_years):
+            stored, metadata = self._read(self.path(station, year))
+            year_sources = {key: mtime for key, mtime in (sources or {}).items() if int(key.split("/")[0]) == year}
+            new_rows = row_years == year
+            new_days = np.unique(np.asarray(columns["doy"]).astype(int)[new_rows])
+            if year_sources:
+                new_days = np.union1d(new_days, [int(key.split("/")[1]) for key in year_sources])
+            if not replace_days:
+                new_days = np.zeros(0, int)
+            keep = ~np.isin(stored["doy"].astype(int), new_days)
+            merged = {name: np.concatenate([stored[name][keep], np.asarray(columns[name], dtype=dtype)[new_rows]])
+                      for name, dtype in RESULT_COLUMNS}
+            order = np.argsort(merged["mjd"], kind='stable')
+            metadata.setdefault("sources", {}).update(year_sources)
+            os.makedirs(os.path.dirname(self.path(station, year)), exist_ok=True)
+            snr_cache.write_columns({name: values[order] for name, values in merged.items()},
+                                    self.path(station, year), metadata)
+
+    def append(self, station, columns, sources=None, replace_days=True):
+        """
+        Add rows to the store of a station, replacing the rows of the same days.
+
+        Args:
+        - columns (dict): {column name: array} of the new rows, see RESULT_COLUMNS.
+        - sources (dict): {"year/doy": result file modification time} to record as ingested.
+        - replace_days (bool): False adds the rows to those of the same days (near-real-time arcs,
+          see rolling_window.py), which the next full day then replaces.
+        """
+        self._migrate(station)
+        with self._locked(station):
+            self._append(station, columns, sources, replace_days)
+
+    def ingest_results(self, station, year, doys=None):
+        """
+        Append the gnssir result files of a station-year that are new or changed since they were ingested.
+
+        The ingested modification times are checked under the lock of the
+        station, so concurrent processes do not ingest the same days twice.
+
+        Args:
+        - doys (list): DOYs to look at (default: every result file of the year).
+
+        Returns:
+        - int: Number of days ingested.
+        """
+        result_dir = os.path.dirname(src.gnssir_result_path(station, year, 1))
+        if doys is None:
+            doys = [int(name[:3]) for name in os.listdir(result_dir)
+                    if name.endswith(".txt") and name[:3].isdigit()] if os.path.isdir(result_dir) else []
+
+        self._migrate(station)
+        with self._locked(station):
+            _, metadata = self._read(self.path(station, year))
+            ingested = metadata.get("sources", {})
+            parts, sources = [], {}
+            for doy in sorted(doys):
+                result_path = src.gnssir_result_path(station, year, doy)
+                if not os.path.exists(result_path):
+                    continue
+                key, mtime = f"{int(year)}/{int(doy)}", os.path.getmtime(result_path)
+                if ingested.get(key) == mtime:
+                    continue
+                parts.append(read_result_file(result_path))
+                sources[key] = mtime
+            if not sources:
+                return 0
+
+            columns = {name: np.concatenate([part[name] for part in parts]) for name, _ in RESULT_COLUMNS}
+            self._append(station, columns, sources, replace_days=True)
+        return len(sources)
+
+    def query(self, station, start=None, end=None, freq=None, azim=None, provisional=True):
+        """
+        Reflector heights of a station in a time window.
+
+        Rows with provisional == 1 are near-real-time estimates of the rolling
+        window (rolling_window.py) for days the nightly gnssir run has not
+        processed yet. They are not corrected for refraction (refr 0), so at
+        low elevation angles they are biased against the gnssir rows, and they
+        are replaced once the gnssir results of their day are ingested.
+
+        Args:
+        - start, end (datetime or float): Window [start, end) as datetime or MJD (default: open ended).
+        - freq (int or list): Only these gnssir frequency codes.
+        - azim (tuple): Only azimuths in (az1, az2) degrees.
+        - provisional (bool): False leaves out the provisional rows.
+
+        Returns:
+        - dict: {column name: array}, sorted by time.
+        """
+        start_mjd = None if start is None else to_mjd(start)
+        end_mjd = None if end is None else to_mjd(end)
+        windows = []
+        for year in self.years(station):
+            # A day's arcs may run a little past midnight, look one day beyond the year on both sides
+            if ((start_mjd is not None and to_mjd(datetime(year + 1, 1, 1)) + 1 < start_mjd)
+                    or (end_mjd is not None and to_mjd(datetime(year, 1, 1)) - 1 >= end_mjd)):
+                continue
+            columns, _ = self._read(self.path(station, year))
+            mjd = columns["mjd"]
+            first = 0 if start_mjd is None else np.searchsorted(mjd, start_mjd, side='left')
+            last = len(mjd) if end_mjd is None else np.searchsorted(mjd, end_mjd, side='left')
+            windows.append({name: values[first:last] for name, values in columns.items()})
+
+        if not windows:
+            window = {name: np.zeros(0, dtype=dtype) for name, dtype in RESULT_COLUMNS}
+        elif len(windows) == 1:
+            window = windows[0]
+        else:
+            window = {name: np.concatenate([w[name] for w in windows]) for name, _ in RESULT_COLUMNS}
+            order = np.argsort(window["mjd"], kind='stable')
+            window = {name: values[order] for name, values in window.items()}
+        if freq is None and azim is None and provisional:
+            return window
+
+        keep = np.ones(len(window["mjd"]), bool)
+        if not provisional:
+            keep &= window["provisional"] == 0
+        if freq is not None:
+            keep &= np.isin(window["freq"], np.atleast_1d(freq))
+        if azim is not None:
+            keep &= (window["azim"] >= azim[0]) & (window["azim"] <= azim[1])
+        return {name: values[keep] for name, values in window.items()}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Add gnssir results to the reflector height store.")
+    parser.add_argument("station_id", help="Station ID (e.g., KULL)")
+    parser.add_argument("years", type=int, nargs="+", help="Years to ingest (e.g., 2023 2024)")
+    parser.add_argument("--store", default=STORE_PATH, help="Reflector height store directory")
+    args = parser.parse_args()
+
+    store = result_store(args.store)
+    for year in args.years:
+        n_days = store.ingest_results(args.station_id, year)
+        print(f"{args.station_id.upper()} {year}: {n_days} new or changed days")
+    columns, _ = store.load(args.station_id)
+    print(f"{len(columns['mjd'])} reflector heights in {os.path.join(store.store_path, args.station_id.upper())}")
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+
+import os
+import argparse
+import numpy as np
+import gnss_ir_util as src
+import snr_cache
+import rinex3_stream
+import sat_geometry
+import orbit_cache
+
+# SNR file columns after sat, elev, azim, seconds, edot: S6 S1 S2 S5 S7 S8
+SNR_BANDS = "612578"
+# Satellite numbering used in SNR files: GPS 1-99, GLONASS 101-199, Galileo 201-299, BeiDou 301-399
+SYSTEM_OFFSET = {'G': 0, 'R': 100, 'E': 200, 'C': 300}
+# Preferred tracking mode when a band has several SNR observations
+ATTRIBUTE_PREFERENCE = "CXWLSQIPDBZAN"
+# -snr choices: elevation angle limits in degrees
+SNR_ELEVATION_LIMITS = {66: (0, 30), 50: (0, 10), 88: (0, 90), 99: (5, 30)}
+
+
+def _attribute_rank(code):
+    rank = ATTRIBUTE_PREFERENCE.find(code[2])
+    return rank if rank >= 0 else len(ATTRIBUTE_PREFERENCE)
+
+def select_snr_observations(obs_types):
+    """
+    Index of the observation used for each SNR column, per satellite system.
+
+    Returns:
+    - dict: {system: np.ndarray of len(SNR_BANDS)}, -1 where the band is not observed.
+    """
+    columns = {}
+    for system, codes in obs_types.items():
+        index = np.full(len(SNR_BANDS), -1)
+        for j, band in enumerate(SNR_BANDS):
+            candidates = [(_attribute_rank(code), i) for i, code in enumerate(codes)
+                          if len(code) == 3 and code[0] == 'S' and code[1] == band]
+            if candidates:
+                index[j] = min(candidates)[1]
+        columns[system] = index
+    return columns
+
+def read_snr_observations(rinex_path, samplerate=None):
+    """
+    Read the SNR observations of a Rinex3 file in one streaming pass.
+
+    Returns:
+    - tuple: (day start datetime, sat numbers (N,), seconds of day (N,), SNR (N, 6))
+    """
+    sat_numbers, seconds, snr = [], [], []
+    columns = None
+    day_start = None
+    for header, epoch in rinex3_stream.iter_epochs(rinex_path, samplerate=samplerate):
+        if columns is None:
+            columns = select_snr_observations(header.obs_types)
+            day_start = epoch.time.replace(hour=0, minute=0, second=0, microsecond=0)
+        epoch_seconds = (epoch.time - day_start).total_seconds()
+        for sat, values in epoch.obs.items():
+            if sat[0] not in SYSTEM_OFFSET:
+                continue
+            index = columns[sat[0]]
+            row = np.where(index >= 0, values[index], np.nan)
+            sat_numbers.append(SYSTEM_OFFSET[sat[0]] + int(sat[1:3]))
+            seconds.append(epoch_seconds)
+            snr.append(row)
+    if day_start is None:
+        raise ValueError(f"No observation epochs in {rinex_path}")
+
+    snr = np.array(snr).reshape(-1, len(SNR_BANDS))
+    return day_start, np.array(sat_numbers, dtype=int), np.array(seconds), snr
+
+def _sat_id(sat_number):
+    system = {offset: system for system, offset in SYSTEM_OFFSET.items()}[sat_number // 100 * 100]
+    return f"{system}{sat_number % 100:02d}"
+
+def snr_rows(day_start, sat_numbers, seconds, snr, sp3_path, lat, lon, height, snr_option=66):
+    """
+    SNR file rows of decoded observations (see read_snr_observations), with the
+    elevation and azimuth angles of the satellites from the SP3 orbit.
+
+    Returns:
+    - np.ndarray: (N, 11) array with the columns of an SNR file, rows outside the elevation
+      limits of snr_option dropped; seconds counted from day_start
+    """
+    geometry = sat_geometry.sat_geometry(orbit_cache.read_sp3(sp3_path), lat, lon, height)
+    offset = (day_start - geometry.orbit.t0).total_seconds()
+    min_elev, max_elev = SNR_ELEVATION_LIMITS[int(snr_option)]
+
+    # Orbit row of every observation, all satellites and epochs in one pass
+    sat_numbers_found, inverse = np.unique(sat_numbers, return_inverse=True)
+    rows = geometry.sat_rows([_sat_id(n) for n in sat_numbers_found])[inverse]
+    elev, azim, edot = geometry.elev_azim(rows, seconds + offset)
+
+    keep = (elev > min_elev) & (elev < max_elev)
+    return np.column_stack([sat_numbers, elev, azim, seconds, edot, np.nan_to_num(snr)])[keep]
+
+def snr_table(rinex_path, sp3_path, lat, lon, height, samplerate=None, snr_option=66):
+    """
+    SNR observations of a Rinex3 file with the elevation and azimuth angles of the satellites.
+
+    Returns:
+    - tuple: (day start datetime, (N, 11) array with the columns of an SNR file, rows outside the
+      elevation limits of snr_option dropped; seconds counted from the day start)
+    """
+    day_start, sat_numbers, seconds, snr = read_snr_observations(rinex_path, samplerate)
+    return day_start, snr_rows(day_start, sat_numbers, seconds, snr, sp3_path, lat, lon, height, snr_option)
+
+def extract_snr(rinex_path, sp3_path, snr_path, lat, lon, height, samplerate=None, snr_option=66):
+    """
+    Write an SNR file directly from a Rinex3 (or Hatanaka compressed) observation file.
+
+    Replaces the Rinex3 -> Rinex2 -> rinex2snr round trip: the observations are
+    decimated to samplerate while parsing, elevation and azimuth angles are
+    computed from the SP3 orbit and the station position, and rows outside the
+    elevation limits of snr_option are dropped.
+
+    Args:
+    - rinex_path (str): Rinex3 observation file (.crx.gz, .crx, .rnx.gz, .rnx).
+    - sp3_path (str): SP3 orbit file covering the day.
+    - snr_path (str): Output SNR file.
+    - lat, lon, height (float): Station position (degrees, ellipsoidal height WGS84).
+    - samplerate (int): Decimation interval in seconds (e.g. 2, 5, 15).
+    - snr_option (int): 66, 50, 88 or 99, as for rinex2snr -snr.
+
+    Returns:
+    - int: Number of rows written.
+    """
+    _, table = snr_table(rinex_path, sp3_path, lat, lon, height, samplerate, snr_option)
+
+    os.makedirs(os.path.dirname(os.path.abspath(snr_path)), exist_ok=True)
+    np.savetxt(snr_path, table, fmt="%3.0f %10.4f %10.4f %10.0f %10.6f" + " %7.2f" * len(SNR_BANDS))
+    snr_cache.write_cache(table, snr_cache.cache_path(snr_path))
+    return len(table)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rinex3 -> SNR file without the Rinex2 intermediate.")
+    parser.add_argument("station_id", help="Station ID in the station registry (e.g., KULL)")
+    parser.add_argument("rinex_file", help="Rinex3 observation file (.crx.gz, .rnx, ...)")
+    parser.add_argument("sp3_file", help="SP3 orbit file for the day")
+    parser.add_argument("--registry", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "stations.json"))
+    parser.add_argument("--output", default=None, help="SNR file (default: gnssir location under $REFL_CODE)")
+    args = parser.parse_args()
+
+    station = src.load_station_registry(args.registry)[args.station_id.upper()]
+    _, year, doy = src.get_info(os.path.basename(args.rinex_file))
+    snr_path = args.output or src.snr_file_path(station.station_id, year, doy, station.rinex2snr_snr)
+    n_rows = extract_snr(args.rinex_file, args.sp3_file, snr_path, station.lat, station.lon, station.height,
+                         samplerate=station.samplerate, snr_option=station.rinex2snr_snr)
+    print(f"Wrote {n_rows} SNR observations to {snr_path}")
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+
+import gzip
+import numpy as np
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+
+
+@dataclass
+class rinex3_header:
+    """
+    The parts of a Rinex3 observation header needed for reading the epochs
+    """
+    version: float = 3.0
+    crinex: bool = False                                # Hatanaka compressed (CRINEX 3)
+    marker_name: str = ""
+    approx_xyz: tuple = None
+    interval: float = None
+    obs_types: dict = field(default_factory=dict)       # {system: [observation codes]}
+    lines: list = field(default_factory=list)           # Raw (uncompressed) Rinex3 header lines
+
+@dataclass
+class rinex3_epoch:
+    time: datetime
+    flag: int
+    clock: float                # Receiver clock offset [s], None if not given
+    obs: dict                   # {satellite: np.ndarray}, in header.obs_types order, NaN if missing
+
+
+def open_rinex(file_path):
+    """
+    Open a (Hatanaka compressed) Rinex3 file as text, gzip compressed files are read as a stream.
+    """
+    if file_path.endswith('.gz'):
+        return gzip.open(file_path, 'rt', errors='replace')
+    return open(file_path, 'r', errors='replace')
+
+def read_header(rinex_file):
+    """
+    Read the header of an open Rinex3 or CRINEX 3 file, leaving the file at the first epoch.
+    """
+    header = rinex3_header()
+    system = None
+    for line in rinex_file:
+        line = line.rstrip('\r\n')
+        label = line[60:80].strip()
+
+        if label == "CRINEX VERS   / TYPE":
+            header.crinex = True
+            continue
+        if label == "CRINEX PROG / DATE":
+            continue
+
+        header.lines.append(line)
+        if label == "RINEX VERSION / TYPE":
+            header.version = float(line[0:9])
+        elif label == "MARKER NAME":
+            header.marker_name = line[0:60].strip()
+        elif label == "APPROX POSITION XYZ":
+            header.approx_xyz = tuple(float(v) for v in line[0:42].split())
+        elif label == "INTERVAL":
+            header.interval = float(line[0:10])
+        elif label == "SYS / # / OBS TYPES":
+            if line[0] != ' ':
+                system = line[0]
+                header.obs_types[system] = []
+            header.obs_types[system].extend(line[7:60].split())
+        elif label == "END OF HEADER":
+            break
+    return header
+
+def _epoch_time(epoch_line):
+    # > 2024 05 20 00 00  0.0000000  0 32
+    year, month, day, hour, minute, sec = epoch_line[1:29].split()
+    return datetime(int(year), int(month), int(day), int(hour), int(minute)) + timedelta(seconds=float(sec))
+
+def _sat_id(sat):
+    return sat[0] + sat[1:3].replace(' ', '0')
+
+def _repair(old, diff):
+    """
+    Undo the text differencing of CRINEX: ' ' keeps the old character, '&' is a blank.
+    """
+    if len(diff) > len(old):
+        old = old.ljust(len(diff))
+    chars = list(old)
+    for i, c in enumerate(diff):
+        if c == ' ':
+            continue
+        chars[i] = ' ' if c == '&' else c
+    return ''.join(chars)
+
+def _undifference(arc, field_text):
+    """
+    Recover one value from its CRINEX field and the state of the arc.
+
+    The arc is a list [arc_order, u0, u1, ...], where u0 is the last value and
+    uk the last k'th order difference. A field "k&value" starts a new arc of
+    order k, any other field is the next difference of the current arc.
+    Returns the new value (integer, 1e-3 units) and the updated arc.
+    """
+    if len(field_text) > 1 and field_text[1] == '&':
+        return int(field_text[2:]), [int(field_text[0]), int(field_text[2:])]
+    if arc is None:
+        raise ValueError(f"CRINEX difference '{field_text}' without an initialized arc")
+
+    order = min(len(arc) - 1, arc[0])
+    if order == len(arc) - 1:
+        arc.append(0)
+    arc[order + 1] = int(field_text)
+    for k in range(order, 0, -1):
+        arc[k] += arc[k + 1]
+    return arc[1], arc
+
+def _keep_epoch(epoch_time, samplerate):
+    if not samplerate:
+        return True
+    seconds = epoch_time.hour * 3600 + epoch_time.minute * 60 + epoch_time.second + epoch_time.microsecond * 1e-6
+    return abs(seconds - samplerate * round(seconds / samplerate)) < 1e-3
+
+def _iter_crx_epochs(rinex_file, header, samplerate=None):
+    """
+    Hatanaka (CRINEX 3) decompaction of the epochs following the header.
+
+    Every epoch has to be decompacted (the values are differences to the
+    previous epochs), but only epochs on the samplerate grid are yielded.
+    """
+    epoch_line = ""
+    clock_arc = None
+    arcs = {}                   # {satellite: [arc per observation type]}
+
+    for line in rinex_file:
+        line = line.rstrip('\r\n')
+        if line.startswith('>'):
+            new_epoch_line = line
+        else:
+            new_epoch_line = _repair(epoch_line, line)
+
+        flag = int(new_epoch_line[31])
+        n_sat = int(new_epoch_line[32:35])
+        if flag > 1 and flag != 6:
+            # Special event, the following records are (uncompressed) header lines
+            for _ in range(n_sat):
+                next(rinex_file)
+            continue
+        epoch_line = new_epoch_line
+
+        clock_line = next(rinex_file).rstrip('\r\n')
+        if clock_line.strip():
+            clock_value, clock_arc = _undifference(clock_arc, clock_line.strip())
+            clock = clock_value * 1e-12
+        else:
+            clock_arc, clock = None, None
+
+        epoch_time = _epoch_time(epoch_line)
+        keep = _keep_epoch(epoch_time, samplerate)
+        sats = [_sat_id(epoch_line[41 + 3 * i:44 + 3 * i]) for i in range(n_sat)]
+        new_arcs = {}
+        obs = {}
+        for sat in sats:
+            data_line = next(rinex_file).rstrip('\r\n')
+            n_types = len(header.obs_types.get(sat[0], []))
+            sat_arcs = arcs.get(sat, [None] * n_types)
+            values = np.full(n_types, np.nan)
+
+            pos = 0
+            for i in range(n_types):
+                if pos > len(data_line):
+                    sat_arcs[i] = None
+                    continue
+                end = data_line.find(' ', pos)
+                if end < 0:
+                    end = len(data_line)
+                field_text = data_line[pos:end]
+                pos = end + 1
+                if not field_text:
+                    sat_arcs[i] = None
+                    continue
+                value, sat_arcs[i] = _undifference(sat_arcs[i], field_text)
+                values[i] = value / 1000.0
+
+            new_arcs[sat] = sat_arcs
+            obs[sat] = values
+        arcs = new_arcs
+
+        if keep:
+            yield rinex3_epoch(time=epoch_time, flag=flag, clock=clock, obs=obs)
+
+def _iter_rnx_epochs(rinex_file, header, samplerate=None):
+    """
+    Epochs of a plain Rinex3 observation file following the header.
+
+    Satellite records of epochs off the samplerate grid are skipped unparsed.
+    """
+    for line in rinex_file:
+        if not line.startswith('>'):
+            continue
+        flag = int(line[31])
+        n_sat = int(line[32:35])
+        epoch_time = _epoch_time(line)
+        if (flag > 1 and flag != 6) or not _keep_epoch(epoch_time, samplerate):
+            for _ in range(n_sat):
+                next(rinex_file)
+            continue
+        clock_text = line[41:56].strip()
+        clock = float(clock_text) if clock_text else None
+
+        obs = {}
+        for _ in range(n_sat):
+            data_line = next(rinex_file).rstrip('\r\n')
+            sat = _sat_id(data_line[0:3])
+            n_types = len(header.obs_types.get(sat[0], []))
+            values = np.full(n_types, np.nan)
+            for i in range(n_types):
+                value_text = data_line[3 + 16 * i:17 + 16 * i].strip()
+                if value_text:
+                    values[i] = float(value_text)
+            obs[sat] = values
+
+        yield rinex3_epoch(time=epoch_time, flag=flag, clock=clock, obs=obs)
+
+def iter_epochs(file_path, samplerate=None):
+    """
+    Stream the epochs of a Rinex3 observation file without temporary files.
+
+    Reads .crx.gz / .crx (Hatanaka) and .rnx.gz / .rnx files directly:
+    gzip -> Hatanaka decompaction -> Rinex3 observation records.
+
+    Args:
+    - file_path (str): Path to the observation file.
+    - samplerate (float): Only yield epochs on this grid (seconds of day), e.g. 15.
+
+    Yields:
+    - tuple: (rinex3_header, rinex3_epoch), the header is the same object for every epoch.
+    """
+    with open_rinex(file_path) as rinex_file:
+        header = read_header(rinex_file)
+        if header.crinex:
+            epochs = _iter_crx_epochs(rinex_file, header, samplerate)
+        else:
+            epochs = _iter_rnx_epochs(rinex_file, header, samplerate)
+        for epoch in epochs:
+            yield header, epoch
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import json
+import sqlite3
+import argparse
+from datetime import datetime, timedelta
+import rinex3_stream
+
+# Header index database, shared by all station processes; next to the processing manifest by default
+INDEX_PATH = os.environ.get("GNSS_IR_HEADER_INDEX",
+                            os.path.join(os.environ.get('REFL_CODE', '.'), "rinex_headers.sqlite"))
+# Rinex3 (.crx/.rnx) and Rinex2 ({station}{doy}0.{yy}o / d) observation files
+RINEX_PATTERN = re.compile(r"(\.crx|\.rnx|\.\d\d[od])(\.gz)?$", re.IGNORECASE)
+
+
+def _header_time(text):
+    # "  2024     5    20     0     0    0.0000000     GPS"
+    fields = text.split()
+    if len(fields) < 6:
+        return None
+    year, month, day, hour, minute, sec = fields[0:6]
+    return (datetime(int(year), int(month), int(day), int(hour), int(minute))
+            + timedelta(seconds=float(sec))).isoformat()
+
+def scan_header(file_path):
+    """
+    Parse the header of a Rinex2/Rinex3 observation file (plain, gzip or Hatanaka
+    compressed), reading nothing past END OF HEADER.
+
+    Returns:
+    - dict: version, marker_name, approx_xyz, antenna_type, antenna_delta_hen,
+            receiver_type, obs_types ({system: [codes]}, system '' for Rinex2),
+            interval, time_first_obs, time_last_obs (ISO format strings)
+    """
+    with rinex3_stream.open_rinex(file_path) as rinex_file:
+        header = rinex3_stream.read_header(rinex_file)
+
+    info = {
+        "version": header.version,
+        "crinex": header.crinex,
+        "marker_name": header.marker_name,
+        "approx_xyz": list(header.approx_xyz) if header.approx_xyz else None,
+        "antenna_type": None,
+        "antenna_delta_hen": None,
+        "receiver_type": None,
+        "obs_types": dict(header.obs_types),
+        "interval": header.interval,
+        "time_first_obs": None,
+        "time_last_obs": None,
+    }
+    rinex2_types = []
+    for line in header.lines:
+        label = line[60:80].strip()
+        if label == "ANT # / TYPE":
+            info["antenna_type"] = line[20:40].strip()
+        elif label == "ANTENNA: DELTA H/E/N":
+            info["antenna_delta_hen"] = [float(v) for v in line[0:42].split()]
+        elif label == "REC # / TYPE / VERS":
+            info["receiver_type"] = line[20:40].strip()
+        elif label == "# / TYPES OF OBSERV":
+            rinex2_types.extend(line[6:60].split())
+        elif label == "TIME OF FIRST OBS":
+            info["time_first_obs"] = _header_time(line[0:43])
+        elif label == "TIME OF LAST OBS":
+            info["time_last_obs"] = _header_time(line[0:43])
+    if rinex2_types:
+        info["obs_types"] = {"": rinex2_types}
+    return info
+
+
+class header_index:
+    """
+    On-disk (SQLite) index of Rinex headers keyed by path, mtime and size.
+
+    A file is only opened when it is not in the index or has changed since it
+    was indexed, so repeated runs never reopen unchanged files.
+    """
+    def __init__(self, index_path=INDEX_PATH):
+        if os.path.dirname(index_path):
+            os.makedirs(os.path.dirname(index_path), exist_ok=True)
+        # Stations look up positions concurrently, wait for the lock of another writer
+        self.db = sqlite3.connect(index_path, timeout=60)
+        self.db.execute("""CREATE TABLE IF NOT EXISTS headers (
+                               path TEXT PRIMARY KEY, mtime REAL, size INTEGER,
+                               marker_name TEXT, time_first_obs TEXT, time_last_obs TEXT,
+                               header TEXT)""")
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def get(self, file_path):
+        """
+        Header of a file (see scan_header), from the index when up to date.
+        """
+        file_path = os.path.abspath(file_path)
+        stat = os.stat(file_path)
+        row = self.db.execute("SELECT mtime, size, header FROM headers WHERE path = ?", (file_path,)).fetchone()
+        if row is not None and row[0] == stat.st_mtime and row[1] == stat.st_size:
+            return json.loads(row[2])
+
+        info = scan_header(file_path)
+        self.db.execute("INSERT OR REPLACE INTO headers VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (file_path, stat.st_mtime, stat.st_size, info["marker_name"],
+                         info["time_first_obs"], info["time_last_obs"], json.dumps(info)))
+        self.db.commit()
+        return info
+
+    def lookup(self, file_path):
+        """
+        Approximate receiver position of a file from its header, through the index.
+
+        Returns:
+        - tuple: (x, y, z) in meters, None if the header has no APPROX POSITION XYZ.
+        """
+        xyz = self.get(file_path)["approx_xyz"]
+        return tuple(xyz) if xyz else None
+
+    def update(self, directory):
+        """
+        Index all Rinex observation files in a directory.
+
+        Returns:
+        - int: Number of files in the directory that are in the index.
+        """
+        n_files = 0
+        for filename in sorted(os.listdir(directory)):
+            if RINEX_PATTERN.search(filename):
+                try:
+                    self.get(os.path.join(directory, filename))
+                    n_files += 1
+                except (OSError, ValueError) as e:
+                    print(f"Could not read header of {filename}: {e}")
+        return n_files
+
+    def find(self, marker_name=None, start=None, end=None):
+        """
+        Catalog query over the index.
+
+        Args:
+        - marker_name (str): Only files of this marker (case insensitive).
+        - start, end (datetime): Only files with observations overlapping [start, end].
+
+        Returns:
+        - list: (path, header dict) sorted by time of first observation.
+        """
+        query = "SELECT path, header FROM headers WHERE 1 = 1"
+        params = []
+        if marker_name is not None:
+            query += " AND upper(marker_name) = ?"
+            params.append(marker_name.upper())
+        if start is not None:
+            query += " AND (time_last_obs IS NULL OR time_last_obs >= ?)"
+            params.append(start.isoformat())
+        if end is not None:
+            query += " AND (time_first_obs IS NULL OR time_first_obs <= ?)"
+            params.append(end.isoformat())
+        query += " ORDER BY time_first_obs"
+        return [(path, json.loads(header)) for path, header in self.db.execute(query, params)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Index the Rinex headers of a directory and list them.")
+    parser.add_argument("directory", help="Directory with Rinex files")
+    parser.add_argument("--index", default=INDEX_PATH, help="Index database")
+    parser.add_argument("--marker", default=None, help="Only list this marker name")
+    args = parser.parse_args()
+
+    with header_index(args.index) as index:
+        n_files = index.update(args.directory)
+        print(f"{n_files} Rinex files indexed")
+        for path, info in index.find(marker_name=args.marker):
+            print(f"{os.path.basename(path)}  {info['marker_name']:10s} {info['time_first_obs']}  "
+                  f"{info['interval']}s  {info['approx_xyz']}")
@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+
+import os
+import fcntl
+import argparse
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import numpy as np
+import gnss_ir_util as src
+import snr_cache
+import rinex3_snr
+import reflector_height
+import result_store
+import orbit_cache
+
+# ---- Defaults ----
+# One columnar SNR window per station, next to the gnssrefl output
+WINDOW_PATH = os.path.join(os.environ.get('REFL_CODE', '.'), "snr_window")
+WINDOW_SUFFIX = ".npc"
+WINDOW_HOURS = 3.0          # Must exceed the last hour plus delTmax, so the arcs of the last hour are whole
+# ------------------
+
+UNIX_EPOCH = datetime(1970, 1, 1)
+
+
+def _to_datetime(seconds):
+    return UNIX_EPOCH + timedelta(seconds=float(seconds))
+
+
+class snr_window:
+    """
+    Rolling window of the most recent SNR observations of a station.
+
+    Hourly or 15 minute Rinex3 files are added as they arrive; observations
+    older than the window are dropped. The window is kept as a columnar file
+    (see snr_cache.write_columns) with the time as seconds since 1970, so it
+    runs across midnight. Reflector heights are estimated on the whole window
+    but only the arcs that are complete and not reported before are returned,
+    so every update costs a few hours of data instead of the whole day.
+    The angles of every observation are computed from the orbit of its own
+    day, also for windows and files running across midnight.
+    """
+    def __init__(self, station, window_path=WINDOW_PATH, hours=WINDOW_HOURS):
+        self.station = station
+        self.window_path = window_path
+        self.hours = hours
+        os.makedirs(window_path, exist_ok=True)
+
+    @property
+    def path(self):
+        return os.path.join(self.window_path, self.station.station_id.upper() + WINDOW_SUFFIX)
+
+    def load(self):
+        """
+        Returns:
+        - tuple: ({column name: np.memmap}, metadata with the added files and the reported arcs)
+        """
+        if not os.path.exists(self.path):
+            return {name: np.zeros(0, dtype=dtype) for name, dtype in snr_cache.SNR_COLUMNS}, {}
+        stored, metadata = snr_cache.read_columns(self.path)
+        n_rows = len(stored["seconds"])
+        columns = {name: stored[name] if name in stored else np.zeros(n_rows, dtype=dtype)
+                   for name, dtype in snr_cache.SNR_COLUMNS}
+        return columns, metadata
+
+    @staticmethod
+    def _file_end(name):
+        # End of the period of a Rinex3 file in seconds since 1970, files older than the window are forgotten
+        parsed = src.parse_rinex3_name(name)
+        if parsed is None:
+            return np.inf
+        return (parsed[1] - UNIX_EPOCH).total_seconds() + parsed[2]
+
+    @contextmanager
+    def _locked(self):
+        # Watch mode and manual updates may add to the same window at the same time
+        with open(self.path + ".lock", 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _orbit(day_start, sp3_paths=None):
+        # SP3 file of the day itself, from sp3_paths or the orbit cache; None if not available yet
+        day = (day_start.year, day_start.timetuple().tm_yday)
+        if sp3_paths and day in sp3_paths:
+            return sp3_paths[day]
+        return orbit_cache.get_cache().fetch(*day)
+
+    def _snr_table(self, rinex_path, sp3_paths=None):
+        """
+        SNR rows of a Rinex3 file, seconds since 1970. Observations after
+        midnight take the orbit of the next day instead of extrapolating.
+
+        Returns:
+        - np.ndarray: (N, 11) SNR rows, None when the orbit of a day is not available.
+        """
+        day_start, sat_numbers, seconds, snr = rinex3_snr.read_snr_observations(rinex_path, self.station.samplerate)
+        day_index = (seconds // 86400).astype(int)
+        tables = []
+        for day in np.unique(day_index):
+            rows = day_index == day
+            start = day_start + timedelta(days=int(day))
+            sp3_path = self._orbit(start, sp3_paths)
+            if sp3_path is None:
+                print(f">>  {os.path.basename(rinex_path)}: no orbit for {start:%Y %j} yet, added on a later update")
+                return None
+            table = rinex3_snr.snr_rows(start, sat_numbers[rows], seconds[rows] - day * 86400, snr[rows], sp3_path,
+                                        self.station.lat, self.station.lon, self.station.height,
+                                        self.station.rinex2snr_snr)
+            table[:, 3] += (start - UNIX_EPOCH).total_seconds()
+            tables.append(table)
+        return np.concatenate(tables)
+
+    def add_files(self, rinex_paths, sp3_paths=None):
+        """
+        Add the SNR observations of sub-daily Rinex3 files to the window.
+
+        Args:
+        - rinex_paths (list): Rinex3 files, e.g. NUK200GRL_R_20241401300_01H_01S_MO.crx.gz.
+        - sp3_paths (dict): {(year, doy): SP3 file}, default the orbit cache (see orbit_cache.py).
+
+        Returns:
+        - int: Number of rows in the window.
+        """
+        with self._locked():
+            columns, metadata = self.load()
+            files = metadata.get("files", {})
+            tables = [np.column_stack([columns[name].astype(float) for name, _ in snr_cache.SNR_COLUMNS])]
+            for rinex_path in rinex_paths:
+                name, mtime = os.path.basename(rinex_path), os.path.getmtime(rinex_path)
+                if files.get(name) == mtime:
+                    continue
+                table = self._snr_table(rinex_path, sp3_paths)
+                if table is not None:
+                    tables.append(table)
+                    files[name] = mtime
+
+            window = np.concatenate(tables)
+            if len(window):
+                # Drop what fell out of the window, and rows of files that were added again
+                window = window[window[:, 3] > window[:, 3].max() - self.hours * 3600]
+                window = np.unique(window, axis=0)
+                window = window[np.lexsort((window[:, 0], window[:, 3]))]
+                files = {name: mtime for name, mtime in files.items() if self._file_end(name) > window[0, 3]}
+
+            metadata["files"] = files
+            snr_cache.write_columns({name: window[:, i].astype(dtype) for i, (name, dtype)
+                                     in enumerate(snr_cache.SNR_COLUMNS)}, self.path, metadata)
+        return len(window)
+
+    def estimate(self, periodogram=None):
+        """
+        Reflector heights of the arcs completed since the last call.
+
+        An arc lasts at most delTmax minutes, so an arc whose mean time is more
+        than delTmax / 2 from both ends of the window lies wholly inside it:
+        arcs still rising at the newest epoch or cut at the start are left for
+        a later update or were reported before.
+
+        Returns:
+        - tuple: (reflector_height.RESULT_DTYPE table, datetime of every arc)
+        """
+        with self._locked():
+            columns, metadata = self.load()
+            if len(columns["seconds"]) == 0:
+                return np.zeros(0, dtype=reflector_height.RESULT_DTYPE), []
+            times = np.asarray(columns["seconds"], dtype=float)
+            window_start, window_end = times[0], times[-1]
+            snr = np.column_stack([columns[name].astype(float) for name, _ in snr_cache.SNR_COLUMNS])
+            snr[:, 3] = times - window_start
+
+            gnssir_input = self.station.gnssir_input
+            half_arc = float(gnssir_input.get("delTmax", 75.0)) * 60 / 2
+            table = reflector_height.estimate_reflector_heights(
+                snr, periodogram=periodogram or self.station.periodogram, **gnssir_input)
+            arc_times = table['seconds'] + window_start
+            whole = (arc_times > window_start + half_arc) & (arc_times < window_end - half_arc)
+
+            # Arcs are reported once, keyed by satellite, frequency, direction and mean time
+            reported = set(metadata.get("reported", []))
+            keys = [f"{sat}/{freq}/{int(rising)}/{round(t)}"
+                    for sat, freq, rising, t in zip(table['sat'], table['freq'], table['rising'], arc_times)]
+            new = whole & np.array([key not in reported for key in keys], bool)
+            metadata["reported"] = sorted(key for key in reported | {k for k, n in zip(keys, new) if n}
+                                          if float(key.rsplit("/", 1)[1]) > window_start)
+            snr_cache.write_columns(columns, self.path, metadata)
+            return table[new], [_to_datetime(t) for t in arc_times[new]]
+
+    def append_to_store(self, table, arc_times, store=None):
+        """
+        Append near-real-time reflector heights to the station's result store.
+
+        The rows are added to those of the day already stored, marked as
+        provisional (no refraction correction, see result_store.query); the
+        daily gnssir processing later replaces the whole day.
+
+        Returns:
+        - int: Number of rows appended.
+        """
+        store = store or result_store.result_store()
+        days = np.array([t.year * 1000 + t.timetuple().tm_yday for t in arc_times], dtype=int)
+        for day in np.unique(days):
+            rows = table[days == day].copy()
+            day_start = datetime(day // 1000, 1, 1) + timedelta(days=int(day % 1000) - 1)
+            rows['seconds'] = [(t - day_start).total_seconds() for t, d in zip(arc_times, days) if d == day]
+            store.append(self.station.station_id,
+                         result_store.columns_from_estimates(rows, day // 1000, day % 1000, provisional=True),
+                         replace_days=False)
+        return len(table)
+
+
+def update(station, rinex_paths, sp3_paths=None, window_path=WINDOW_PATH, hours=WINDOW_HOURS, store=None):
+    """
+    Add sub-daily Rinex3 files to the station's window and store the reflector heights of the newly completed arcs.
+
+    Returns:
+    - int: Number of new reflector heights.
+    """
+    window = snr_window(station, window_path, hours)
+    window.add_files(rinex_paths, sp3_paths)
+    table, arc_times = window.estimate()
+    return window.append_to_store(table, arc_times, store)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Add hourly or 15 minute Rinex3 files to the rolling SNR window "
+                                                 "of a station and store the reflector heights of completed arcs.")
+    parser.add_argument("station_id", help="Station ID in the station registry (e.g., NUK2)")
+    parser.add_argument("rinex_files", nargs="+", help="Sub-daily Rinex3 files (.crx.gz, .rnx, ...)")
+    parser.add_argument("--sp3", nargs="+", default=[],
+                        help="SP3 orbit files of the days of the files (default: the orbit cache)")
+    parser.add_argument("--registry", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "stations.json"))
+    parser.add_argument("--window", default=WINDOW_PATH, help="Directory of the SNR windows")
+    parser.add_argument("--hours", type=float, default=WINDOW_HOURS, help="Length of the window in hours")
+    args = parser.parse_args()
+
+    station = src.load_station_registry(args.registry)[args.station_id.upper()]
+    sp3_paths = {}
+    for sp3_path in args.sp3:
+        t0 = orbit_cache.read_sp3(sp3_path).t0
+        sp3_paths[(t0.year, t0.timetuple().tm_yday)] = sp3_path
+    n_new = update(station, args.rinex_files, sp3_paths, args.window, args.hours)
+    print(f"{station.station_id}: {n_new} new reflector heights")
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+
+import os
+import argparse
+import numpy as np
+import gnss_ir_util as src
+import orbit_cache
+
+# ---- Defaults ----
+N_POINTS = 10               # SP3 epochs per Lagrange interpolation (order + 1)
+# ------------------
+
+
+def lagrange_weights(nodes_t, seconds, n_points=N_POINTS):
+    """
+    Lagrange interpolation weights, and their time derivatives, at a set of times.
+
+    The weights only depend on the time and the SP3 epochs, not on the
+    satellite, so they are computed once per epoch and shared by all
+    satellites observed at that epoch.
+
+    Args:
+    - nodes_t (np.ndarray): SP3 epochs in seconds, evenly spaced.
+    - seconds (np.ndarray): (n,) times in seconds, on the scale of nodes_t.
+    - n_points (int): Number of SP3 epochs used per interpolation.
+
+    Returns:
+    - tuple: (first SP3 epoch index (n,), weights (n, n_points), weights per second (n, n_points))
+    """
+    n_points = min(n_points, len(nodes_t))
+    seconds = np.asarray(seconds, dtype=float)
+
+    # Window of SP3 epochs centered around each time
+    dt = nodes_t[1] - nodes_t[0]
+    start = np.floor((seconds - nodes_t[0]) / dt).astype(int) - (n_points // 2 - 1)
+    start = np.clip(start, 0, len(nodes_t) - n_points)
+    t = nodes_t[start[:, None] + np.arange(n_points)]             # (n, n_points)
+
+    weights = np.ones_like(t)
+    rates = np.zeros_like(t)
+    for k in range(n_points):
+        for m in range(n_points):
+            if m == k:
+                continue
+            # Product rule, so the derivative stays finite at the SP3 epochs
+            factor = (seconds - t[:, m]) / (t[:, k] - t[:, m])
+            rates[:, k] = rates[:, k] * factor + weights[:, k] / (t[:, k] - t[:, m])
+            weights[:, k] *= factor
+    return start, weights, rates
+
+
+class sat_geometry:
+    """
+    Elevation and azimuth angles of all satellites of an orbit seen from one station.
+
+    The station position (from the registry) is converted once to ECEF and a
+    local east/north/up rotation. Positions and velocities of the satellites
+    are interpolated from the SP3 epochs for all (satellite, time) pairs at
+    once, one whole-array operation per interpolation node, so a station-day
+    at 1-2 s sampling is a few dozen array operations instead of a loop over
+    satellites and epochs. Without an orbit (None) only look_angles of given
+    positions is available.
+    """
+    def __init__(self, orbit, lat, lon, height, n_points=N_POINTS):
+        self.orbit = orbit
+        self.lat, self.lon, self.height = lat, lon, height
+        self.n_points = n_points
+        self.rx_xyz = src.llh2xyz(lat, lon, height)
+        phi, lam = np.radians(lat), np.radians(lon)
+        self.enu = np.array([[-np.sin(lam), np.cos(lam), 0.0],
+                             [-np.sin(phi) * np.cos(lam), -np.sin(phi) * np.sin(lam), np.cos(phi)],
+                             [np.cos(phi) * np.cos(lam), np.cos(phi) * np.sin(lam), np.sin(phi)]])
+        self.index = orbit.sat_index() if orbit is not None else {}
+
+    @classmethod
+    def for_station(cls, station, sp3_path, n_points=N_POINTS):
+        """
+        Geometry of a registry station (see src.load_station_registry) for the orbit of an SP3 file.
+        """
+        return cls(orbit_cache.read_sp3(sp3_path), station.lat, station.lon, station.height, n_points)
+
+    def sat_rows(self, sats):
+        """
+        Orbit row of each satellite ID (e.g. 'G01'), -1 where the orbit has no positions.
+        """
+        return np.array([self.index.get(sat, -1) for sat in sats], dtype=int)
+
+    def positions(self, rows, seconds):
+        """
+        Interpolated ECEF positions and velocities.
+
+        Args:
+        - rows (np.ndarray): (n,) orbit row per observation (see sat_rows), -1 gives NaN.
+        - seconds (np.ndarray): (n,) times in seconds since orbit.t0.
+
+        Returns:
+        - tuple: (positions (n, 3) in meters, velocities (n, 3) in meters per second)
+        """
+        rows = np.asarray(rows, dtype=int)
+        # Weights per distinct epoch; all satellites of an epoch share them
+        epochs, inverse = np.unique(np.asarray(seconds, dtype=float), return_inverse=True)
+        start, weights, rates = lagrange_weights(self.orbit.seconds, epochs, self.n_points)
+        start, known = start[inverse], rows >= 0
+        safe_rows = np.where(known, rows, 0)
+
+        xyz = np.zeros((len(rows), 3))
+        vel = np.zeros((len(rows), 3))
+        for k in range(weights.shape[1]):
+            nodes = self.orbit.xyz[safe_rows, start + k]
+            xyz += weights[inverse, k, None] * nodes
+            vel += rates[inverse, k, None] * nodes
+        xyz[~known] = np.nan
+        vel[~known] = np.nan
+        return xyz, vel
+
+    def look_angles(self, xyz, vel=None):
+        """
+        Elevation and azimuth angles, and the elevation rate, of ECEF satellite positions.
+
+        Args:
+        - xyz (np.ndarray): (n, 3) positions in meters.
+        - vel (np.ndarray): (n, 3) velocities in meters per second, None when not known.
+
+        Returns:
+        - tuple: (elevation (n,) degrees, azimuth (n,) degrees 0-360 clockwise from north,
+          elevation rate (n,) degrees per second, NaN without velocities)
+        """
+        east, north, up = ((np.asarray(xyz) - self.rx_xyz) @ self.enu.T).T
+        horizontal = np.hypot(east, north)
+        elev = np.degrees(np.arctan2(up, horizontal))
+        azim = np.mod(np.degrees(np.arctan2(east, north)), 360)
+        if vel is None:
+            return elev, azim, np.full_like(elev, np.nan)
+        v_east, v_north, v_up = (np.asarray(vel) @ self.enu.T).T
+        horizontal_rate = (east * v_east + north * v_north) / horizontal
+        edot = np.degrees((horizontal * v_up - up * horizontal_rate) / (horizontal**2 + up**2))
+        return elev, azim, edot
+
+    def elev_azim(self, rows, seconds):
+        """
+        Elevation and azimuth angles, and the elevation rate, for (satellite, time) pairs.
+
+        Args:
+        - rows (np.ndarray): (n,) orbit row per observation (see sat_rows).
+        - seconds (np.ndarray): (n,) times in seconds since orbit.t0.
+
+        Returns:
+        - tuple: (elevation (n,) degrees, azimuth (n,) degrees 0-360 clockwise from north,
+          elevation rate (n,) degrees per second), NaN where the orbit has no position.
+        """
+        return self.look_angles(*self.positions(rows, seconds))
+
+    def sky(self, seconds, sats=None):
+        """
+        Elevation and azimuth angles of satellites at all given times, e.g. for a whole day.
+
+        Args:
+        - seconds (np.ndarray): (n_epochs,) times in seconds since orbit.t0.
+        - sats (list): Satellite IDs, default all satellites of the orbit.
+
+        Returns:
+        - tuple: (sats, elevation (n_sats, n_epochs), azimuth (n_sats, n_epochs), elevation rate (n_sats, n_epochs))
+        """
+        sats = list(self.orbit.sats) if sats is None else list(sats)
+        seconds = np.asarray(seconds, dtype=float)
+        rows = np.repeat(self.sat_rows(sats), len(seconds))
+        elev, azim, edot = self.elev_azim(rows, np.tile(seconds, len(sats)))
+        shape = (len(sats), len(seconds))
+        return sats, elev.reshape(shape), azim.reshape(shape), edot.reshape(shape)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Elevation and azimuth angles of all satellites of an SP3 orbit "
+                                                 "seen from a registry station.")
+    parser.add_argument("station_id", help="Station ID in the station registry (e.g., KULL)")
+    parser.add_argument("sp3_file", help="SP3 orbit file for the day")
+    parser.add_argument("--registry", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "stations.json"))
+    parser.add_argument("--interval", type=float, default=30.0, help="Time step in seconds")
+    parser.add_argument("--min_elev", type=float, default=0.0, help="Lowest elevation angle written (degrees)")
+    parser.add_argument("--output", default=None, help="Output text file (default: standard output)")
+    args = parser.parse_args()
+
+    station = src.load_station_registry(args.registry)[args.station_id.upper()]
+    geometry = sat_geometry.for_station(station, args.sp3_file)
+    seconds = np.arange(0, geometry.orbit.seconds[-1] + args.interval / 2, args.interval)
+    sats, elev, azim, edot = geometry.sky(seconds)
+    sat_i, epoch_i = np.nonzero(elev > args.min_elev)
+    lines = [f"{sats[i]} {seconds[j]:8.0f} {elev[i, j]:8.4f} {azim[i, j]:9.4f} {edot[i, j]:10.6f}"
+             for i, j in zip(sat_i, epoch_i)]
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write("\n".join(lines) + "\n")
+    else:
+        print("\n".join(lines))
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+
+import os
+import glob
+import json
+import argparse
+import numpy as np
+
+# ---- Defaults ----
+CACHE_SUFFIX = ".npc"               # Cache file next to the text SNR file: kull1400.24.snr66 -> kull1400.24.snr66.npc
+MAGIC = b"GNSSIRCOL1\n"
+ALIGNMENT = 64                      # Byte alignment of every column block
+# ------------------
+
+# Columns of the SNR file (sat elev azim seconds edot S6 S1 S2 S5 S7 S8) and their stored dtype
+SNR_COLUMNS = [("sat", "<i2"), ("elev", "<f4"), ("azim", "<f4"), ("seconds", "<f8"), ("edot", "<f4"),
+               ("S6", "<f4"), ("S1", "<f4"), ("S2", "<f4"), ("S5", "<f4"), ("S7", "<f4"), ("S8", "<f4")]
+
+
+def cache_path(snr_path):
+    # Text SNR files may be gzipped by gnssrefl, the cache sits next to the uncompressed name
+    if snr_path.endswith(".gz"):
+        snr_path = snr_path[:-3]
+    return snr_path + CACHE_SUFFIX
+
+def write_columns(columns, path, metadata=None):
+    """
+    Write named 1-D arrays of equal length as a columnar binary file.
+
+    Layout: MAGIC, 8 byte header length, a JSON header with the row count,
+    the dtype and byte offset of every column and optional metadata, then one
+    aligned block per column. The file is replaced atomically, so readers
+    never see a half written file.
+    """
+    n_rows = len(next(iter(columns.values()))) if columns else 0
+    header_columns, blocks, offset = {}, [], 0
+    for name, values in columns.items():
+        block = np.ascontiguousarray(values)
+        offset = -(-offset // ALIGNMENT) * ALIGNMENT
+        header_columns[name] = {"dtype": block.dtype.str, "offset": offset}
+        blocks.append((offset, block))
+        offset += block.nbytes
+
+    header = json.dumps({"n_rows": n_rows, "columns": header_columns, "metadata": metadata or {}}).encode()
+    data_start = -(-(len(MAGIC) + 8 + len(header)) // ALIGNMENT) * ALIGNMENT
+    tmp_path = path + ".part"
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(len(header).to_bytes(8, 'little'))
+        f.write(header)
+        for block_offset, block in blocks:
+            f.seek(data_start + block_offset)
+            f.write(block.tobytes())
+        f.truncate(data_start + offset)
+    os.replace(tmp_path, path)
+
+def is_columnar(path):
+    """
+    True when path is a columnar file in the current format. Caches of an
+    older format (another MAGIC) are stale and are rebuilt from their source.
+    """
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+def read_columns(path):
+    """
+    Memory-map a columnar binary file written by write_columns.
+
+    Returns:
+    - tuple: ({column name: read-only np.memmap}, metadata dict)
+    """
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a columnar cache file")
+        header_length = int.from_bytes(f.read(8), 'little')
+        header = json.loads(f.read(header_length))
+    data_start = -(-(len(MAGIC) + 8 + header_length) // ALIGNMENT) * ALIGNMENT
+    n_rows = header["n_rows"]
+
+    columns = {}
+    for name, stored in header["columns"].items():
+        if n_rows == 0:
+            columns[name] = np.zeros(0, dtype=stored["dtype"])
+        else:
+            columns[name] = np.memmap(path, dtype=stored["dtype"], mode='r',
+                                      offset=data_start + stored["offset"], shape=(n_rows,))
+    return columns, header.get("metadata", {})
+
+def write_cache(snr, path):
+    """
+    Write an (N, 11) SNR array as a columnar SNR cache. SNR columns that are
+    zero for all rows (bands not observed) are not stored.
+    """
+    snr = np.asarray(snr)
+    columns = {}
+    for i, (name, dtype) in enumerate(SNR_COLUMNS):
+        values = snr[:, i] if i < snr.shape[1] else np.zeros(len(snr))
+        if name.startswith("S") and not np.any(values):
+            continue
+        columns[name] = values.astype(dtype)
+    write_columns(columns, path)
+
+def read_cache(path):
+    """
+    Memory-map a columnar SNR cache.
+
+    Returns:
+    - dict: {column name: read-only np.memmap}, zero arrays for the SNR columns that were not stored.
+    """
+    stored, _ = read_columns(path)
+    n_rows = len(next(iter(stored.values())))
+    return {name: stored[name] if name in stored else np.zeros(n_rows, dtype=dtype) for name, dtype in SNR_COLUMNS}
+
+def load_snr(snr_path, columns=False):
+    """
+    Read SNR observations, through the binary cache.
+
+    The text SNR file is parsed only the first time (or after it changed, or
+    when the cache is of an older format); later reads memory-map the cache. With only the cache present (the text
+    file removed to save disk) the cache is used as is.
+
+    Args:
+    - snr_path (str): Text SNR file as written by rinex2snr.
+    - columns (bool): Return the memory-mapped columns instead of an (N, 11) array.
+
+    Returns:
+    - np.ndarray or dict: (N, 11) array in SNR file column order, or {column name: array}.
+    """
+    path = cache_path(snr_path)
+    text_exists = os.path.exists(snr_path)
+    if (not os.path.exists(path) or not is_columnar(path)
+            or (text_exists and os.path.getmtime(snr_path) > os.path.getmtime(path))):
+        if not text_exists:
+            raise FileNotFoundError(snr_path)
+        write_cache(np.loadtxt(snr_path, ndmin=2), path)
+
+    snr_columns = read_cache(path)
+    if columns:
+        return snr_columns
+    return np.column_stack([snr_columns[name].astype(float) for name, _ in SNR_COLUMNS])
+
+def convert_directory(directory, remove_text=False):
+    """
+    Build the cache of every text SNR file in a directory, e.g. $REFL_CODE/2024/snr/kull.
+
+    Returns:
+    - tuple: (bytes of the text files, bytes of the cache files)
+    """
+    text_bytes, cache_bytes = 0, 0
+    for snr_path in sorted(glob.glob(os.path.join(directory, "*.snr*"))):
+        if snr_path.endswith(CACHE_SUFFIX) or snr_path.endswith(".part"):
+            continue
+        load_snr(snr_path, columns=True)
+        text_bytes += os.path.getsize(snr_path)
+        cache_bytes += os.path.getsize(cache_path(snr_path))
+        if remove_text:
+            os.remove(snr_path)
+    return text_bytes, cache_bytes
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert text SNR files to the binary SNR cache.")
+    parser.add_argument("directories", nargs="+", help="SNR directories (e.g., $REFL_CODE/2024/snr/kull)")
+    parser.add_argument("--remove_text", action="store_true", help="Remove the text SNR files after conversion")
+    args = parser.parse_args()
+
+    for directory in args.directories:
+        text_bytes, cache_bytes = convert_directory(directory, remove_text=args.remove_text)
+        print(f"{directory}: {text_bytes / 1e6:.1f} MB text -> {cache_bytes / 1e6:.1f} MB cache")
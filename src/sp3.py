@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+
+import gzip
+import numpy as np
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+
+
+@dataclass
+class sp3_orbit:
+    t0: datetime                # Time of the first epoch
+    seconds: np.ndarray         # (n_epochs,) seconds since t0
+    sats: list                  # Satellite IDs, e.g. 'G01'
+    xyz: np.ndarray             # (n_sats, n_epochs, 3) ECEF positions in meters, NaN if missing
+
+    def sat_index(self):
+        return {sat: i for i, sat in enumerate(self.sats)}
+
+
+def read_sp3(file_path):
+    """
+    Read satellite positions from an SP3-c/d orbit file (optionally gzip compressed).
+
+    Args:
+    - file_path (str): Path to the SP3 file.
+
+    Returns:
+    - sp3_orbit
+    """
+    opener = gzip.open if file_path.endswith('.gz') else open
+    epochs = []
+    positions = {}              # {sat: {epoch index: (x, y, z)}}
+    with opener(file_path, 'rt') as sp3_file:
+        for line in sp3_file:
+            if line.startswith('*'):
+                year, month, day, hour, minute, sec = line[1:].split()[0:6]
+                epochs.append(datetime(int(year), int(month), int(day), int(hour), int(minute))
+                              + timedelta(seconds=float(sec)))
+            elif line.startswith('P') and epochs:
+                sat = line[1:4].replace(' ', '0')
+                xyz = [float(line[4:18]), float(line[18:32]), float(line[32:46])]
+                if xyz == [0.0, 0.0, 0.0]:
+                    continue        # Bad or absent position
+                positions.setdefault(sat, {})[len(epochs) - 1] = xyz
+            elif line.startswith('EOF'):
+                break
+
+    sats = sorted(positions)
+    xyz = np.full((len(sats), len(epochs), 3), np.nan)
+    for i, sat in enumerate(sats):
+        index = np.fromiter(positions[sat].keys(), dtype=int)
+        xyz[i, index] = np.array(list(positions[sat].values())) * 1000.0      # km -> m
+
+    t0 = epochs[0]
+    seconds = np.array([(t - t0).total_seconds() for t in epochs])
+    return sp3_orbit(t0=t0, seconds=seconds, sats=sats, xyz=xyz)
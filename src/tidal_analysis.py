@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+
+import os
+import argparse
+from dataclasses import dataclass
+from datetime import datetime
+import numpy as np
+import gnss_ir_util as src
+import result_store
+
+# ---- Defaults ----
+DEFAULT_CONSTITUENTS = ["M2", "S2", "N2", "K2", "K1", "O1", "P1", "Q1", "M4", "MS4", "Mf", "Mm", "Ssa", "Sa"]
+ROW_CHUNK = 50000                   # Observations per station that go into the normal equations at a time
+DESIGN_CACHE_BYTES = 2e9            # Keep the design matrix between the outlier iterations up to this size
+# ------------------
+
+# Doodson numbers of the constituents: multiples of (tau, s, h, p, N', p1) and a phase offset [deg]
+CONSTITUENTS = {
+    "M2":  (2, 0, 0, 0, 0, 0, 0),
+    "S2":  (2, 2, -2, 0, 0, 0, 0),
+    "N2":  (2, -1, 0, 1, 0, 0, 0),
+    "2N2": (2, -2, 0, 2, 0, 0, 0),
+    "K2":  (2, 2, 0, 0, 0, 0, 0),
+    "K1":  (1, 1, 0, 0, 0, 0, 90),
+    "O1":  (1, -1, 0, 0, 0, 0, -90),
+    "P1":  (1, 1, -2, 0, 0, 0, -90),
+    "Q1":  (1, -2, 0, 1, 0, 0, -90),
+    "M4":  (4, 0, 0, 0, 0, 0, 0),
+    "MS4": (4, 2, -2, 0, 0, 0, 0),
+    "M6":  (6, 0, 0, 0, 0, 0, 0),
+    "Mf":  (0, 2, 0, 0, 0, 0, 0),
+    "Mm":  (0, 1, 0, -1, 0, 0, 0),
+    "Ssa": (0, 0, 2, 0, 0, 0, 0),
+    "Sa":  (0, 0, 1, 0, 0, 0, 0),
+}
+
+
+def astronomical_arguments(mjd):
+    """
+    Mean longitudes [deg] of the lunar time tau, moon s, sun h, lunar perigee p,
+    negative lunar node N' and solar perigee p1 at the MJD (UT) times.
+
+    Returns:
+    - np.ndarray: (len(mjd), 6)
+    """
+    mjd = np.asarray(mjd, dtype=float)
+    T = (mjd - 51544.5) / 36525                     # Julian centuries since J2000
+    s = 218.3164 + 481267.8813 * T
+    h = 280.4661 + 36000.7698 * T
+    p = 83.3535 + 4069.0137 * T
+    N = 125.0445 - 1934.1363 * T
+    p1 = 282.9384 + 1.7195 * T
+    tau = 360 * (mjd % 1) + h - s
+    return np.stack([tau, s, h, p, -N, p1], axis=-1)
+
+def constituent_speeds(names):
+    # Angular speeds [deg/hour] of the constituents, from the rates of the astronomical arguments
+    rates = astronomical_arguments(1 / 24) - astronomical_arguments(0.0)
+    doodson = np.array([CONSTITUENTS[name][:6] for name in names], dtype=float)
+    return doodson @ rates
+
+def nodal_corrections(names, mjd):
+    """
+    Nodal amplitude factors f and phase corrections u [deg] (Schureman approximations).
+
+    Returns:
+    - tuple: (f, u), each (len(mjd), len(names))
+    """
+    N = np.radians(125.0445 - 1934.1363 * (np.asarray(mjd, dtype=float) - 51544.5) / 36525)
+    cos1, cos2, cos3 = np.cos(N), np.cos(2 * N), np.cos(3 * N)
+    sin1, sin2, sin3 = np.sin(N), np.sin(2 * N), np.sin(3 * N)
+    f_m2, u_m2 = 1.0004 - 0.0373 * cos1 + 0.0002 * cos2, -2.14 * sin1
+    one, zero = np.ones_like(N), np.zeros_like(N)
+    corrections = {
+        "M2": (f_m2, u_m2), "N2": (f_m2, u_m2), "2N2": (f_m2, u_m2),
+        "S2": (one, zero), "P1": (one, zero), "Sa": (one, zero), "Ssa": (one, zero),
+        "K2": (1.0241 + 0.2863 * cos1 + 0.0083 * cos2 - 0.0015 * cos3, -17.74 * sin1 + 0.68 * sin2 - 0.04 * sin3),
+        "K1": (1.0060 + 0.1150 * cos1 - 0.0088 * cos2 + 0.0006 * cos3, -8.86 * sin1 + 0.68 * sin2 - 0.07 * sin3),
+        "O1": (1.0089 + 0.1871 * cos1 - 0.0147 * cos2 + 0.0014 * cos3, 10.80 * sin1 - 1.34 * sin2 + 0.19 * sin3),
+        "M4": (f_m2 ** 2, 2 * u_m2), "MS4": (f_m2, u_m2), "M6": (f_m2 ** 3, 3 * u_m2),
+        "Mf": (1.043 + 0.414 * cos1, -23.7 * sin1 + 2.7 * sin2 - 0.4 * sin3),
+        "Mm": (1.000 - 0.130 * cos1, zero),
+    }
+    corrections["Q1"] = corrections["O1"]
+    f = np.stack([corrections[name][0] for name in names], axis=-1)
+    u = np.stack([corrections[name][1] for name in names], axis=-1)
+    return f, u
+
+def design_matrix(names, mjd, t_ref, trend=False):
+    """
+    Columns: mean, (trend per year), then f cos(V + u) and f sin(V + u) of every constituent.
+    """
+    doodson = np.array([CONSTITUENTS[name] for name in names], dtype=float)
+    V = astronomical_arguments(mjd) @ doodson[:, :6].T + doodson[:, 6]
+    # The nodal corrections change over 18.6 years, evaluate them once per day
+    days, day_index = np.unique(np.floor(mjd), return_inverse=True)
+    f, u = nodal_corrections(names, days + 0.5)
+    f, u = f[day_index], u[day_index]
+    argument = np.radians((V + u) % 360)
+    columns = [np.ones((len(mjd), 1))]
+    if trend:
+        columns.append(((np.asarray(mjd) - t_ref) / 365.25)[:, None])
+    columns += [f * np.cos(argument), f * np.sin(argument)]
+    return np.hstack(columns)
+
+
+@dataclass
+class tidal_fit:
+    """
+    Harmonic constants of a set of stations, one row per station
+    """
+    station_ids: list
+    constituents: list
+    amplitude: np.ndarray       # (n_stations, n_constituents), unit of the input series
+    phase: np.ndarray           # (n_stations, n_constituents), Greenwich phase lag [deg]
+    mean: np.ndarray            # (n_stations,)
+    trend: np.ndarray           # (n_stations,) per year, zero if not fitted
+    residual_std: np.ndarray    # (n_stations,)
+    n_obs: np.ndarray           # (n_stations,) observations used
+    t_ref: float                # MJD the trend refers to
+
+def fit_tides(series, constituents=DEFAULT_CONSTITUENTS, trend=False, n_sigma=3.0, n_iter=2):
+    """
+    Least squares harmonic analysis of irregularly sampled series of many stations.
+
+    The observations of all stations are stacked into one (stations, rows,
+    parameters) design matrix per chunk of rows and the normal equations of
+    all stations are accumulated and solved together. Nodal corrections are
+    evaluated once per day, at noon, and applied to every observation of
+    that day (they change over 18.6 years). Observations further than n_sigma
+    standard deviations from the fit are dropped and the fit repeated n_iter
+    times (outlier retrievals are common in GNSS-IR); every iteration is a
+    single pass over the rows.
+
+    Args:
+    - series (dict): {station_id: (mjd, values)} with times in MJD (UT).
+    - constituents (list): Constituent names, see CONSTITUENTS.
+    - trend (bool): Also fit a linear trend.
+
+    Returns:
+    - tidal_fit
+    """
+    station_ids = list(series)
+    n_stations = len(station_ids)
+    n_rows = max(len(series[s][0]) for s in station_ids)
+    mjd = np.zeros((n_stations, n_rows))
+    values = np.zeros((n_stations, n_rows))
+    valid = np.zeros((n_stations, n_rows), bool)
+    for i, station_id in enumerate(station_ids):
+        t, v = (np.asarray(a, dtype=float) for a in series[station_id])
+        mjd[i, :len(t)], values[i, :len(t)], valid[i, :len(t)] = t, v, np.isfinite(v)
+    mjd[~valid] = np.nanmedian(mjd[valid]) if np.any(valid) else 0.0
+    values[~valid] = 0.0
+    t_ref = float(np.mean(mjd[valid])) if np.any(valid) else 0.0
+
+    n_params = 1 + int(trend) + 2 * len(constituents)
+    cache_design = n_stations * n_rows * n_params * 8 <= DESIGN_CACHE_BYTES
+    design_chunks = {}
+    x, std = None, None
+    for iteration in range(n_iter + 1):
+        # One pass over the rows per iteration: drop the outliers of the previous fit and accumulate the normal equations
+        normal = np.zeros((n_stations, n_params, n_params))
+        rhs = np.zeros((n_stations, n_params))
+        yy = np.zeros(n_stations)
+        n_used = np.zeros(n_stations, int)
+        for first in range(0, n_rows, ROW_CHUNK):
+            rows = slice(first, first + ROW_CHUNK)
+            A = design_chunks.get(first)
+            if A is None:
+                A = design_matrix(constituents, mjd[:, rows].ravel(), t_ref, trend).reshape(n_stations, -1, n_params)
+                if cache_design:
+                    design_chunks[first] = A
+            used = valid[:, rows]
+            if x is not None:
+                residual = values[:, rows] - np.matmul(A, x[..., None])[..., 0]
+                used = used & (np.abs(residual) <= n_sigma * std[:, None])
+            Aw = A * used[..., None]
+            normal += np.matmul(Aw.transpose(0, 2, 1), Aw)
+            rhs += np.matmul(Aw.transpose(0, 2, 1), values[:, rows, None])[..., 0]
+            yy += np.sum(np.where(used, values[:, rows] ** 2, 0), axis=1)
+            n_used += used.sum(axis=1)
+        x = np.linalg.solve(normal + 1e-9 * np.eye(n_params), rhs[..., None])[..., 0]
+        # Sum of squared residuals from the normal equations: y'y - x'A'y
+        std = np.sqrt(np.maximum(yy - np.sum(x * rhs, axis=1), 0) / np.maximum(n_used - n_params, 1))
+
+    k = 1 + int(trend)
+    a, b = x[:, k:k + len(constituents)], x[:, k + len(constituents):]
+    return tidal_fit(station_ids=station_ids, constituents=list(constituents),
+                     amplitude=np.hypot(a, b), phase=np.degrees(np.arctan2(b, a)) % 360,
+                     mean=x[:, 0], trend=x[:, 1] if trend else np.zeros(n_stations),
+                     residual_std=std, n_obs=n_used, t_ref=t_ref)
+
+def predict_tides(fit, mjd):
+    """
+    Tide of every station of a fit on an arbitrary time grid.
+
+    Returns:
+    - np.ndarray: (n_stations, len(mjd))
+    """
+    mjd = np.asarray(mjd, dtype=float)
+    A = design_matrix(fit.constituents, mjd, fit.t_ref, trend=True)
+    phase = np.radians(fit.phase)
+    x = np.hstack([fit.mean[:, None], fit.trend[:, None],
+                   fit.amplitude * np.cos(phase), fit.amplitude * np.sin(phase)])
+    return x @ A.T
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Harmonic tidal analysis of the reflector heights in the result store.")
+    parser.add_argument("start", help="Start date (e.g., 2024-01-01)")
+    parser.add_argument("end", help="End date (e.g., 2025-01-01)")
+    parser.add_argument("--stations", nargs="+", default=None, help="Station IDs (default: all in registry)")
+    parser.add_argument("--registry", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "stations.json"))
+    parser.add_argument("--store", default=result_store.STORE_PATH, help="Reflector height store directory")
+    parser.add_argument("--constituents", nargs="+", default=DEFAULT_CONSTITUENTS)
+    parser.add_argument("--trend", action="store_true", help="Also fit a linear trend")
+    parser.add_argument("--provisional", action="store_true",
+                        help="Include the provisional near-real-time reflector heights (no refraction correction)")
+    args = parser.parse_args()
+
+    station_ids = [s.upper() for s in args.stations] if args.stations else list(src.load_station_registry(args.registry))
+    store = result_store.result_store(args.store)
+    series = {}
+    for station_id in station_ids:
+        rows = store.query(station_id, datetime.fromisoformat(args.start), datetime.fromisoformat(args.end),
+                           provisional=args.provisional)
+        if len(rows["mjd"]):
+            series[station_id] = (rows["mjd"], -rows["rh"])     # Water level rises as the reflector height drops
+    if not series:
+        parser.error("No reflector heights in the store for these stations and dates")
+
+    fit = fit_tides(series, args.constituents, trend=args.trend)
+    print("Station  " + "".join(f"{name:>14s}" for name in fit.constituents))
+    for i, station_id in enumerate(fit.station_ids):
+        print(f"{station_id:8s} " + "".join(f"{fit.amplitude[i, k]:7.3f} {fit.phase[i, k]:5.1f}°"
+                                           for k in range(len(fit.constituents)))
+              + f"   std {fit.residual_std[i]:.3f} m, n {fit.n_obs[i]}")
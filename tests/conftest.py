@@ -0,0 +1,7 @@
+import os
+import sys
+
+# The modules are flat scripts in src/, imported as in the station scripts
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+# No metrics file from the instrumented stages
+os.environ["GNSS_IR_METRICS"] = ""
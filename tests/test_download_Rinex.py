@@ -0,0 +1,140 @@
+import os
+import download_Rinex
+
+FILENAME = "KULL00GRL_R_20241400000_01D_15S_MO.crx.gz"
+
+
+class local_sftp:
+    """
+    SFTP stand-in serving a local directory, optionally failing after a number of bytes.
+    """
+    def __init__(self, root, fail_after=None):
+        self.root = root
+        self.fail_after = fail_after
+
+    def _path(self, remote_filepath):
+        return os.path.join(self.root, os.path.relpath(remote_filepath, download_Rinex.REMOTE_PATH))
+
+    def stat(self, remote_filepath):
+        return os.stat(self._path(remote_filepath))
+
+    def open(self, remote_filepath, mode):
+        return local_remote_file(self._path(remote_filepath), self.fail_after)
+
+
+class local_remote_file:
+    def __init__(self, path, fail_after):
+        self.file = open(path, 'rb')
+        self.fail_after = fail_after
+        self.prefetched = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.file.close()
+
+    def seek(self, offset):
+        self.file.seek(offset)
+
+    def prefetch(self, file_size):
+        self.prefetched = file_size
+
+    def read(self, size):
+        if self.fail_after is not None and self.file.tell() >= self.fail_after:
+            raise EOFError("connection lost")
+        if self.fail_after is not None:
+            size = min(size, self.fail_after - self.file.tell())
+        return self.file.read(size)
+
+
+class local_ssh:
+    def close(self):
+        pass
+
+
+def _remote(tmp_path, data):
+    remote_dir = tmp_path / "remote" / "2024"
+    remote_dir.mkdir(parents=True)
+    (remote_dir / FILENAME).write_bytes(data)
+    return remote_dir / FILENAME
+
+
+def _download(tmp_path, monkeypatch, sessions, **kwargs):
+    monkeypatch.setattr(download_Rinex, "REMOTE_PATH", str(tmp_path / "remote"))
+    local_dir = tmp_path / "local"
+    local_dir.mkdir(exist_ok=True)
+    sessions = iter(sessions)
+    return download_Rinex.download_files("KULL", 2024, [140], str(local_dir), n_workers=1, backoff=0.0,
+                                         connect=lambda: (local_ssh(), next(sessions)), **kwargs), local_dir
+
+
+def test_download_then_skip(tmp_path, monkeypatch):
+    data = os.urandom(3 * download_Rinex.CHUNK_SIZE + 17)
+    remote = _remote(tmp_path, data)
+    sftp = local_sftp(remote.parent.parent)
+
+    results, local_dir = _download(tmp_path, monkeypatch, [sftp])
+    assert results == {FILENAME: "downloaded"}
+    assert (local_dir / FILENAME).read_bytes() == data
+    assert int(os.path.getmtime(local_dir / FILENAME)) == int(os.path.getmtime(remote))
+    assert not os.path.exists(local_dir / (FILENAME + ".part.src"))
+
+    results, _ = _download(tmp_path, monkeypatch, [sftp])
+    assert results == {FILENAME: "skipped"}
+
+
+def test_retry_resumes_the_part_file(tmp_path, monkeypatch):
+    data = os.urandom(3 * download_Rinex.CHUNK_SIZE + 17)
+    remote = _remote(tmp_path, data)
+    broken = local_sftp(remote.parent.parent, fail_after=2 * download_Rinex.CHUNK_SIZE + 5)
+    working = local_sftp(remote.parent.parent)
+
+    results, local_dir = _download(tmp_path, monkeypatch, [broken, working], retries=1)
+    assert results == {FILENAME: "resumed"}
+    assert (local_dir / FILENAME).read_bytes() == data
+
+
+def test_retries_exhausted_keep_the_part_file(tmp_path, monkeypatch):
+    data = os.urandom(2 * download_Rinex.CHUNK_SIZE)
+    remote = _remote(tmp_path, data)
+    broken = local_sftp(remote.parent.parent, fail_after=download_Rinex.CHUNK_SIZE)
+
+    results, local_dir = _download(tmp_path, monkeypatch, [broken, broken], retries=1)
+    assert results[FILENAME].startswith("failed")
+    assert not os.path.exists(local_dir / FILENAME)
+    assert os.path.getsize(local_dir / (FILENAME + ".part")) == download_Rinex.CHUNK_SIZE
+
+
+def test_replaced_remote_file_restarts_the_transfer(tmp_path, monkeypatch):
+    old = os.urandom(2 * download_Rinex.CHUNK_SIZE)
+    remote = _remote(tmp_path, old)
+    broken = local_sftp(remote.parent.parent, fail_after=download_Rinex.CHUNK_SIZE)
+    results, local_dir = _download(tmp_path, monkeypatch, [broken], retries=0)
+    assert results[FILENAME].startswith("failed")
+
+    new = os.urandom(2 * download_Rinex.CHUNK_SIZE)
+    remote.write_bytes(new)
+    os.utime(remote, (os.path.getatime(remote), os.path.getmtime(remote) + 60))
+    results, _ = _download(tmp_path, monkeypatch, [local_sftp(remote.parent.parent)])
+    assert results == {FILENAME: "downloaded"}
+    assert (local_dir / FILENAME).read_bytes() == new
+
+
+def test_resume_prefetches_to_the_end_of_the_file(tmp_path, monkeypatch):
+    # Paramiko's prefetch(file_size) takes the end of the file, not the number of bytes left
+    monkeypatch.setattr(download_Rinex, "REMOTE_PATH", str(tmp_path / "remote"))
+    data = os.urandom(1000)
+    remote = _remote(tmp_path, data)
+    local = tmp_path / "local"
+    (tmp_path / "local.part").write_bytes(data[:600])
+    stat = os.stat(remote)
+    (tmp_path / "local.part.src").write_text(f"{stat.st_size} {int(stat.st_mtime)}\n")
+
+    opened = []
+    sftp = local_sftp(remote.parent.parent)
+    sftp_open = sftp.open
+    sftp.open = lambda path, mode: opened.append(sftp_open(path, mode)) or opened[-1]
+    assert download_Rinex.fetch_file(sftp, str(remote), str(local)) == "resumed"
+    assert opened[0].prefetched == len(data)
+    assert local.read_bytes() == data
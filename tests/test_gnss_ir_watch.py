@@ -0,0 +1,39 @@
+import os
+import gnss_ir_watch
+
+
+def test_polling_watcher_reports_a_replaced_file_again(tmp_path):
+    watcher = gnss_ir_watch._polling_watcher([str(tmp_path)], poll_interval=0.0, settle_time=0.0)
+    path = tmp_path / "KULL00GRL_R_20241400000_01D_15S_MO.crx.gz"
+    path.write_bytes(b"first")
+    assert watcher.completed(0) == []
+    assert watcher.completed(0) == [str(path)]
+    assert watcher.completed(0) == []
+
+    path.write_bytes(b"replaced")
+    os.utime(path, (os.path.getatime(path), os.path.getmtime(path) + 60))
+    assert watcher.completed(0) == []
+    assert watcher.completed(0) == [str(path)]
+    assert watcher.completed(0) == []
+
+
+def test_station_file_moves_daily_and_sub_daily_files(tmp_path):
+    registry = {"KULL": None, "NUK2": None}
+    for station_id in registry:
+        (tmp_path / station_id).mkdir()
+    queued = {}
+    names = ["KULL00GRL_R_20241400000_01D_15S_MO.crx.gz", "NUK200GRL_R_20241401300_01H_01S_MO.crx.gz",
+             "NUK200GRL_R_20241401315_15M_01S_MO.crx.gz", "NUK200GRL_R_20241401330_15M_01S_MO.crx.gz.part",
+             "QAAR00GRL_R_20241400000_01D_15S_MO.crx.gz"]
+    for name in names:
+        (tmp_path / name).write_bytes(b"")
+
+    found = [gnss_ir_watch._station_file(str(tmp_path / name), registry, str(tmp_path), queued) for name in names]
+    assert [f[:3] if f else None for f in found] == [
+        ("KULL", gnss_ir_watch.src.parse_rinex3_name(names[0])[1], 86400),
+        ("NUK2", gnss_ir_watch.src.parse_rinex3_name(names[1])[1], 3600),
+        ("NUK2", gnss_ir_watch.src.parse_rinex3_name(names[2])[1], 900), None, None]
+    assert found[1][3] == str(tmp_path / "NUK2" / names[1])
+    assert os.path.exists(found[1][3]) and not os.path.exists(tmp_path / names[1])
+    # Seen again by the scanner after the move
+    assert gnss_ir_watch._station_file(found[1][3], registry, str(tmp_path), queued) is None
@@ -0,0 +1,113 @@
+import os
+import gzip
+import shutil
+from datetime import datetime, timedelta
+import numpy as np
+import benchmark
+import orbit_cache
+import sp3
+import gnss_ir_watch
+
+
+def _write_orbit(directory, year, doy, compress=False):
+    # GBM orbit of a day in a local directory standing in for GFZ
+    directory.mkdir(parents=True, exist_ok=True)
+    path = str(directory / orbit_cache.gbm_names(year, doy)[0])
+    benchmark.write_sp3(path, datetime(year, 1, 1) + timedelta(days=doy - 1))
+    if compress:
+        with open(path, 'rb') as f_in, gzip.open(path + ".gz", 'wb') as f_out:
+            shutil.copyfileobj(f_in, f_out)
+        os.remove(path)
+    return path
+
+
+def test_fetch_from_a_local_source_and_parse_once(tmp_path, monkeypatch):
+    _write_orbit(tmp_path / "source" / "2024" / "sp3", 2024, 140)
+    _write_orbit(tmp_path / "source", 2024, 141, compress=True)
+    monkeypatch.chdir(tmp_path)
+    cache = orbit_cache.orbit_cache("orbits", source=str(tmp_path / "source"))
+    assert cache.orbits_path == str(tmp_path / "orbits")
+
+    for doy in (140, 141):
+        path = cache.fetch(2024, doy)
+        assert path == os.path.join(cache.sp3_dir(2024), orbit_cache.gbm_names(2024, doy)[0])
+        orbit = cache.load(path)
+        expected = sp3.read_sp3(path)
+        assert orbit.sats == expected.sats and orbit.t0 == expected.t0
+        np.testing.assert_array_equal(orbit.xyz, expected.xyz)
+
+    parsed = cache._parsed_file(cache.fetch(2024, 140))
+    mtime = os.path.getmtime(parsed)
+    cache.load(cache.fetch(2024, 140))
+    assert os.path.getmtime(parsed) == mtime
+    assert cache.fetch(2024, 142) is None
+
+
+def test_gfz_fetch_keeps_the_working_directory_and_environment(tmp_path, monkeypatch):
+    # Stand-in for gnssrefl: writes the orbit to $ORBITS/{yyyy}/sp3 from its working directory
+    script = tmp_path / "fetch.py"
+    script.write_text(
+        "import os, sys, shutil\n"
+        "import orbit_cache\n"
+        "year, doy = int(sys.argv[1]), int(sys.argv[2])\n"
+        "name = orbit_cache.gbm_names(year, doy)[0]\n"
+        f"shutil.copy(os.path.join({str(tmp_path / 'remote')!r}, name), name)\n"
+        "os.makedirs(os.path.join(os.environ['ORBITS'], str(year), 'sp3'), exist_ok=True)\n"
+        "shutil.move(name, os.path.join(os.environ['ORBITS'], str(year), 'sp3', name))\n")
+    monkeypatch.setattr(orbit_cache, "GFZ_FETCH", f"exec(open({str(script)!r}).read())")
+    monkeypatch.setenv("PYTHONPATH", os.path.dirname(orbit_cache.__file__))
+    monkeypatch.delenv("ORBITS", raising=False)
+    _write_orbit(tmp_path / "remote", 2024, 140)
+    monkeypatch.chdir(tmp_path)
+
+    cache = orbit_cache.orbit_cache("orbits", source="")
+    path = cache.fetch(2024, 140)
+    assert path == str(tmp_path / "orbits" / "2024" / "sp3" / orbit_cache.gbm_names(2024, 140)[0])
+    assert os.getcwd() == str(tmp_path) and "ORBITS" not in os.environ
+    assert not os.path.exists(tmp_path / orbit_cache.gbm_names(2024, 140)[0])
+
+
+def test_sp3_files_outside_the_cache_are_read_directly(tmp_path):
+    cache = orbit_cache.orbit_cache(str(tmp_path / "orbits"))
+    sp3_path = str(tmp_path / "work" / "SYN_2024141.sp3")
+    os.makedirs(os.path.dirname(sp3_path))
+    benchmark.write_sp3(sp3_path, datetime(2024, 5, 20))
+
+    orbit = cache.load(sp3_path)
+    np.testing.assert_array_equal(orbit.xyz, sp3.read_sp3(sp3_path).xyz)
+    assert not cache.owns(sp3_path) and not os.path.exists(tmp_path / "orbits")
+    assert os.listdir(tmp_path / "work") == ["SYN_2024141.sp3"]
+    assert cache.evict() == 0
+
+
+def test_evict_least_recently_used(tmp_path):
+    for doy in (140, 141, 142):
+        _write_orbit(tmp_path / "source", 2024, doy)
+    cache = orbit_cache.orbit_cache(str(tmp_path / "orbits"), source=str(tmp_path / "source"))
+    paths = [cache.fetch(2024, doy) for doy in (140, 141, 142)]
+    for age, path in zip((300, 200, 100), paths):
+        os.utime(path, (os.path.getmtime(path) - age, os.path.getmtime(path)))
+    cache.max_bytes = 2 * os.path.getsize(paths[0])
+
+    assert cache.evict(keep=[paths[0]]) > 0
+    assert [os.path.exists(path) for path in paths] == [True, False, True]
+
+
+def test_watch_prefetch_backs_off_failed_days(tmp_path, monkeypatch):
+    source = tmp_path / "source"
+    _write_orbit(source, 2024, 140)
+    monkeypatch.setattr(orbit_cache, "_cache", orbit_cache.orbit_cache(str(tmp_path / "orbits"), source=str(source)))
+
+    failed = {}
+    paths = gnss_ir_watch._prefetch_orbits([(2024, 140), (2024, 141)], failed, now=1000.0)
+    assert paths[(2024, 140)] is not None and paths[(2024, 141)] is None
+    assert failed == {(2024, 141): (1, 1000.0 + gnss_ir_watch.ORBIT_RETRY)}
+
+    # Not due yet: no attempt
+    assert gnss_ir_watch._prefetch_orbits([(2024, 141)], failed, now=1100.0) == {}
+    gnss_ir_watch._prefetch_orbits([(2024, 141)], failed, now=1700.0)
+    assert failed == {(2024, 141): (2, 1700.0 + 2 * gnss_ir_watch.ORBIT_RETRY)}
+
+    _write_orbit(source, 2024, 141)
+    assert gnss_ir_watch._prefetch_orbits([(2024, 141)], failed, now=3000.0)[(2024, 141)] is not None
+    assert failed == {}
@@ -0,0 +1,75 @@
+import numpy as np
+import reflector_height
+
+KULL = {"e1": 4, "e2": 10, "h1": 67, "h2": 83, "nr1": 67, "nr2": 83, "peak2noise": 2.7, "ampl": 6.0,
+        "frlist": "1", "azlist2": "0 20 285 360"}
+
+
+def synthetic_arc(rh, azim_start, azim_end, n_points=1200, e1=3.5, e2=10.5, sat=1, noise=0.0, seed=0):
+    """
+    SNR rows (N, 11) of one rising GPS L1 arc over a horizontal reflector at height rh.
+    """
+    elev = np.linspace(e1, e2, n_points)
+    azim = np.linspace(azim_start, azim_end, n_points) % 360
+    wavelength = reflector_height.SPEED_OF_LIGHT / reflector_height.FREQUENCIES[1][2]
+    sin_elev = np.sin(np.radians(elev))
+    direct = 10 ** ((35 + 15 * sin_elev) / 20)
+    snr = 20 * np.log10(np.abs(direct + 20 * np.cos(4 * np.pi * rh / wavelength * sin_elev)))
+    snr += np.random.default_rng(seed).normal(0, noise, n_points)
+    rows = np.zeros((n_points, 11))
+    rows[:, 0], rows[:, 1], rows[:, 2] = sat, elev, azim
+    rows[:, 3] = np.arange(n_points) * 2.0
+    rows[:, 4] = (e2 - e1) / (2.0 * n_points)
+    rows[:, 6] = snr
+    return rows
+
+
+def test_arc_crossing_north_keeps_its_azimuth():
+    snr = synthetic_arc(75.0, 350.0, 370.0)
+    arcs = reflector_height.extract_arcs(snr, 1, 4, 10, reflector_height.parse_azlist(KULL["azlist2"]))
+    assert len(arcs['sat']) == 1
+    assert min(arcs['azim'][0], 360 - arcs['azim'][0]) < 0.5
+
+    result = reflector_height.estimate_reflector_heights(snr, **KULL)
+    assert len(result) == 1
+    assert abs(result['rh'][0] - 75.0) < 0.05
+
+
+def test_arc_outside_the_azimuth_sectors_is_dropped():
+    snr = synthetic_arc(75.0, 170.0, 190.0)
+    assert len(reflector_height.estimate_reflector_heights(snr, **KULL)) == 0
+
+
+def _periodograms(snr, heights, **fast_options):
+    arcs = reflector_height.extract_arcs(snr, 1, 4, 10, [(0, 360)])
+    wavelength = reflector_height.SPEED_OF_LIGHT / reflector_height.FREQUENCIES[1][2]
+    x, y = reflector_height.detrend_arcs(arcs['elev'], arcs['snr'], arcs['mask'])
+    direct = reflector_height.lomb_scargle_batch(x, y, arcs['mask'], heights, wavelength)
+    fast = reflector_height.lomb_scargle_fast(x, y, arcs['mask'], heights, wavelength, **fast_options)
+    return direct, fast
+
+
+def _relative_error(direct, fast):
+    # Largest error of every arc, relative to the peak amplitude of the arc
+    return np.max(np.abs(fast - direct), axis=1) / np.max(direct, axis=1)
+
+
+def test_fast_periodogram_matches_direct_on_short_and_long_arcs():
+    heights = np.arange(67, 83 + 0.0025, 0.005)
+    for n_points in (25, 45, 70, 150, 600, 2000):
+        # Short arcs are heavily aliased at 67-83 m, where the fit amplifies the extirpolation error
+        snr = np.concatenate([synthetic_arc(68 + 2 * k, 10 * k, 10 * k + 5, n_points=n_points, sat=k + 1,
+                                            noise=1.0, seed=k) for k in range(8)])
+        direct, fast = _periodograms(snr, heights)
+        assert direct.shape == (8, len(heights))
+        assert np.max(_relative_error(direct, fast)) < 1e-4, n_points
+
+
+def test_fast_periodogram_gives_the_same_retrievals():
+    snr = np.concatenate([synthetic_arc(70 + k, 10 * k, 10 * k + 5, n_points=n_points, sat=k + 1, noise=2.0, seed=k)
+                          for k, n_points in enumerate((30, 60, 120, 400, 1200, 45, 90, 2000))])
+    direct = reflector_height.estimate_reflector_heights(snr, periodogram="direct", keep_rejected=True, **KULL)
+    fast = reflector_height.estimate_reflector_heights(snr, periodogram="fast", keep_rejected=True, **KULL)
+    assert np.array_equal(direct['ok'], fast['ok'])
+    assert np.allclose(direct['rh'], fast['rh'])
+    assert np.allclose(direct['amp'], fast['amp'], rtol=1e-4)
@@ -0,0 +1,69 @@
+import os
+import numpy as np
+import reflector_height
+import result_store
+import snr_cache
+
+
+def _estimates(seconds, rh=20.0):
+    table = np.zeros(len(seconds), dtype=reflector_height.RESULT_DTYPE)
+    table['seconds'], table['rh'], table['freq'], table['sat'] = seconds, rh, 1, 5
+    return table
+
+
+def _result_file(refl_code, year, doy, utc_hours, rh=20.5):
+    result_dir = refl_code / str(year) / "results" / "kull"
+    result_dir.mkdir(parents=True, exist_ok=True)
+    mjd = result_store.to_mjd(result_store.datetime(year, 1, 1)) + doy - 1 + np.asarray(utc_hours) / 24
+    with open(result_dir / f"{doy:03d}.txt", 'w') as f:
+        f.write("% year doy RH sat UTCtime Azim Amp eminO emaxO NumbOf freq rise EdotF PkNoise DelT MJD refr\n")
+        for hours, day_mjd in zip(utc_hours, mjd):
+            f.write(f"{year} {doy} {rh} 5 {hours} 100 10 4 10 200 1 1 0 3.1 30 {day_mjd} 1\n")
+
+
+def test_provisional_rows_are_tagged_and_replaced(tmp_path, monkeypatch):
+    monkeypatch.setenv("REFL_CODE", str(tmp_path))
+    store = result_store.result_store(str(tmp_path / "store"))
+    store.append("KULL", result_store.columns_from_estimates(_estimates([3600.0, 7200.0]), 2024, 140,
+                                                             provisional=True), replace_days=False)
+    rows = store.query("KULL")
+    assert list(rows["provisional"]) == [1, 1] and list(rows["refr"]) == [0, 0]
+    assert len(store.query("KULL", provisional=False)["mjd"]) == 0
+
+    _result_file(tmp_path, 2024, 140, [1.5, 2.5, 3.5])
+    assert store.ingest_results("KULL", 2024) == 1
+    rows = store.query("KULL")
+    assert list(rows["provisional"]) == [0, 0, 0] and list(rows["refr"]) == [1, 1, 1]
+
+
+def test_single_file_store_is_split_by_year(tmp_path):
+    # Store written before the partitioning (and before the provisional column): one file per station
+    store = result_store.result_store(str(tmp_path))
+    parts = [result_store.columns_from_estimates(_estimates([3600.0]), 2023, 365),
+             result_store.columns_from_estimates(_estimates([7200.0]), 2024, 1)]
+    columns = {name: np.concatenate([part[name] for part in parts]) for name in parts[0] if name != "provisional"}
+    legacy_path = os.path.join(str(tmp_path), "KULL" + result_store.STORE_SUFFIX)
+    snr_cache.write_columns(columns, legacy_path, {"sources": {"2023/365": 1.0, "2024/1": 2.0}})
+
+    assert list(store.query("KULL", provisional=False)["year"]) == [2023, 2024]
+    assert not os.path.exists(legacy_path)
+    assert store.years("KULL") == [2023, 2024]
+    assert store.load("KULL", 2024)[1]["sources"] == {"2024/1": 2.0}
+
+
+def test_append_rewrites_only_the_years_it_touches(tmp_path):
+    store = result_store.result_store(str(tmp_path))
+    for year, doy in [(2023, 200), (2024, 100)]:
+        store.append("KULL", result_store.columns_from_estimates(_estimates([3600.0, 7200.0]), year, doy))
+    mtime_2023 = os.path.getmtime(store.path("KULL", 2023))
+    os.utime(store.path("KULL", 2023), (mtime_2023 - 60, mtime_2023 - 60))
+
+    store.append("KULL", result_store.columns_from_estimates(_estimates([1800.0], rh=21.0), 2024, 100))
+    assert os.path.getmtime(store.path("KULL", 2023)) == mtime_2023 - 60
+    assert list(store.query("KULL")["rh"]) == [20.0, 20.0, 21.0]
+
+    start = result_store.datetime(2024, 1, 1)
+    rows = store.query("KULL", start=start)
+    assert list(rows["year"]) == [2024] and rows["mjd"][0] >= result_store.to_mjd(start)
+    rows = store.query("KULL", end=start)
+    assert list(rows["year"]) == [2023, 2023]
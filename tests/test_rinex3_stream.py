@@ -0,0 +1,22 @@
+from datetime import datetime
+import numpy as np
+import gnss_ir_util as src
+import benchmark
+import rinex3_stream
+
+
+def test_crinex_decodes_to_the_plain_rinex3_records(tmp_path):
+    station = src.load_station_registry(benchmark.REGISTRY_PATH)["KULL"]
+    rnx_path, crx_path = str(tmp_path / "day.rnx.gz"), str(tmp_path / "day.crx.gz")
+    benchmark.write_rinex3(rnx_path, station, datetime(2024, 5, 20), 300, 70.0, np.random.default_rng(0))
+    benchmark.write_crinex(rnx_path, crx_path)
+
+    with rinex3_stream.open_rinex(crx_path) as rinex_file:
+        assert rinex3_stream.read_header(rinex_file).crinex
+    plain = list(rinex3_stream.iter_epochs(rnx_path))
+    compact = list(rinex3_stream.iter_epochs(crx_path))
+    assert len(compact) == len(plain) == 288
+    for (_, a), (_, b) in zip(plain, compact):
+        assert a.time == b.time and list(a.obs) == list(b.obs)
+        for sat in a.obs:
+            np.testing.assert_array_equal(a.obs[sat], b.obs[sat])
@@ -0,0 +1,100 @@
+import os
+import gzip
+import dataclasses
+from datetime import datetime
+import numpy as np
+import gnss_ir_util as src
+import benchmark
+import orbit_cache
+import rinex3_snr
+import rolling_window
+
+DAYS = [datetime(2024, 5, 19), datetime(2024, 5, 20)]
+
+
+def _station():
+    station = src.load_station_registry(benchmark.REGISTRY_PATH)["NUK2"]
+    return dataclasses.replace(station, samplerate=60)
+
+
+def _split(path):
+    lines = gzip.open(path, 'rt').read().splitlines()
+    end = next(i for i, line in enumerate(lines) if "END OF HEADER" in line) + 1
+    epochs, epoch = [], None
+    for line in lines[end:]:
+        if line.startswith(">"):
+            epoch = [line]
+            epochs.append(epoch)
+        else:
+            epoch.append(line)
+    return lines[:end], epochs
+
+
+def _split_day(tmp_path, station):
+    day_file = str(tmp_path / "day.rnx.gz")
+    benchmark.write_rinex3(day_file, station, DAYS[0], 60, 22.0, np.random.default_rng(0))
+    return _split(day_file)
+
+
+def test_file_across_midnight_takes_the_orbit_of_each_day(tmp_path, monkeypatch):
+    station = _station()
+    source = tmp_path / "source"
+    source.mkdir()
+    day_files = []
+    for day in DAYS:
+        day_file = str(tmp_path / f"{day:%j}.rnx.gz")
+        benchmark.write_rinex3(day_file, station, day, 60, 22.0, np.random.default_rng(0))
+        benchmark.write_sp3(str(source / orbit_cache.gbm_names(day.year, day.timetuple().tm_yday)[0]), day, margin=0)
+        day_files.append(day_file)
+    cache = orbit_cache.orbit_cache(str(tmp_path / "orbits"), source=str(source))
+    monkeypatch.setattr(orbit_cache, "_cache", cache)
+
+    # Hourly file from 23:30 to 00:30
+    header, first = _split(day_files[0])
+    _, second = _split(day_files[1])
+    rinex_path = str(tmp_path / "NUK200GRL_R_20241402330_01H_01M_MO.rnx.gz")
+    with gzip.open(rinex_path, 'wt') as f:
+        f.write("\n".join(header + sum(first[-30:] + second[:30], [])) + "\n")
+
+    window = rolling_window.snr_window(station, str(tmp_path / "window"))
+    window.add_files([rinex_path])
+    columns, metadata = window.load()
+    assert list(metadata["files"]) == [os.path.basename(rinex_path)]
+    # Both days were taken from the orbit cache
+    assert cache._find(2024, 140) is not None and cache._find(2024, 141) is not None
+
+    expected = []
+    for day, day_file in zip(DAYS, day_files):
+        sp3_path = cache.fetch(day.year, day.timetuple().tm_yday)
+        assert sp3_path is not None
+        day_start, table = rinex3_snr.snr_table(day_file, sp3_path, station.lat, station.lon, station.height,
+                                                station.samplerate, station.rinex2snr_snr)
+        table[:, 3] += (day_start - rolling_window.UNIX_EPOCH).total_seconds()
+        expected.append(table)
+    expected = np.concatenate(expected)
+    start = (datetime(2024, 5, 19, 23, 30) - rolling_window.UNIX_EPOCH).total_seconds()
+    expected = expected[(expected[:, 3] >= start) & (expected[:, 3] < start + 3600)]
+
+    assert len(columns["seconds"]) == len(expected)
+    np.testing.assert_allclose(np.asarray(columns["seconds"]), np.sort(expected[:, 3]))
+    order = np.lexsort((expected[:, 0], expected[:, 3]))
+    np.testing.assert_allclose(np.asarray(columns["elev"]), expected[order, 1], atol=1e-3)
+
+
+def test_file_without_orbit_is_added_later(tmp_path, monkeypatch):
+    station = _station()
+    rinex_path = str(tmp_path / "NUK200GRL_R_20241400000_01H_01M_MO.rnx.gz")
+    header, epochs = _split_day(tmp_path, station)
+    with gzip.open(rinex_path, 'wt') as f:
+        f.write("\n".join(header + sum(epochs[:60], [])) + "\n")
+    empty = tmp_path / "empty"
+    empty.mkdir()
+    monkeypatch.setattr(orbit_cache, "_cache", orbit_cache.orbit_cache(str(tmp_path / "orbits"), source=str(empty)))
+
+    window = rolling_window.snr_window(station, str(tmp_path / "window"))
+    assert window.add_files([rinex_path]) == 0
+    assert window.load()[1]["files"] == {}
+
+    benchmark.write_sp3(str(empty / orbit_cache.gbm_names(2024, 140)[0]), DAYS[0])
+    assert window.add_files([rinex_path]) > 0
+
@@ -0,0 +1,33 @@
+import os
+import numpy as np
+import snr_cache
+
+
+def _snr_file(tmp_path, n_rows=50, seed=0):
+    rng = np.random.default_rng(seed)
+    snr = np.column_stack([rng.integers(1, 33, n_rows), rng.uniform(5, 30, n_rows), rng.uniform(0, 360, n_rows),
+                           np.arange(n_rows) * 15.0, rng.normal(0, 1e-3, n_rows), np.zeros(n_rows),
+                           rng.uniform(30, 50, n_rows), rng.uniform(30, 50, n_rows), np.zeros((n_rows, 3))])
+    path = str(tmp_path / "kull1400.24.snr66")
+    np.savetxt(path, snr, fmt="%.4f")
+    return path, snr
+
+
+def test_load_snr_builds_and_reads_the_cache(tmp_path):
+    path, snr = _snr_file(tmp_path)
+    np.testing.assert_allclose(snr_cache.load_snr(path), snr, rtol=1e-6, atol=1e-4)
+    assert snr_cache.is_columnar(snr_cache.cache_path(path))
+
+    os.remove(path)
+    np.testing.assert_allclose(snr_cache.load_snr(path), snr, rtol=1e-6, atol=1e-4)
+
+
+def test_cache_of_an_older_format_is_rebuilt(tmp_path):
+    path, snr = _snr_file(tmp_path)
+    cache = snr_cache.cache_path(path)
+    with open(cache, 'wb') as f:
+        f.write(b"GNSSIRSNR1\n" + bytes(200))
+    os.utime(cache, (os.path.getmtime(path) + 60,) * 2)
+
+    np.testing.assert_allclose(snr_cache.load_snr(path), snr, rtol=1e-6, atol=1e-4)
+    assert snr_cache.is_columnar(cache)